@@ -0,0 +1,129 @@
+"""
+Контекст из базы знаний для промпта вопроса (handle_knowledge).
+
+ContextAssembler копит записи предвыборки и раундов поиска: одна сущность (type, id) попадает
+в контекст один раз, записи упорядочены по релевантности вопросу (и запросу, которым найдены),
+и в реплику раунда идёт только то, что помещается в бюджет токенов. Каждый раунд получает только
+новые записи (предыдущие уже есть в истории диалога), так что реплика не растёт с числом раундов.
+
+Токены оцениваются локально, без токенизатора модели: слово режется на куски по 4 символа
+(примерно как BPE-токены русского текста), знак препинания — отдельный токен.
+"""
+import re
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]", re.UNICODE)
+
+NO_DATA = "Пока нет данных из поиска."
+NOTHING_NEW = "Поиск не нашёл ничего нового."
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text or ""))
+
+
+def words(text: str) -> list[str]:
+    return _WORD_RE.findall((text or "").lower())
+
+
+def stem(word: str) -> str:
+    """Грубая основа слова: без окончания («Ивана» — «иван», «таверне» — «тавер»)."""
+    return word[:max(len(word) - 2, 4)]
+
+
+def _overlap(stems: set[str], text: str) -> int:
+    """Сколько основ из stems встречается среди слов text."""
+    found = set()
+    for w in words(text):
+        for s in stems:
+            if w.startswith(s):
+                found.add(s)
+    return len(found)
+
+
+class ContextAssembler:
+    """Записи контекста с дедупликацией по (type, id) и отбором по бюджету токенов."""
+
+    def __init__(self, question: str, budget_tokens: int) -> None:
+        self._question_stems = {stem(w) for w in words(question) if len(w) >= 3}
+        self._budget = budget_tokens
+        self._entries: dict[tuple, tuple[float, int, str]] = {}  # key -> (score, порядок, текст)
+        self._covered: set[tuple] = set()
+        self._added = 0
+        self._searches: list[tuple[str, bool]] = []  # (запрос, нашёл ли новое) с последней сборки
+        self._rendered = False
+        self.dropped = 0  # записей, не поместившихся в бюджет при последней сборке
+
+    def _score(self, name: str, text: str, query: str | None, rank: int) -> float:
+        score = 2 * _overlap(self._question_stems, name) + _overlap(self._question_stems, text)
+        if query:
+            score += _overlap({stem(w) for w in words(query) if len(w) >= 3}, f"{name} {text}")
+        return score - rank * 0.01
+
+    def _add(self, key: tuple, score: float, text: str) -> bool:
+        if key in self._covered:
+            return False
+        self._covered.add(key)
+        self._added += 1
+        self._entries[key] = (score, self._added, text)
+        return True
+
+    def add_retrieved(self, records: list[dict]) -> int:
+        """Предвыборка: сущность со сценами — одна запись. Возвращает число новых записей."""
+        added = 0
+        for rank, r in enumerate(records):
+            lines = [f"[{r.get('type', '')}] {r.get('name', '')}: {(r.get('description') or '')[:200]}"]
+            for scene in r.get("scenes") or []:
+                where = f"локация: {scene['location']}" if scene.get("location") else "локация не указана"
+                who = ", ".join(scene.get("characters") or []) or "—"
+                lines.append(
+                    f"  сцена «{scene.get('title') or ''}» ({where}; персонажи: {who}): "
+                    f"{(scene.get('description') or '')[:150]}"
+                )
+            # Найдено по самому вопросу — выше результатов поиска с той же релевантностью
+            score = self._score(r.get("name") or "", "\n".join(lines), None, rank) + 1
+            if self._add((r.get("type"), r.get("id")), score, "\n".join(lines)):
+                added += 1
+                self._covered.update(("Scene", scene.get("id")) for scene in r.get("scenes") or [])
+        return added
+
+    def add_search(self, query: str, records: list[dict]) -> int:
+        """Результаты поиска по query. Возвращает число новых (ещё не бывших в контексте) сущностей."""
+        added = 0
+        for rank, r in enumerate(records):
+            name = r.get("name", "")
+            snippet = (r.get("snippet") or "")[:200]
+            text = f"[{r.get('type', '')}] {name}: {snippet}"
+            if self._add((r.get("type"), r.get("id")), self._score(name, snippet, query, rank), text):
+                added += 1
+        self._searches.append((query, added > 0))
+        return added
+
+    def render(self) -> str:
+        """
+        Новые с прошлой сборки записи, самые релевантные в пределах бюджета; выполненные поиски — строкой
+        в конце. Не поместившиеся записи остаются на следующие раунды.
+        """
+        footer = []
+        if self._searches:
+            footer.append("Выполненные поиски: " + ", ".join(f"«{q}»" for q, _ in self._searches) + ".")
+            empty = [q for q, found in self._searches if not found]
+            if empty:
+                footer.append("Ничего нового не нашли: " + ", ".join(f"«{q}»" for q in empty) + ".")
+        used = sum(estimate_tokens(line) for line in footer)
+        chosen = []
+        self.dropped = 0
+        for key, (score, order, text) in sorted(self._entries.items(), key=lambda e: (-e[1][0], e[1][1])):
+            cost = estimate_tokens(text)
+            if used + cost > self._budget:
+                self.dropped += 1
+                continue
+            used += cost
+            chosen.append(text)
+            del self._entries[key]
+        if self.dropped:
+            footer.append(f"(ещё {self.dropped} записей не поместились в контекст)")
+        self._searches = []
+        empty_text = NOTHING_NEW if self._rendered else NO_DATA
+        self._rendered = True
+        return "\n".join(chosen + footer) or empty_text
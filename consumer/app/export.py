@@ -0,0 +1,411 @@
+"""
+Экспорт событий графа в export_dir (для Git и для восстановления графа — app/replay.py).
+
+Обработчики только ставят строки в ограниченную очередь (write); фоновый поток ExportWriter пишет
+их группами — одна запись в файл на всё, что накопилось, — и делает fsync по политике export_fsync:
+always — после каждой группы, interval — не чаще export_fsync_interval_ms, never — на усмотрение ОС
+(при ротации и закрытии — всегда). Очередь заполнена — обработчик ждёт (backpressure). Ошибки диска
+не останавливают поток записи: незаписанные события считаются в export_write_failures_total, ротация и
+сжатие повторяются позже; если поток всё же остановлен, write и flush не ждут его.
+
+Файлы:
+- events-000001.jsonl — текущий сегмент; новый начинается по размеру (export_segment_max_mb) или
+  возрасту (export_segment_max_age_sec), закрытый сжимается в events-000001.jsonl.gz (export_compress);
+- index.json — {"segments": [{"segment", "file", "first_offset", "events", "bytes", "created_at",
+  "closed_at"}]}; offset — номер события во всём журнале (с 0), find_segment(index, offset) находит
+  сегмент без чтения файлов. У открытого сегмента (closed_at = null) events/bytes в индексе могут
+  отставать — при запуске они пересчитываются по файлу.
+"""
+import atexit
+import bisect
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from app.config import settings
+from app.metrics import (
+    export_commit_events,
+    export_events_written_total,
+    export_queue_depth,
+    export_write_failures_total,
+)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "events-"
+INDEX_FILE = "index.json"
+IDLE_SEC = 1.0  # ожидание очереди потоком записи и шаг проверки, жив ли он, в write/flush
+COMPRESS_RETRY_SEC = 60.0
+_STOP = object()
+
+
+def segment_file(segment: int, compressed: bool = False) -> str:
+    return f"{SEGMENT_PREFIX}{segment:06d}.jsonl" + (".gz" if compressed else "")
+
+
+def load_index(directory: str | Path) -> dict:
+    path = Path(directory) / INDEX_FILE
+    if not path.exists():
+        return {"segments": []}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def find_segment(index: dict, offset: int) -> dict | None:
+    """Сегмент, в котором лежит событие с номером offset (None — такого ещё нет)."""
+    segments = index.get("segments") or []
+    starts = [s["first_offset"] for s in segments]
+    i = bisect.bisect_right(starts, offset) - 1
+    if i < 0:
+        return None
+    segment = segments[i]
+    if segment.get("closed_at") is not None and offset >= segment["first_offset"] + segment["events"]:
+        return None
+    return segment
+
+
+class ExportWriter:
+    """Фоновый писатель сегментов одного каталога. write — из любых потоков."""
+
+    def __init__(
+        self,
+        directory: str | Path,
+        queue_size: int = 10000,
+        segment_max_bytes: int = 64 * 1024 * 1024,
+        segment_max_age_sec: float = 3600.0,
+        fsync: str = "interval",
+        fsync_interval_sec: float = 1.0,
+        compress: bool = True,
+        batch_max_lines: int = 1000,
+    ) -> None:
+        self.directory = Path(directory)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+        self._segment_max_bytes = segment_max_bytes
+        self._segment_max_age_sec = segment_max_age_sec
+        self._fsync = fsync
+        self._fsync_interval_sec = fsync_interval_sec
+        self._compress = compress
+        self._batch_max_lines = batch_max_lines
+        self._file = None
+        self._last_fsync = 0.0
+        self._compress_retry_at = 0.0  # закрытые несжатые сегменты (например, после сбоя) — сжать в простое
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index = load_index(self.directory)
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="export-writer", daemon=True)
+        self._thread.start()
+
+    # --- API ---
+
+    def write(self, lines: list[str]) -> None:
+        """
+        Поставить строки (с \\n на конце) в очередь; порядок строк сохраняется. Очередь полна — ждёт,
+        пока поток записи жив; если он остановлен, строки не ставятся и считаются в export_write_failures_total.
+        """
+        if not lines:
+            return
+        while True:
+            if not self._thread.is_alive():
+                logger.error("Export writer for %s is stopped, %d events not exported", self.directory, len(lines))
+                export_write_failures_total.inc(len(lines))
+                return
+            try:
+                self._queue.put(lines, timeout=IDLE_SEC)
+            except queue.Full:
+                continue
+            export_queue_depth.inc()
+            return
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Дождаться записи всего, что уже в очереди. False — не успели за timeout или поток записи
+        остановлен. Неудачная запись (диск полон, EIO) flush не блокирует: она в логе и в
+        export_write_failures_total.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = threading.Event()
+        queued = False
+        while self._thread.is_alive():
+            remaining = IDLE_SEC if deadline is None else min(IDLE_SEC, deadline - time.monotonic())
+            if remaining <= 0:
+                break
+            if not queued:
+                try:
+                    self._queue.put(done, timeout=remaining)
+                    queued = True
+                except queue.Full:
+                    pass
+            elif done.wait(remaining):
+                return True
+        return done.is_set()
+
+    def close(self) -> None:
+        """Записать очередь, fsync, обновить индекс и остановить поток."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._drop_queued()
+
+    # --- Поток записи ---
+
+    def _run(self) -> None:
+        """Ошибки записи, fsync, ротации (диск полон, EIO) логируются — поток не останавливается до close."""
+        while True:
+            try:
+                if self._step():
+                    return
+            except Exception as e:
+                logger.exception("Export writer error: %s", e)
+
+    def _step(self) -> bool:
+        """Одна группа из очереди или обслуживание в простое. True — получен стоп, поток завершён."""
+        try:
+            item = self._queue.get(timeout=IDLE_SEC)
+        except queue.Empty:
+            self._maybe_rotate()
+            self._maybe_compress()
+            self._maybe_fsync(force=False)
+            return False
+        items = [item]
+        lines = len(item) if isinstance(item, list) else 0
+        while lines < self._batch_max_lines:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            if isinstance(item, list):
+                lines += len(item)
+        try:
+            self._commit(items)
+        except Exception as e:
+            logger.exception("Export write failed: %s", e)
+        if any(item is _STOP for item in items):
+            self._finish()
+            return True
+        return False
+
+    def _commit(self, items: list) -> None:
+        """
+        Группа: строки до каждого маркера flush пишутся и синхронизируются раньше, чем маркер срабатывает.
+        При ошибке записи маркеры всё равно срабатывают, а незаписанные события считаются в
+        export_write_failures_total.
+        """
+        batches = [item for item in items if isinstance(item, list)]
+        export_queue_depth.dec(len(batches))
+        total = sum(len(batch) for batch in batches)
+        written = 0
+        pending: list[str] = []
+        try:
+            for item in items:
+                if isinstance(item, list):
+                    pending.extend(item)
+                    continue
+                self._write_lines(pending)
+                written += len(pending)
+                pending = []
+                if isinstance(item, threading.Event):
+                    self._maybe_fsync(force=True)
+                    item.set()
+            self._write_lines(pending)
+            written += len(pending)
+        except Exception:
+            export_write_failures_total.inc(total - written)
+            raise
+        finally:
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write_lines(self, lines: list[str]) -> None:
+        if not lines:
+            return
+        data = "".join(lines).encode("utf-8")
+        self._file.write(data)
+        self._file.flush()
+        segment = self._index["segments"][-1]
+        segment["events"] += len(lines)
+        segment["bytes"] += len(data)
+        export_commit_events.observe(len(lines))
+        export_events_written_total.inc(len(lines))
+        self._maybe_fsync(force=self._fsync == "always")
+        self._maybe_rotate()
+
+    def _maybe_fsync(self, force: bool) -> None:
+        if self._file is None or (self._fsync == "never" and not force):
+            return
+        now = time.monotonic()
+        if force or now - self._last_fsync >= self._fsync_interval_sec:
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def _finish(self) -> None:
+        try:
+            os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+            self._file = None
+            self._save_index()
+
+    def _drop_queued(self) -> None:
+        """Поток записи остановлен: то, что осталось в очереди, уже не запишется."""
+        dropped = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, list):
+                export_queue_depth.dec()
+                dropped += len(item)
+            elif isinstance(item, threading.Event):
+                item.set()
+        if dropped:
+            logger.error("Export writer for %s stopped with %d events queued", self.directory, dropped)
+            export_write_failures_total.inc(dropped)
+
+    # --- Сегменты и индекс ---
+
+    def _open_segment(self) -> None:
+        """При запуске: продолжить открытый сегмент из индекса (с пересчётом по файлу) или начать следующий."""
+        segments = self._index["segments"]
+        if segments and segments[-1].get("closed_at") is None:
+            segment = segments[-1]
+            path = self.directory / segment["file"]
+            if path.exists():
+                data = path.read_bytes()
+                if data and not data.endswith(b"\n"):
+                    # Оборванная при сбое строка: новые события — с новой строки
+                    with path.open("ab") as f:
+                        f.write(b"\n")
+                    data += b"\n"
+                segment["events"] = data.count(b"\n")
+                segment["bytes"] = len(data)
+            else:
+                segment["events"] = segment["bytes"] = 0
+        else:
+            segment = self._next_segment()
+            segments.append(segment)
+        self._file = (self.directory / segment["file"]).open("ab")
+        self._save_index()
+
+    def _next_segment(self) -> dict:
+        segments = self._index["segments"]
+        number = segments[-1]["segment"] + 1 if segments else 1
+        return {
+            "segment": number,
+            "file": segment_file(number),
+            "first_offset": segments[-1]["first_offset"] + segments[-1]["events"] if segments else 0,
+            "events": 0,
+            "bytes": 0,
+            "created_at": time.time(),
+            "closed_at": None,
+        }
+
+    def _maybe_rotate(self) -> None:
+        """
+        Закрыть сегмент по размеру или возрасту и писать в следующий. Следующий открывается раньше, чем
+        закрывается текущий: при ошибке (диск полон, EIO) запись продолжается в текущий, ротация
+        повторится при следующей записи или в простое. Сжатие — отдельный шаг (_maybe_compress).
+        """
+        segment = self._index["segments"][-1]
+        if segment["events"] == 0:
+            return
+        too_big = segment["bytes"] >= self._segment_max_bytes
+        too_old = time.time() - segment["created_at"] >= self._segment_max_age_sec
+        if not (too_big or too_old):
+            return
+        try:
+            os.fsync(self._file.fileno())
+            following = self._next_segment()
+            file = (self.directory / following["file"]).open("ab")
+        except OSError as e:
+            logger.error("Export segment %s rotation failed, will retry: %s", segment["file"], e)
+            return
+        previous, self._file = self._file, file
+        segment["closed_at"] = time.time()
+        self._index["segments"].append(following)
+        self._compress_retry_at = 0.0
+        try:
+            previous.close()
+            self._save_index()
+        except OSError as e:
+            # Индекс в памяти верен и будет сохранён при следующей ротации или закрытии
+            logger.error("Export index update after rotation failed: %s", e)
+        self._maybe_compress()
+
+    def _maybe_compress(self) -> None:
+        """
+        Сжать закрытые, ещё не сжатые сегменты (export_compress). Ошибка не трогает запись: сегмент
+        остаётся несжатым (и читается replay как есть), повтор — не раньше чем через COMPRESS_RETRY_SEC.
+        """
+        if not self._compress or time.monotonic() < self._compress_retry_at:
+            return
+        for segment in self._index["segments"]:
+            if segment.get("closed_at") is None or segment["file"].endswith(".gz"):
+                continue
+            source = self.directory / segment["file"]
+            target = self.directory / segment_file(segment["segment"], compressed=True)
+            tmp = target.with_name(target.name + ".tmp")
+            try:
+                with source.open("rb") as src, gzip.open(tmp, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp, target)
+                segment["file"] = target.name
+                self._save_index()
+                source.unlink()
+            except OSError as e:
+                logger.error("Export segment %s compression failed, will retry: %s", source.name, e)
+                self._compress_retry_at = time.monotonic() + COMPRESS_RETRY_SEC
+                return
+        self._compress_retry_at = float("inf")
+
+    def _save_index(self) -> None:
+        """Атомарно: временный файл + rename."""
+        path = self.directory / INDEX_FILE
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(self._index, indent=1), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+_writers: dict[str, ExportWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_export_writer(directory: str) -> ExportWriter:
+    """Писатель каталога (создаётся при первом вызове, закрывается при выходе процесса)."""
+    key = str(Path(directory).resolve())
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            if not _writers:
+                atexit.register(close_exports)
+            writer = _writers[key] = ExportWriter(
+                directory,
+                queue_size=settings.export_queue_size,
+                segment_max_bytes=int(settings.export_segment_max_mb * 1024 * 1024),
+                segment_max_age_sec=settings.export_segment_max_age_sec,
+                fsync=settings.export_fsync,
+                fsync_interval_sec=settings.export_fsync_interval_ms / 1000,
+                compress=settings.export_compress,
+            )
+        return writer
+
+
+def flush_exports(timeout: float | None = None) -> None:
+    """Дождаться записи всех очередей экспорта (тесты, остановка)."""
+    for writer in list(_writers.values()):
+        writer.flush(timeout)
+
+
+def close_exports() -> None:
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -1,11 +1,37 @@
 """Neo4j write operations (consumer)."""
+import logging
 import uuid
+from collections.abc import Callable
 from typing import Any
 
 from neo4j import GraphDatabase
+from neo4j.exceptions import Neo4jError
+
+from shared.changes import BUMP_GRAPH_VERSION_QUERY, GRAPH_VERSION_ID
+from shared.role_context import (
+    CHARACTER_CONTEXT_QUERY,
+    NARRATOR_CONTEXT_QUERY,
+    NARRATOR_ROLE,
+    WRITE_ROLE_CONTEXTS_QUERY,
+    character_context_params,
+    format_character_context,
+    format_narrator_context,
+    missing_character_context,
+    narrator_context_params,
+    role_key,
+)
+from shared.search import (
+    FULLTEXT_INDEX,
+    FULLTEXT_SEARCH_QUERY,
+    REGEX_SEARCH_QUERY,
+    build_fulltext_any_query,
+    search_params,
+)
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 _driver = None
 
 
@@ -28,6 +54,19 @@ def run_write(query: str, parameters: dict[str, Any] | None = None) -> None:
         session.run(query, parameters)
 
 
+def write_in_transaction(work: Callable[[Any], Any]) -> Any:
+    """Run work(tx) in one explicit write transaction (retried by the driver on transient errors)."""
+    driver = get_driver()
+    with driver.session() as session:
+        return session.execute_write(work)
+
+
+def bump_graph_version(tx) -> int:
+    """Increment the graph version (see shared/changes.py) inside tx. Returns the new version."""
+    record = tx.run(BUMP_GRAPH_VERSION_QUERY, {"id": GRAPH_VERSION_ID}).single()
+    return record["version"]
+
+
 def run_read(query: str, parameters: dict[str, Any] | None = None) -> list[dict[str, Any]]:
     """Execute read Cypher. Returns list of records (dict per row)."""
     driver = get_driver()
@@ -37,6 +76,11 @@ def run_read(query: str, parameters: dict[str, Any] | None = None) -> list[dict[
         return [dict(record) for record in result]
 
 
+def normalize_key(value: str | None) -> str:
+    """name_norm / title_norm: same normalisation as server uniqueness checks (strip + lower)."""
+    return (value or "").strip().lower()
+
+
 def ensure_id(payload: dict) -> str:
     """Ensure payload has id; generate if missing."""
     if "id" in payload and payload["id"]:
@@ -52,27 +96,40 @@ class NameNodeWriter:
 
     label: str = ""
 
-    def create(self, payload: dict) -> str:
-        uid = ensure_id(payload)
-        run_write(
-            f"MERGE (n:{self.label} {{id: $id}}) SET n.name = $name, n.description = $description",
-            {"id": uid, "name": payload.get("name", ""), "description": payload.get("description", "")},
+    def create_many(self, tx, payloads: list[dict]) -> list[str]:
+        """Batch create: one UNWIND statement inside the caller's transaction."""
+        rows = [
+            {
+                "id": ensure_id(p),
+                "name": p.get("name", ""),
+                "name_norm": normalize_key(p.get("name", "")),
+                "description": p.get("description", ""),
+            }
+            for p in payloads
+        ]
+        tx.run(
+            f"UNWIND $rows AS row "
+            f"MERGE (n:{self.label} {{id: row.id}}) "
+            f"SET n.name = row.name, n.name_norm = row.name_norm, n.description = row.description",
+            {"rows": rows},
         )
-        return uid
-
-    def update(self, payload: dict) -> str:
-        uid = payload["id"]
-        updates = []
-        params = {"id": uid}
-        if "name" in payload:
-            updates.append("n.name = $name")
-            params["name"] = payload["name"]
-        if "description" in payload:
-            updates.append("n.description = $description")
-            params["description"] = payload["description"]
-        if updates:
-            run_write(f"MATCH (n:{self.label} {{id: $id}}) SET {', '.join(updates)}", params)
-        return uid
+        return [r["id"] for r in rows]
+
+    def update_many(self, tx, payloads: list[dict]) -> list[str]:
+        """Batch update of the passed fields: one UNWIND statement inside the caller's transaction."""
+        rows = []
+        for p in payloads:
+            props = {k: p[k] for k in ("name", "description") if k in p}
+            if "name" in props:
+                props["name_norm"] = normalize_key(props["name"])
+            if props:
+                rows.append({"id": p["id"], "props": props})
+        if rows:
+            tx.run(
+                f"UNWIND $rows AS row MATCH (n:{self.label} {{id: row.id}}) SET n += row.props",
+                {"rows": rows},
+            )
+        return [p["id"] for p in payloads]
 
 
 class LocationWriter(NameNodeWriter):
@@ -92,122 +149,248 @@ _character_writer = CharacterWriter()
 _concept_writer = ConceptWriter()
 
 
-def create_location(payload: dict) -> str:
-    return _location_writer.create(payload)
+def create_locations(tx, payloads: list[dict]) -> list[str]:
+    return _location_writer.create_many(tx, payloads)
 
 
-def update_location(payload: dict) -> str:
-    return _location_writer.update(payload)
+def update_locations(tx, payloads: list[dict]) -> list[str]:
+    return _location_writer.update_many(tx, payloads)
 
 
-def create_character(payload: dict) -> str:
-    return _character_writer.create(payload)
+def create_characters(tx, payloads: list[dict]) -> list[str]:
+    return _character_writer.create_many(tx, payloads)
 
 
-def update_character(payload: dict) -> str:
-    return _character_writer.update(payload)
+def update_characters(tx, payloads: list[dict]) -> list[str]:
+    return _character_writer.update_many(tx, payloads)
 
 
-def create_concept(payload: dict) -> str:
-    return _concept_writer.create(payload)
+def create_concepts(tx, payloads: list[dict]) -> list[str]:
+    return _concept_writer.create_many(tx, payloads)
 
 
-def update_concept(payload: dict) -> str:
-    return _concept_writer.update(payload)
+def update_concepts(tx, payloads: list[dict]) -> list[str]:
+    return _concept_writer.update_many(tx, payloads)
 
 
-# --- Scene (custom logic: relationships) ---
+def search_graph(q: str, limit: int = 50) -> list[dict[str, Any]]:
+    """
+    Поиск по графу (локации, персонажи, сцены, понятия). Как в server search API: full-text, а если индекса
+    нет или он ничего не нашёл — regex.
+    """
+    params = search_params(q, None, limit, 0)
+    if settings.search_fulltext_enabled and params["query"]:
+        try:
+            records = run_read(FULLTEXT_SEARCH_QUERY, params)
+            if records:
+                return records
+        except Neo4jError as e:
+            logger.warning("Full-text search failed, falling back to regex scan: %s", e)
+    return run_read(REGEX_SEARCH_QUERY, params)
 
 
-def create_scene(payload: dict) -> str:
-    """Create Scene node and relationships. Returns id."""
-    uid = ensure_id(payload)
-    title = payload.get("title", "")
-    description = payload.get("description", "")
-    location_id = payload.get("location_id", "")
-    character_ids = payload.get("character_ids") or []
-    run_write(
-        """
-        MERGE (s:Scene {id: $id}) SET s.title = $title, s.description = $description
-        WITH s
-        OPTIONAL MATCH (l:Location {id: $location_id})
-        FOREACH (_ IN CASE WHEN l IS NOT NULL THEN [1] ELSE [] END |
-            MERGE (s)-[:TAKES_PLACE_IN]->(l)
-        )
-        """,
-        {"id": uid, "title": title, "description": description, "location_id": location_id},
+# Предварительная выборка для вопроса к базе знаний: сущности, чьи имена/названия встречаются в вопросе
+# (full-text индекс: любое слово вопроса, с русской морфологией), и их окружение по сценам — одним запросом.
+# Для локации/персонажа — сцены, где они встречаются; для сцены — она сама; у сцены — локация и персонажи.
+_RETRIEVE_CONTEXT_QUERY = """
+CALL db.index.fulltext.queryNodes($index, $query) YIELD node, score
+WITH node, score ORDER BY score DESC LIMIT $limit
+OPTIONAL MATCH (node)<-[:TAKES_PLACE_IN|FEATURES]-(s:Scene)
+WITH node, score, CASE WHEN node:Scene THEN [node] ELSE [] END + collect(DISTINCT s)[..$scenes] AS scenes
+UNWIND CASE WHEN size(scenes) = 0 THEN [null] ELSE scenes END AS s
+OPTIONAL MATCH (s)-[:TAKES_PLACE_IN]->(l:Location)
+OPTIONAL MATCH (s)-[:FEATURES]->(c:Character)
+WITH node, score, s, l, collect(c.name) AS characters
+WITH node, score, collect(CASE WHEN s IS NULL THEN null ELSE {
+    id: s.id, title: s.title, description: s.description, location: l.name, characters: characters
+} END) AS scenes
+RETURN labels(node)[0] AS type, node.id AS id, COALESCE(node.name, node.title, '') AS name,
+       COALESCE(node.description, '') AS description, score, scenes
+ORDER BY score DESC
+"""
+
+
+def retrieve_context(question: str, limit: int = 5, scenes_per_entity: int = 3) -> list[dict[str, Any]]:
+    """
+    Сущности из вопроса вместе с их сценами (type, id, name, description, score, scenes[]).
+    Пустой список, если в вопросе нет слов для индекса. Ошибки Neo4j (нет индекса) — наружу.
+    """
+    query = build_fulltext_any_query(question)
+    if not query:
+        return []
+    return run_read(
+        _RETRIEVE_CONTEXT_QUERY,
+        {"index": FULLTEXT_INDEX, "query": query, "limit": limit, "scenes": scenes_per_entity},
     )
-    for cid in character_ids:
-        if not cid:
-            continue
-        run_write(
-            """
-            MATCH (s:Scene {id: $scene_id})
-            MATCH (c:Character {id: $char_id})
-            MERGE (s)-[:FEATURES]->(c)
-            """,
-            {"scene_id": uid, "char_id": cid},
-        )
-    return uid
-
-
-def search_graph(q: str) -> list[dict[str, Any]]:
-    """Поиск по графу (локации, персонажи, сцены, понятия). Как в server search API."""
-    q_norm = (q or "").strip().lower().replace(" ", ".*")
-    pattern = f".*{q_norm}.*" if q_norm else ".*"
-    params = {"pattern": pattern}
-    records = run_read("""
-        MATCH (n)
-        WHERE (n:Location OR n:Character OR n:Scene OR n:Concept)
-        AND (
-            (n.name IS NOT NULL AND toLower(trim(n.name)) =~ $pattern)
-            OR (n.title IS NOT NULL AND toLower(trim(n.title)) =~ $pattern)
-            OR (n.description IS NOT NULL AND toLower(trim(n.description)) =~ $pattern)
-        )
-        RETURN labels(n)[0] AS type, n.id AS id,
-               COALESCE(n.name, n.title, '') AS name,
-               COALESCE(n.description, n.title, '') AS snippet
-        LIMIT 50
-    """, params)
-    return records
-
-
-def update_scene(payload: dict) -> str:
-    """Update Scene node and relationships. Returns id."""
-    uid = payload["id"]
-    params = {"id": uid}
-    updates = []
-    if "title" in payload:
-        updates.append("s.title = $title")
-        params["title"] = payload["title"]
-    if "description" in payload:
-        updates.append("s.description = $description")
-        params["description"] = payload["description"]
-    if updates:
-        run_write(f"MATCH (s:Scene {{id: $id}}) SET {', '.join(updates)}", params)
-    if "location_id" in payload:
-        run_write(
-            """
-            MATCH (s:Scene {id: $id})
-            OPTIONAL MATCH (s)-[r:TAKES_PLACE_IN]->()
-            DELETE r
-            WITH s
-            MATCH (l:Location {id: $location_id})
-            MERGE (s)-[:TAKES_PLACE_IN]->(l)
-            """,
-            {"id": uid, "location_id": payload["location_id"]},
-        )
-    if "character_ids" in payload:
-        run_write("MATCH (s:Scene {id: $id}) OPTIONAL MATCH (s)-[r:FEATURES]->() DELETE r", {"id": uid})
-        for cid in payload["character_ids"] or []:
-            if not cid:
-                continue
-            run_write(
-                """
-                MATCH (s:Scene {id: $scene_id})
-                MATCH (c:Character {id: $char_id})
-                MERGE (s)-[:FEATURES]->(c)
-                """,
-                {"scene_id": uid, "char_id": cid},
-            )
-    return uid
+
+
+# --- Scene (custom logic: relationships) ---
+# Create/update is one UNWIND statement per batch: the scene, its location and all FEATURES
+# relationships are written in a single round trip and a single transaction.
+
+_CREATE_SCENES_QUERY = """
+UNWIND $rows AS row
+MERGE (s:Scene {id: row.id})
+SET s.title = row.title, s.title_norm = row.title_norm, s.description = row.description
+WITH s, row
+OPTIONAL MATCH (l:Location {id: row.location_id})
+FOREACH (_ IN CASE WHEN l IS NOT NULL THEN [1] ELSE [] END |
+    MERGE (s)-[:TAKES_PLACE_IN]->(l)
+)
+WITH s, row
+OPTIONAL MATCH (c:Character) WHERE c.id IN row.character_ids
+WITH s, collect(c) AS chars
+FOREACH (c IN chars | MERGE (s)-[:FEATURES]->(c))
+"""
+
+_UPDATE_SCENES_QUERY = """
+UNWIND $rows AS row
+MATCH (s:Scene {id: row.id})
+SET s += row.props
+WITH s, row
+OPTIONAL MATCH (s)-[r:TAKES_PLACE_IN]->() WHERE row.set_location
+WITH s, row, collect(r) AS old_locations
+FOREACH (r IN old_locations | DELETE r)
+WITH s, row
+OPTIONAL MATCH (l:Location {id: row.location_id}) WHERE row.set_location
+FOREACH (_ IN CASE WHEN l IS NOT NULL THEN [1] ELSE [] END |
+    MERGE (s)-[:TAKES_PLACE_IN]->(l)
+)
+WITH s, row
+OPTIONAL MATCH (s)-[r:FEATURES]->() WHERE row.set_characters
+WITH s, row, collect(r) AS old_features
+FOREACH (r IN old_features | DELETE r)
+WITH s, row
+OPTIONAL MATCH (c:Character) WHERE row.set_characters AND c.id IN row.character_ids
+WITH s, collect(c) AS chars
+FOREACH (c IN chars | MERGE (s)-[:FEATURES]->(c))
+"""
+
+
+def _scene_create_row(payload: dict) -> dict:
+    return {
+        "id": ensure_id(payload),
+        "title": payload.get("title", ""),
+        "title_norm": normalize_key(payload.get("title", "")),
+        "description": payload.get("description", ""),
+        "location_id": payload.get("location_id", ""),
+        "character_ids": [cid for cid in payload.get("character_ids") or [] if cid],
+    }
+
+
+def _scene_update_row(payload: dict) -> dict:
+    props = {k: payload[k] for k in ("title", "description") if k in payload}
+    if "title" in props:
+        props["title_norm"] = normalize_key(props["title"])
+    return {
+        "id": payload["id"],
+        "props": props,
+        "set_location": "location_id" in payload,
+        "location_id": payload.get("location_id"),
+        "set_characters": "character_ids" in payload,
+        "character_ids": [cid for cid in payload.get("character_ids") or [] if cid],
+    }
+
+
+def create_scenes(tx, payloads: list[dict]) -> list[str]:
+    """Batch create scenes with TAKES_PLACE_IN and FEATURES relationships."""
+    rows = [_scene_create_row(p) for p in payloads]
+    tx.run(_CREATE_SCENES_QUERY, {"rows": rows})
+    return [r["id"] for r in rows]
+
+
+def update_scenes(tx, payloads: list[dict]) -> list[str]:
+    """Batch update scenes; location_id / character_ids replace the existing relationships."""
+    rows = [_scene_update_row(p) for p in payloads]
+    tx.run(_UPDATE_SCENES_QUERY, {"rows": rows})
+    return [r["id"] for r in rows]
+
+
+_STORE_ANSWER_QUERY = (
+    "MERGE (c:AnswerCache {key: $key}) "
+    "SET c.answer = $answer, c.role = $role, c.expires_at = timestamp() + $ttl_ms"
+)
+_PURGE_ANSWERS_QUERY = (
+    "MATCH (c:AnswerCache) WHERE c.expires_at < timestamp() "
+    "WITH c LIMIT $limit DELETE c"
+)
+
+
+def store_cached_answer(key: str, answer: str, role: str | None, ttl_sec: float) -> None:
+    """
+    Entry of the shared LLM answer cache (server LLM_ANSWER_CACHE_BACKEND=neo4j).
+    Expired entries are dropped a few at a time on every store (expires_at is indexed).
+    """
+
+    def work(tx) -> None:
+        tx.run(_STORE_ANSWER_QUERY, {"key": key, "answer": answer, "role": role, "ttl_ms": int(ttl_sec * 1000)})
+        tx.run(_PURGE_ANSWERS_QUERY, {"limit": 100})
+
+    write_in_transaction(work)
+
+
+# --- Материализованный контекст ролей (shared/role_context.py) ---
+
+_FEATURED_CHARACTERS_QUERY = """
+CALL {
+    UNWIND $scene_ids AS id
+    MATCH (:Scene {id: id})-[:FEATURES]->(c:Character)
+    RETURN c.id AS character_id
+    UNION
+    UNWIND $location_ids AS id
+    MATCH (:Location {id: id})<-[:TAKES_PLACE_IN]-(:Scene)-[:FEATURES]->(c:Character)
+    RETURN c.id AS character_id
+}
+RETURN collect(character_id) AS ids
+"""
+
+
+def featured_characters(tx, scene_ids: list[str], location_ids: list[str]) -> list[str]:
+    """Персонажи сцен scene_ids и сцен в локациях location_ids (одним запросом, по индексам id)."""
+    if not scene_ids and not location_ids:
+        return []
+    record = tx.run(_FEATURED_CHARACTERS_QUERY, {"scene_ids": scene_ids, "location_ids": location_ids}).single()
+    return list(record["ids"]) if record else []
+
+
+def refresh_role_contexts(tx, character_ids, narrator: bool) -> dict[str, str]:
+    """
+    Пересобрать документы контекста для персонажей character_ids (несуществующие пропускаются)
+    и, если narrator, обзор мира; записать их одним UNWIND. Возвращает {role: text}.
+    """
+    texts: dict[str, str] = {}
+    if character_ids:
+        for record in tx.run(CHARACTER_CONTEXT_QUERY, character_context_params(sorted(character_ids))):
+            texts[record["id"]] = format_character_context(dict(record))
+    if narrator:
+        record = tx.run(NARRATOR_CONTEXT_QUERY, narrator_context_params()).single()
+        texts[NARRATOR_ROLE] = format_narrator_context(dict(record) if record else None)
+    if texts:
+        tx.run(WRITE_ROLE_CONTEXTS_QUERY, {"rows": [{"role": role, "text": text} for role, text in texts.items()]})
+    return texts
+
+
+# Документ роли и, для персонажа, есть ли он в графе — одним чтением по индексам
+_READ_ROLE_CONTEXT_QUERY = """
+OPTIONAL MATCH (r:RoleContext {role: $role})
+OPTIONAL MATCH (c:Character {id: $role})
+RETURN r.text AS text, c IS NOT NULL AS character
+"""
+
+
+def get_role_context(role: str | None) -> str:
+    """
+    Контекст роли одним чтением по ключу. Документа ещё нет (граф записан до миграции 4) —
+    собирается и сохраняется сейчас, но только для существующего персонажа: неизвестный id
+    (role приходит от пользователя) не открывает транзакцию записи.
+    """
+    key = role_key(role)
+    records = run_read(_READ_ROLE_CONTEXT_QUERY, {"role": key})
+    record = records[0] if records else {}
+    if record.get("text"):
+        return record["text"]
+    narrator = key == NARRATOR_ROLE
+    if not narrator and not record.get("character"):
+        return missing_character_context(key)
+    texts = write_in_transaction(lambda tx: refresh_role_contexts(tx, [] if narrator else [key], narrator))
+    return texts.get(key) or missing_character_context(key)
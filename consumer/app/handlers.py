@@ -1,67 +1,193 @@
 """Event handlers: dispatch to graph writes and optional export."""
 import json
-from pathlib import Path
 
-from shared.events import EventType
+from shared.events import EventType, expand_events
 
 from app.config import settings
+from app.export import get_export_writer
 from app.graph import (
-    create_location,
-    update_location,
-    create_character,
-    update_character,
-    create_scene,
-    update_scene,
-    create_concept,
-    update_concept,
+    create_locations,
+    update_locations,
+    create_characters,
+    update_characters,
+    create_scenes,
+    update_scenes,
+    create_concepts,
+    update_concepts,
+    bump_graph_version,
+    featured_characters,
+    refresh_role_contexts,
+    write_in_transaction,
 )
 
+# Порядок групп в пакете: сначала узлы, на которые могут ссылаться сцены, затем сцены
+_BATCH_ORDER = (
+    EventType.LOCATION_CREATE.value,
+    EventType.CHARACTER_CREATE.value,
+    EventType.CONCEPT_CREATE.value,
+    EventType.LOCATION_UPDATE.value,
+    EventType.CHARACTER_UPDATE.value,
+    EventType.CONCEPT_UPDATE.value,
+    EventType.SCENE_CREATE.value,
+    EventType.SCENE_UPDATE.value,
+)
+_TITLE_EVENTS = (EventType.SCENE_CREATE.value, EventType.SCENE_UPDATE.value)
+
+# Контекст ролей (shared/role_context.py): обзор мира содержит имена локаций, персонажей и понятий,
+# документ персонажа — его имя, описание и сцены (название, локация)
+_NARRATOR_CREATES = (
+    EventType.LOCATION_CREATE.value,
+    EventType.CHARACTER_CREATE.value,
+    EventType.CONCEPT_CREATE.value,
+)
+_NARRATOR_UPDATES = (
+    EventType.LOCATION_UPDATE.value,
+    EventType.CHARACTER_UPDATE.value,
+    EventType.CONCEPT_UPDATE.value,
+)
+_CHARACTER_EVENTS = (EventType.CHARACTER_CREATE.value, EventType.CHARACTER_UPDATE.value)
+_SCENE_CONTEXT_FIELDS = {"title", "location_id", "character_ids"}
+
 
 def _normalize_name(name: str) -> str:
     """Strip leading/trailing whitespace (consistent with server uniqueness)."""
     return name.strip() if name else ""
 
 
-def handle_event(event_type: str, payload: dict) -> None:
-    """Dispatch event to graph write and export. Normalizes name/title (strip) before write."""
-    if event_type == EventType.LOCATION_CREATE.value:
-        payload = {**payload, "name": _normalize_name(payload.get("name", ""))}
-        create_location(payload)
-    elif event_type == EventType.LOCATION_UPDATE.value:
-        if "name" in payload:
-            payload = {**payload, "name": _normalize_name(payload["name"])}
-        update_location(payload)
-    elif event_type == EventType.CHARACTER_CREATE.value:
-        payload = {**payload, "name": _normalize_name(payload.get("name", ""))}
-        create_character(payload)
-    elif event_type == EventType.CHARACTER_UPDATE.value:
-        if "name" in payload:
-            payload = {**payload, "name": _normalize_name(payload["name"])}
-        update_character(payload)
-    elif event_type == EventType.SCENE_CREATE.value:
-        payload = {**payload, "title": _normalize_name(payload.get("title", ""))}
-        create_scene(payload)
-    elif event_type == EventType.SCENE_UPDATE.value:
-        if "title" in payload:
-            payload = {**payload, "title": _normalize_name(payload["title"])}
-        update_scene(payload)
-    elif event_type == EventType.CONCEPT_CREATE.value:
-        payload = {**payload, "name": _normalize_name(payload.get("name", ""))}
-        create_concept(payload)
-    elif event_type == EventType.CONCEPT_UPDATE.value:
-        if "name" in payload:
-            payload = {**payload, "name": _normalize_name(payload["name"])}
-        update_concept(payload)
-    else:
+def _prepare_payload(event_type: str, payload: dict) -> dict:
+    """Normalize name/title (strip) like handle_event does. Raises ValueError for unknown type."""
+    if event_type not in _BATCH_ORDER:
         raise ValueError(f"Unknown event type: {event_type}")
+    field = "title" if event_type in _TITLE_EVENTS else "name"
+    if event_type.endswith(".create"):
+        return {**payload, field: _normalize_name(payload.get(field, ""))}
+    if field in payload:
+        return {**payload, field: _normalize_name(payload[field])}
+    return payload
+
+
+def _batch_writer(event_type: str):
+    return {
+        EventType.LOCATION_CREATE.value: create_locations,
+        EventType.LOCATION_UPDATE.value: update_locations,
+        EventType.CHARACTER_CREATE.value: create_characters,
+        EventType.CHARACTER_UPDATE.value: update_characters,
+        EventType.SCENE_CREATE.value: create_scenes,
+        EventType.SCENE_UPDATE.value: update_scenes,
+        EventType.CONCEPT_CREATE.value: create_concepts,
+        EventType.CONCEPT_UPDATE.value: update_concepts,
+    }[event_type]
+
+
+def _plan_segments(events: list[tuple[str, dict]]) -> list[dict[str, list[dict]]]:
+    """
+    Split events into segments grouped by type. A new segment starts when an id repeats,
+    so reordering groups inside a segment never reorders writes to the same node.
+    """
+    segments: list[dict[str, list[dict]]] = [{}]
+    seen: set[str] = set()
+    for event_type, payload in events:
+        uid = payload.get("id")
+        if uid and uid in seen:
+            segments.append({})
+            seen = set()
+        if uid:
+            seen.add(uid)
+        segments[-1].setdefault(event_type, []).append(payload)
+    return segments
+
+
+def _role_context_targets(tx, events: list[tuple[str, dict]]) -> tuple[set[str], bool] | None:
+    """
+    Before the write: characters whose context documents the events change — including those a scene
+    update removes from the scene — and whether the narrator summary changes. None if nothing changes.
+    """
+    characters: set[str] = set()
+    scene_ids: list[str] = []
+    location_ids: list[str] = []
+    narrator = False
+    for event_type, payload in events:
+        if event_type in _CHARACTER_EVENTS:
+            characters.add(payload.get("id"))
+        elif event_type == EventType.SCENE_CREATE.value or (
+            event_type == EventType.SCENE_UPDATE.value and _SCENE_CONTEXT_FIELDS & payload.keys()
+        ):
+            scene_ids.append(payload.get("id"))
+            characters.update(payload.get("character_ids") or [])
+        elif event_type == EventType.LOCATION_UPDATE.value and "name" in payload:
+            location_ids.append(payload.get("id"))
+        if event_type in _NARRATOR_CREATES or (event_type in _NARRATOR_UPDATES and "name" in payload):
+            narrator = True
+    characters.update(featured_characters(tx, [i for i in scene_ids if i], [i for i in location_ids if i]))
+    characters.discard(None)
+    return (characters, narrator) if characters or narrator else None
+
+
+def _finish_write(role_targets: tuple[set[str], bool] | None):
+    """Transaction work after the write: refresh affected role contexts, bump the graph version."""
+    if role_targets is None:
+        return bump_graph_version
+
+    def work(tx) -> int:
+        refresh_role_contexts(tx, *role_targets)
+        return bump_graph_version(tx)
+
+    return work
+
+
+def handle_events_batch(events: list[tuple[str, dict]]) -> int:
+    """
+    Write many events in one transaction: one UNWIND statement per event type (per segment),
+    then export. BATCH events are expanded in place. Role context documents touched by the events are
+    refreshed in the same transaction. Raises on any error; nothing is committed in that case.
+    Returns the graph version bumped in the same transaction.
+    """
+    prepared = [
+        (event_type, _prepare_payload(event_type, payload))
+        for event_type, payload in expand_events(events)
+    ]
+    segments = _plan_segments(prepared)
+
+    def work(tx) -> int:
+        role_targets = _role_context_targets(tx, prepared) if settings.role_context_enabled else None
+        for segment in segments:
+            for event_type in _BATCH_ORDER:
+                if event_type in segment:
+                    _batch_writer(event_type)(tx, segment[event_type])
+        return _finish_write(role_targets)(tx)
+
+    version = write_in_transaction(work)
+    export_events_to_file(prepared)
+    return version
+
+
+def handle_event(event_type: str, payload: dict) -> int:
+    """
+    Dispatch event to graph write and export. Normalizes name/title (strip) before write.
+    The write, the refresh of the role context documents the event changes (participants read inside
+    the same transaction) and the graph version bump run in one transaction.
+    Returns the new graph version.
+    """
+    if event_type == EventType.BATCH.value:
+        return handle_events_batch([(event_type, payload)])
+    payload = _prepare_payload(event_type, payload)
+
+    def work(tx) -> int:
+        role_targets = _role_context_targets(tx, [(event_type, payload)]) if settings.role_context_enabled else None
+        _batch_writer(event_type)(tx, [payload])
+        return _finish_write(role_targets)(tx)
+
+    version = write_in_transaction(work)
     export_to_file(event_type, payload)
+    return version
 
 
 def export_to_file(event_type: str, payload: dict) -> None:
-    """Append event to export file for Git (optional)."""
-    path = Path(settings.export_dir)
-    path.mkdir(parents=True, exist_ok=True)
-    file_path = path / "events.jsonl"
-    line = json.dumps({"type": event_type, "payload": payload}) + "\n"
-    with open(file_path, "a", encoding="utf-8") as f:
-        f.write(line)
+    """Queue event for the export segments (for Git and replay)."""
+    export_events_to_file([(event_type, payload)])
+
+
+def export_events_to_file(events: list[tuple[str, dict]]) -> None:
+    """Queue many events for the background export writer (app/export.py); order is preserved."""
+    lines = [json.dumps({"type": event_type, "payload": payload}) + "\n" for event_type, payload in events]
+    get_export_writer(settings.export_dir).write(lines)
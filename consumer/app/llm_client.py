@@ -0,0 +1,170 @@
+"""
+Общий HTTP-клиент consumer -> llm-service: один пул keep-alive соединений на процесс
+(httpx.Client потокобезопасен, его делят все обработчики пула llm.tasks).
+
+Таймаут каждого вызова — min(llm_request_timeout_sec, остаток дедлайна задачи): задача из
+нескольких раундов не может длиться дольше llm_task_timeout_sec.
+"""
+import json
+import logging
+import threading
+import time
+from collections.abc import Iterator
+
+import httpx
+
+from app.config import settings
+from app.metrics import (
+    llm_http_in_flight,
+    llm_http_pool_connections,
+    llm_http_pool_max_connections,
+    llm_http_request_duration_seconds,
+    llm_http_requests_total,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Дедлайн задачи истёк до (очередного) вызова LLM."""
+
+
+def task_deadline() -> float:
+    """Момент (time.monotonic), к которому задача llm.tasks должна завершиться."""
+    return time.monotonic() + settings.llm_task_timeout_sec
+
+
+def call_timeout(deadline: float | None) -> float:
+    """Таймаут одного вызова с учётом дедлайна задачи. DeadlineExceeded, если времени не осталось."""
+    timeout = settings.llm_request_timeout_sec
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("LLM task deadline exceeded")
+    return min(timeout, remaining)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_client() -> httpx.Client:
+    # По соединению на обработчик; пакетная генерация ведёт до llm_generate_concurrency запросов сразу
+    max_connections = settings.llm_http_max_connections or (
+        max(settings.llm_workers, 1) + max(settings.llm_generate_concurrency, 1) - 1
+    )
+    http2 = settings.llm_http2
+    if http2 and not _http2_available():
+        logger.warning("LLM_HTTP2=true, but package h2 is not installed; using HTTP/1.1")
+        http2 = False
+    llm_http_pool_max_connections.set(max_connections)
+    return httpx.Client(
+        base_url=settings.llm_service_url.rstrip("/"),
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=settings.llm_http_keepalive_expiry_sec,
+        ),
+        timeout=httpx.Timeout(settings.llm_request_timeout_sec, connect=settings.llm_http_connect_timeout_sec),
+    )
+
+
+_client: httpx.Client | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> httpx.Client:
+    """Общий клиент (создаётся при первом вызове)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def close_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _observe_pool(client: httpx.Client) -> None:
+    """Снимок состояния пула соединений (httpcore не даёт публичного доступа к пулу транспорта)."""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return
+    idle = sum(1 for c in connections if c.is_idle())
+    llm_http_pool_connections.labels(state="idle").set(idle)
+    llm_http_pool_connections.labels(state="active").set(len(connections) - idle)
+
+
+def post_json(path: str, payload: dict, deadline: float | None = None) -> dict:
+    """POST в llm-service через общий пул; ответ — JSON. Ошибки HTTP — httpx.HTTPStatusError."""
+    client = get_client()
+    timeout = call_timeout(deadline)
+    endpoint = path.strip("/")
+    status = "error"
+    llm_http_in_flight.inc()
+    start = time.perf_counter()
+    try:
+        r = client.post(
+            path,
+            json=payload,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, settings.llm_http_connect_timeout_sec)),
+        )
+        status = str(r.status_code)
+        r.raise_for_status()
+        return r.json()
+    finally:
+        llm_http_in_flight.dec()
+        llm_http_request_duration_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+        llm_http_requests_total.labels(endpoint=endpoint, status=status).inc()
+        _observe_pool(client)
+
+
+def stream_sse(path: str, payload: dict, deadline: float | None = None) -> Iterator[tuple[str, dict]]:
+    """
+    POST в llm-service с ответом text/event-stream; отдаёт (event, data) по мере прихода событий.
+    Таймаут чтения — на каждый кусок, общий срок ограничен дедлайном задачи.
+    """
+    client = get_client()
+    timeout = call_timeout(deadline)
+    endpoint = path.strip("/")
+    status = "error"
+    llm_http_in_flight.inc()
+    start = time.perf_counter()
+    try:
+        with client.stream(
+            "POST",
+            path,
+            json=payload,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, settings.llm_http_connect_timeout_sec)),
+        ) as r:
+            status = str(r.status_code)
+            r.raise_for_status()
+            event = "message"
+            for line in r.iter_lines():
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):].strip())
+                elif not line:
+                    event = "message"
+                if deadline is not None and time.monotonic() > deadline:
+                    status = "error"
+                    raise DeadlineExceeded("LLM task deadline exceeded")
+    finally:
+        llm_http_in_flight.dec()
+        llm_http_request_duration_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+        llm_http_requests_total.labels(endpoint=endpoint, status=status).inc()
+        _observe_pool(client)
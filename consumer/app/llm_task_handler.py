@@ -1,13 +1,41 @@
 """
 Обработка задач из очереди llm.tasks: вопросы по базе знаний (с поиском до ~3 раз) и генерация сущностей.
 Результат публикуется в llm.results.
+
+Кэш ответов: server кладёт в задачу knowledge cache_key (вопрос + роль + версия графа). Готовый ответ
+возвращается с тем же cache_key — по нему server заполняет кэш; при cache_store="neo4j" ответ
+дополнительно пишется в общий кэш в Neo4j (узел AnswerCache, TTL cache_ttl_sec).
+
+Пакетная генерация (count/prompts): части по llm_generate_chunk_size сущностей идут в /generate
+параллельно (до llm_generate_concurrency); по мере готовности частей через on_partial публикуется
+{"status": "partial", "items": [...]}, в итоговом результате — items и errors (index, error).
+
+Предвыборка (llm_retrieval_first): до первого вызова LLM сущности, упомянутые в вопросе, и их сцены
+одним запросом к графу попадают в промпт; среднее число вызовов LLM на вопрос — метрика llm_knowledge_rounds.
+
+Раунды вопроса — диалог в llm-service (messages + conversation_id, llm_conversations): история
+хранится там, каждый раунд отправляет только новые реплики; 409 (диалог потерян) — повтор с полной историей.
+
+Потоковый ответ (llm_stream): вызов /chat/stream, и пока модель пишет ответ (а не SEARCH:), уже
+полученная часть публикуется через on_partial как {"status": "partial", "answer": ...}.
 """
 import logging
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import httpx
 
 from app.config import settings
-from app.graph import search_graph
+from app.context import ContextAssembler, estimate_tokens, stem, words
+from app.graph import get_role_context, retrieve_context, search_graph, store_cached_answer
+from app.llm_client import post_json, stream_sse, task_deadline
+from app.metrics import (
+    llm_context_dropped_records_total,
+    llm_knowledge_rounds,
+    llm_pre_retrieval_total,
+    llm_prompt_tokens,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,57 +43,261 @@ MAX_SEARCH_ROUNDS = 3
 SEARCH_PREFIX = "SEARCH:"
 ANSWER_PREFIX = "ANSWER:"
 
+# Поиски раундов всех задач: до llm_search_max_queries на каждого из llm_workers (потоки создаются по мере надобности)
+_search_pool = ThreadPoolExecutor(
+    max_workers=max(1, settings.llm_search_max_queries * settings.llm_workers),
+    thread_name_prefix="graph-search",
+)
+
+
+def _call_llm_chat(
+    payload: dict,
+    deadline: float | None = None,
+    on_delta: Callable[[str], None] | None = None,
+) -> str:
+    """
+    Один вызов LLM /chat (общий пул соединений, таймаут с учётом дедлайна задачи).
+    С on_delta — /chat/stream: on_delta(весь текст на данный момент) на каждый кусок ответа.
+    """
+    if on_delta is None or not settings.llm_stream:
+        return post_json("/chat", payload, deadline).get("answer", "") or ""
+    text = ""
+    for event, data in stream_sse("/chat/stream", payload, deadline):
+        if event == "delta":
+            text += data.get("delta") or ""
+            on_delta(text)
+        elif event == "done":
+            return data.get("answer") or text
+        elif event == "error":
+            raise RuntimeError(data.get("detail") or "LLM stream error")
+    return text
+
+
+class _Conversation:
+    """
+    Диалог вопроса с LLM: история сообщений (system, user, assistant). С llm_conversations llm-service
+    хранит историю по conversation_id, и каждый раунд отправляет только новые реплики; если там
+    диалога уже нет (409 — перезапуск, вытеснение, другая реплика) — повторяем с полной историей.
+    """
+
+    def __init__(self, conversation_id: str, system: str) -> None:
+        self._id = conversation_id
+        self.messages = [{"role": "system", "content": system}]
+        self._sent = 0  # сколько сообщений истории уже есть в llm-service
+
+    def ask(self, text: str, deadline: float, on_delta: Callable[[str], None] | None = None) -> str:
+        """Реплика пользователя -> ответ модели (оба остаются в истории)."""
+        turn = {"role": "user", "content": text}
+        if not settings.llm_conversations:
+            answer = _call_llm_chat({"messages": self.messages + [turn]}, deadline, on_delta)
+        else:
+            append = self._sent > 0
+            new = self.messages[self._sent:] + [turn]
+            payload = {"messages": new, "conversation_id": self._id, "append": append}
+            try:
+                answer = _call_llm_chat(payload, deadline, on_delta)
+            except httpx.HTTPStatusError as e:
+                if not append or e.response.status_code != 409:
+                    raise
+                logger.info("Conversation %s is gone in llm-service, resending the full history", self._id)
+                payload = {"messages": self.messages + [turn], "conversation_id": self._id, "append": False}
+                answer = _call_llm_chat(payload, deadline, on_delta)
+        self.messages += [turn, {"role": "assistant", "content": answer or "(пустой ответ)"}]
+        self._sent = len(self.messages)
+        return answer
+
+    def tokens_to_send(self, text: str) -> int:
+        """Оценка токенов, которые уйдут в llm-service с репликой text."""
+        unsent = self.messages if not settings.llm_conversations else self.messages[self._sent:]
+        return sum(estimate_tokens(m["content"]) for m in unsent) + estimate_tokens(text)
+
+
+class _PartialAnswer:
+    """
+    on_delta для одного раунда: публикует частичный ответ, если модель отвечает (ANSWER: или текст
+    без префикса), а не просит поиск; не чаще llm_stream_publish_interval_ms.
+    """
+
+    def __init__(self, request_id: str, role: str, publish: Callable[[dict], None]) -> None:
+        self._request_id = request_id
+        self._role = role
+        self._publish = publish
+        self._answering: bool | None = None  # None — по началу текста ещё не понять
+        self._published_at = 0.0
+
+    def __call__(self, text: str) -> None:
+        head = text.lstrip()
+        if self._answering is None:
+            upper = head.upper()
+            if len(upper) < len(SEARCH_PREFIX) and (SEARCH_PREFIX.startswith(upper) or ANSWER_PREFIX.startswith(upper)):
+                return
+            self._answering = not upper.startswith(SEARCH_PREFIX)
+        if not self._answering:
+            return
+        answer = head[len(ANSWER_PREFIX):].lstrip() if head.upper().startswith(ANSWER_PREFIX) else head
+        now = time.monotonic()
+        if not answer or now - self._published_at < settings.llm_stream_publish_interval_ms / 1000:
+            return
+        self._published_at = now
+        try:
+            self._publish({
+                "request_id": self._request_id,
+                "status": "partial",
+                "type": "knowledge",
+                "answer": answer,
+                "role": self._role,
+            })
+        except Exception as e:
+            logger.warning("Failed to publish partial answer: %s", e)
+
 
-def _call_llm_chat(prompt: str, system: str | None = None) -> str:
-    """Один вызов LLM /chat."""
-    url = f"{settings.llm_service_url.rstrip('/')}/chat"
-    with httpx.Client(timeout=120.0) as client:
-        r = client.post(url, json={"prompt": prompt, "system": system})
-        r.raise_for_status()
-        return r.json().get("answer", "") or ""
+def _call_llm_generate(
+    entity_type: str,
+    prompt: str,
+    deadline: float | None = None,
+    count: int | None = None,
+    prompts: list[str] | None = None,
+) -> dict:
+    """
+    Вызов LLM /generate. Возвращает { entity_type, payload }; с count (в том числе 1) или prompts —
+    ещё items и errors, каждая сущность проверена по ENTITY_SCHEMAS.
+    """
+    body = {"entity_type": entity_type, "prompt": prompt}
+    if prompts:
+        body["prompts"] = prompts
+    elif count is not None:
+        body["count"] = count
+    return post_json("/generate", body, deadline)
 
 
-def _call_llm_generate(entity_type: str, prompt: str) -> dict:
-    """Вызов LLM /generate. Возвращает { entity_type, payload }."""
-    url = f"{settings.llm_service_url.rstrip('/')}/generate"
-    with httpx.Client(timeout=120.0) as client:
-        r = client.post(url, json={"entity_type": entity_type, "prompt": prompt})
-        r.raise_for_status()
-        return r.json()
+def _search_queries(raw: str) -> list[str]:
+    """Запросы из строк SEARCH: ответа модели — без пустых и повторов, не больше llm_search_max_queries."""
+    queries = []
+    for line in raw.splitlines():
+        line = line.strip()
+        if line.upper().startswith(SEARCH_PREFIX):
+            query = line[len(SEARCH_PREFIX):].strip()
+            if query and query.lower() not in (q.lower() for q in queries):
+                queries.append(query)
+    return queries[:max(settings.llm_search_max_queries, 1)]
 
 
-def _format_search_results(records: list[dict]) -> str:
-    if not records:
-        return "Поиск не нашёл совпадений."
-    lines = []
-    for r in records:
-        t = r.get("type", "")
-        name = r.get("name", "")
-        snippet = (r.get("snippet") or "")[:200]
-        lines.append(f"[{t}] {name}: {snippet}")
-    return "\n".join(lines)
+def _search_one(query: str) -> list[dict]:
+    """Поиск по одному запросу; ошибка графа не роняет вопрос — записи пустые."""
+    try:
+        return search_graph(query)
+    except Exception as e:
+        logger.warning("Graph search %r failed: %s", query, e)
+        return []
 
 
-def handle_knowledge(request_id: str, question: str, role: str) -> dict:
+def _search_many(queries: list[str]) -> list[tuple[str, list[dict]]]:
     """
-    Вопрос по базе знаний. До ~3 раундов: LLM может ответить SEARCH: <query>, тогда
-    выполняем поиск по графу, добавляем в context и снова спрашиваем LLM.
+    Поиск по нескольким запросам одного раунда параллельно (общий пул _search_pool): [(запрос, записи)]
+    в порядке запросов. Один запрос выполняется в текущем потоке.
+    Упавший запрос не отменяет остальные (его записи — пустые).
+    """
+    if len(queries) == 1:
+        return [(queries[0], _search_one(queries[0]))]
+    futures = [_search_pool.submit(_search_one, q) for q in queries]
+    return [(query, future.result()) for query, future in zip(queries, futures)]
+
+
+def _mentions(question_words: list[str], name: str) -> bool:
+    """Каждое слово имени есть в вопросе с точностью до окончания («Иван» — «Ивана», «таверна» — «таверне»)."""
+    name_words = words(name)
+    return bool(name_words) and all(any(q.startswith(stem(w)) for q in question_words) for w in name_words)
+
+
+def _pre_retrieve(question: str) -> tuple[list[dict], bool]:
+    """Сущности из вопроса с их сценами и признак уверенного совпадения. Ошибка — пустой результат."""
+    try:
+        records = retrieve_context(
+            question,
+            limit=settings.llm_retrieval_max_entities,
+            scenes_per_entity=settings.llm_retrieval_scenes_per_entity,
+        )
+    except Exception as e:
+        logger.warning("Pre-retrieval failed, falling back to SEARCH rounds: %s", e)
+        llm_pre_retrieval_total.labels(result="error").inc()
+        return [], False
+    question_words = words(question)
+    confident = any(_mentions(question_words, r.get("name") or "") for r in records)
+    llm_pre_retrieval_total.labels(result="confident" if confident else "partial" if records else "empty").inc()
+    return records, confident
+
+
+def _role_context(role: str) -> str | None:
+    """Материализованный контекст роли (персонаж или рассказчик); ошибка — без него."""
+    if not settings.role_context_enabled:
+        return None
+    try:
+        return get_role_context(role)
+    except Exception as e:
+        logger.warning("Role context for %r unavailable: %s", role, e)
+        return None
+
+
+def handle_knowledge(
+    request_id: str, question: str, role: str, on_partial: Callable[[dict], None] | None = None
+) -> dict:
+    """
+    Вопрос по базе знаний. С llm_retrieval_first сущности из вопроса и их сцены сразу попадают в первый
+    промпт — часто LLM отвечает с первого вызова. Дальше до ~3 раундов: LLM может ответить
+    SEARCH: <query>, тогда выполняем поиск по графу, добавляем в context и снова спрашиваем LLM.
+    Раунды — реплики одного диалога (_Conversation): следующий раунд отправляет только новые результаты
+    поиска. Их собирает ContextAssembler: без повторов сущностей, по релевантности, в пределах
+    llm_context_budget_tokens — реплика не растёт с каждым раундом.
+    За один раунд модель может запросить несколько поисков (строки SEARCH:) — они выполняются параллельно.
+    Раунды заканчиваются раньше, если поиск не нашёл ничего нового или предвыборка уверенная:
+    последний вызов просит только ANSWER. Контекст роли (RoleContext) — в системном промпте.
+    on_partial — публикация частичного ответа (потоковый режим).
     """
     system = (
         "Ты помощник по визуальной новелле с доступом к базе знаний. "
-        "Если нужна информация из базы — ответь ровно одной строкой: SEARCH: <запрос>. "
+        "Если нужна информация из базы — ответь строками SEARCH: <запрос>, по одной на каждую "
+        "нужную сущность или тему (не больше {max_queries}). "
         "Иначе ответь строкой: ANSWER: <твой ответ пользователю>."
-    )
-    context_parts = []
-    for _ in range(MAX_SEARCH_ROUNDS + 1):
-        context_str = "\n\n".join(context_parts) if context_parts else "Пока нет данных из поиска."
-        prompt = (
-            f"Контекст из базы знаний:\n{context_str}\n\n"
-            f"Вопрос пользователя: {question}\n\n"
-            "Ответь SEARCH: <запрос> или ANSWER: <твой ответ>."
+    ).format(max_queries=settings.llm_search_max_queries)
+    role_context = _role_context(role)
+    if role_context:
+        system += f"\n\nОтвечай с учётом роли. Контекст роли:\n{role_context}"
+    context = ContextAssembler(question, settings.llm_context_budget_tokens)
+    search_rounds = MAX_SEARCH_ROUNDS
+    mode = "search_first"
+    if settings.llm_retrieval_first:
+        mode = "retrieval_first"
+        records, confident = _pre_retrieve(question)
+        context.add_retrieved(records)
+        if confident:
+            search_rounds = min(search_rounds, settings.llm_retrieval_confident_search_rounds)
+
+    def done(answer: str, rounds: int) -> dict:
+        llm_knowledge_rounds.labels(mode=mode).observe(rounds)
+        return {"request_id": request_id, "status": "done", "type": "knowledge", "answer": answer, "role": role}
+
+    conversation = _Conversation(request_id, system)
+    deadline = task_deadline()
+    rounds = 0
+    while True:
+        rounds += 1
+        final = rounds > search_rounds
+        context_str = context.render()
+        if context.dropped:
+            llm_context_dropped_records_total.inc(context.dropped)
+        instruction = (
+            "Поиск больше недоступен. Ответь ANSWER: <твой ответ>."
+            if final
+            else "Ответь SEARCH: <запрос> или ANSWER: <твой ответ>."
         )
+        if rounds == 1:
+            turn = f"Контекст из базы знаний:\n{context_str}\n\nВопрос пользователя: {question}\n\n{instruction}"
+        else:
+            turn = f"Результаты поиска:\n{context_str}\n\n{instruction}"
+        llm_prompt_tokens.labels(round=str(rounds)).observe(conversation.tokens_to_send(turn))
         try:
-            raw = _call_llm_chat(prompt, system=system)
+            on_delta = _PartialAnswer(request_id, role, on_partial) if on_partial else None
+            raw = conversation.ask(turn, deadline, on_delta)
         except Exception as e:
             logger.exception("LLM chat error: %s", e)
             return {
@@ -77,47 +309,34 @@ def handle_knowledge(request_id: str, question: str, role: str) -> dict:
         raw = (raw or "").strip()
         if raw.upper().startswith(ANSWER_PREFIX):
             answer = raw[len(ANSWER_PREFIX):].strip()
-            return {
-                "request_id": request_id,
-                "status": "done",
-                "type": "knowledge",
-                "answer": answer or "(пустой ответ)",
-                "role": role,
-            }
+            return done(answer or "(пустой ответ)", rounds)
         if raw.upper().startswith(SEARCH_PREFIX):
-            query = raw[len(SEARCH_PREFIX):].strip()
-            if not query:
-                return {
-                    "request_id": request_id,
-                    "status": "done",
-                    "type": "knowledge",
-                    "answer": "(LLM запросил поиск без запроса)",
-                    "role": role,
-                }
-            records = search_graph(query)
-            formatted = _format_search_results(records)
-            context_parts.append(f"Поиск по запросу «{query}»:\n{formatted}")
+            if final:
+                return done("(исчерпан лимит раундов поиска)", rounds)
+            queries = _search_queries(raw)
+            if not queries:
+                return done("(LLM запросил поиск без запроса)", rounds)
+            added = sum(context.add_search(q, records) for q, records in _search_many(queries))
+            if not added:
+                # Поиск ничего не добавил — следующий вызов последний
+                search_rounds = rounds
             continue
-        return {
-            "request_id": request_id,
-            "status": "done",
-            "type": "knowledge",
-            "answer": raw or "(не удалось распознать ответ)",
-            "role": role,
-        }
-    return {
-        "request_id": request_id,
-        "status": "done",
-        "type": "knowledge",
-        "answer": "(исчерпан лимит раундов поиска)",
-        "role": role,
-    }
+        return done(raw or "(не удалось распознать ответ)", rounds)
 
 
-def handle_generate(request_id: str, entity_type: str, prompt: str) -> dict:
-    """Генерация сущности. Ответ — payload для создания, в БД не сохраняем."""
+def handle_generate(
+    request_id: str,
+    entity_type: str,
+    prompt: str,
+    count: int = 1,
+    prompts: list[str] | None = None,
+    on_partial: Callable[[dict], None] | None = None,
+) -> dict:
+    """Генерация сущности (или count/prompts сущностей). Ответ — payload для создания, в БД не сохраняем."""
+    if prompts or count > 1:
+        return _handle_generate_many(request_id, entity_type, prompt, count, prompts, on_partial)
     try:
-        data = _call_llm_generate(entity_type, prompt)
+        data = _call_llm_generate(entity_type, prompt, deadline=task_deadline())
         return {
             "request_id": request_id,
             "status": "done",
@@ -135,23 +354,122 @@ def handle_generate(request_id: str, entity_type: str, prompt: str) -> dict:
         }
 
 
-def handle_llm_task(body: dict) -> dict:
-    """По request_id и type вызвать нужный обработчик и вернуть результат для публикации в llm.results."""
+def _handle_generate_many(
+    request_id: str,
+    entity_type: str,
+    prompt: str,
+    count: int,
+    prompts: list[str] | None,
+    on_partial: Callable[[dict], None] | None,
+) -> dict:
+    """Пакетная генерация частями; сущности в items по порядку запроса, неудачные — в errors."""
+    total = len(prompts) if prompts else count
+    size = max(1, min(settings.llm_generate_chunk_size, 50))
+    chunks = [(start, min(size, total - start)) for start in range(0, total, size)]
+    deadline = task_deadline()
+    slots: list[dict | None] = [None] * total
+    errors: list[dict] = []
+
+    def run_chunk(start: int, n: int) -> dict:
+        # count передаётся и для части из одной сущности: иначе llm-service ответит одиночным payload без проверки
+        chunk_prompts = prompts[start:start + n] if prompts else None
+        return _call_llm_generate(entity_type, prompt, deadline, count=n, prompts=chunk_prompts)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(settings.llm_generate_concurrency, len(chunks)))) as pool:
+        futures = {pool.submit(run_chunk, start, n): (start, n) for start, n in chunks}
+        for done_count, future in enumerate(as_completed(futures), 1):
+            start, n = futures[future]
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.warning("LLM generate chunk %d-%d failed: %s", start, start + n - 1, e)
+                errors.extend({"index": start + i, "error": str(e)} for i in range(n))
+                continue
+            failed = {err["index"] for err in data.get("errors") or []}
+            errors.extend({**err, "index": start + err["index"]} for err in data.get("errors") or [])
+            # items идут по порядку, без позиций из errors
+            for index, item in zip((i for i in range(n) if i not in failed), data.get("items") or []):
+                slots[start + index] = item
+            # Сущность, которой нет ни в items, ни в errors, — тоже ошибка
+            errors.extend(
+                {"index": start + i, "error": "LLM не вернул сущность"}
+                for i in range(n) if i not in failed and slots[start + i] is None
+            )
+            if on_partial is not None and done_count < len(chunks):
+                # Только новые сущности части с их позициями: server собирает их в partial_items
+                indices = [start + i for i in range(n) if slots[start + i] is not None]
+                try:
+                    on_partial({
+                        "request_id": request_id,
+                        "status": "partial",
+                        "type": "generate",
+                        "entity_type": entity_type,
+                        "items": [slots[i] for i in indices],
+                        "indices": indices,
+                        "count": total,
+                    })
+                except Exception as e:
+                    logger.warning("Failed to publish partial items: %s", e)
+
+    items = [item for item in slots if item is not None]
+    errors.sort(key=lambda err: err["index"])
+    if not items:
+        return {
+            "request_id": request_id,
+            "status": "error",
+            "type": "generate",
+            "error": errors[0]["error"] if errors else "LLM не вернул ни одной сущности",
+            "errors": errors,
+        }
+    return {
+        "request_id": request_id,
+        "status": "done",
+        "type": "generate",
+        "entity_type": entity_type,
+        "payload": items[0],
+        "items": items,
+        "errors": errors,
+    }
+
+
+def _cache_answer(body: dict, result: dict) -> None:
+    """Вернуть cache_key в результате; при общем кэше — записать ответ в Neo4j (ошибка не роняет задачу)."""
+    result["cache_key"] = body["cache_key"]
+    if body.get("cache_store") != "neo4j":
+        return
+    try:
+        store_cached_answer(body["cache_key"], result["answer"], result.get("role"), body.get("cache_ttl_sec") or 3600)
+    except Exception as e:
+        logger.warning("Failed to store cached answer: %s", e)
+
+
+def handle_llm_task(body: dict, on_partial: Callable[[dict], None] | None = None) -> dict:
+    """
+    По request_id и type вызвать нужный обработчик и вернуть результат для публикации в llm.results.
+    on_partial(result) — опубликовать промежуточный результат (частичный ответ на вопрос).
+    """
     request_id = body.get("request_id")
     task_type = body.get("type")
     if not request_id or not task_type:
         raise ValueError("request_id and type required")
     if task_type == "knowledge":
-        return handle_knowledge(
+        result = handle_knowledge(
             request_id,
             body.get("question", ""),
             body.get("role") or "narrator",
+            on_partial,
         )
+        if body.get("cache_key") and result.get("status") == "done":
+            _cache_answer(body, result)
+        return result
     if task_type == "generate":
         return handle_generate(
             request_id,
             body.get("entity_type", "location"),
             body.get("prompt", ""),
+            body.get("count") or 1,
+            body.get("prompts"),
+            on_partial,
         )
     return {
         "request_id": request_id,
@@ -1,22 +1,82 @@
 """Consumer: подписка на RabbitMQ — graph.tasks (запись в Neo4j) и llm.tasks (LLM, результат в llm.results)."""
 import json
 import logging
+import signal
 import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import pika
+from prometheus_client import start_http_server
 
 from app.config import settings
-from app.handlers import handle_event
+from app.export import close_exports
+from app.handlers import handle_event, handle_events_batch
 from app.llm_task_handler import handle_llm_task
+from app.migrations import run_migrations
+from shared.changes import EXCHANGE_GRAPH_CHANGES, build_change_notification
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
 QUEUE_GRAPH_TASKS = "graph.tasks"
 QUEUE_LLM_TASKS = "llm.tasks"
-QUEUE_LLM_RESULTS = "llm.results"
+EXCHANGE_LLM_RESULTS = "llm.results"  # fanout: каждая реплика server получает все результаты
+
+_stopping = threading.Event()
+_consuming: list = []  # (connection, channel) потребителей, которые сейчас слушают очередь
+_consuming_lock = threading.Lock()
+
+
+def request_stop(signum=None, frame=None) -> None:
+    """
+    SIGTERM/SIGINT: перестать брать сообщения. Потоки потребителей дописывают текущее сообщение или
+    пакет, закрывают соединение (неподтверждённые сообщения брокер отдаст заново) и выходят; main
+    после них записывает очередь экспорта на диск (close_exports).
+    """
+    logger.info("Stopping consumers (signal %s)", signum)
+    _stopping.set()
+    with _consuming_lock:
+        consuming = list(_consuming)
+    for connection, channel in consuming:
+        try:
+            connection.add_callback_threadsafe(channel.stop_consuming)
+        except Exception as e:
+            logger.warning("Cannot stop consumer, connection closed: %s", e)
+
+
+def _consume(connection, channel, consume) -> None:
+    """consume() слушает очередь, пока request_stop не вызовет stop_consuming в потоке соединения."""
+    with _consuming_lock:
+        _consuming.append((connection, channel))
+    try:
+        if not _stopping.is_set():
+            consume()
+    finally:
+        with _consuming_lock:
+            _consuming.remove((connection, channel))
+        if _stopping.is_set():
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+def publish_graph_changes(channel, events: list, graph_version: int | None = None) -> None:
+    """
+    Уведомить server о закоммиченных изменениях (fanout graph.changes, по нему сбрасывается кэш чтения).
+    graph_version — версия графа после записи. Публикуется в канал потребителя graph.tasks;
+    ошибка публикации не откатывает уже записанное.
+    """
+    notification = build_change_notification(events, graph_version)
+    if not notification["changes"]:
+        return
+    try:
+        channel.basic_publish(exchange=EXCHANGE_GRAPH_CHANGES, routing_key="", body=json.dumps(notification))
+    except Exception as e:
+        logger.warning("Failed to publish graph changes: %s", e)
 
 
 def on_graph_message(channel, method, properties, body):
@@ -29,22 +89,67 @@ def on_graph_message(channel, method, properties, body):
             logger.error("Missing type in message")
             channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
             return
-        handle_event(event_type, payload)
+        version = handle_event(event_type, payload)
         channel.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
         logger.exception("Failed to process message: %s", e)
         channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    publish_graph_changes(channel, [(event_type, payload)], version)
+
+
+def on_graph_batch(channel, messages: list) -> None:
+    """
+    Пакетная обработка graph.tasks: messages — список (method, body).
+    Битые сообщения отклоняются по одному, остальные пишутся одной транзакцией и
+    подтверждаются одним basic_ack(multiple=True). Если транзакция не прошла —
+    повтор по одному сообщению, чтобы одно плохое событие не блокировало пакет.
+    """
+    events = []
+    tags = []
+    for method, body in messages:
+        try:
+            data = json.loads(body)
+            event_type = data.get("type")
+            if not event_type:
+                raise ValueError("Missing type in message")
+        except Exception as e:
+            logger.error("Invalid graph message: %s", e)
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            continue
+        events.append((event_type, data.get("payload", {})))
+        tags.append(method.delivery_tag)
+    if not events:
+        return
+    try:
+        version = handle_events_batch(events)
+    except Exception as e:
+        logger.exception("Batch of %d events failed, retrying one by one: %s", len(events), e)
+        written = []
+        version = None
+        for (event_type, payload), tag in zip(events, tags):
+            try:
+                version = handle_event(event_type, payload)
+                channel.basic_ack(delivery_tag=tag)
+                written.append((event_type, payload))
+            except Exception as e:
+                logger.exception("Failed to process message: %s", e)
+                channel.basic_nack(delivery_tag=tag, requeue=False)
+        publish_graph_changes(channel, written, version)
+        return
+    channel.basic_ack(delivery_tag=tags[-1], multiple=True)
+    publish_graph_changes(channel, events, version)
 
 
 def publish_llm_result(result: dict) -> None:
-    """Опубликовать результат LLM в очередь llm.results."""
+    """Опубликовать результат LLM в fanout-exchange llm.results."""
     params = pika.URLParameters(settings.rabbitmq_url)
     connection = pika.BlockingConnection(params)
     channel = connection.channel()
-    channel.queue_declare(queue=QUEUE_LLM_RESULTS, durable=True)
+    channel.exchange_declare(exchange=EXCHANGE_LLM_RESULTS, exchange_type="fanout", durable=True)
     channel.basic_publish(
-        exchange="",
-        routing_key=QUEUE_LLM_RESULTS,
+        exchange=EXCHANGE_LLM_RESULTS,
+        routing_key="",
         body=json.dumps(result),
         properties=pika.BasicProperties(delivery_mode=2),
     )
@@ -56,7 +161,8 @@ def on_llm_message(channel, method, properties, body):
     data = None
     try:
         data = json.loads(body)
-        result = handle_llm_task(data)
+        # Поток соединения: частичные ответы публикуются прямо в канал потребителя
+        result = handle_llm_task(data, on_partial=partial(_publish_partial, channel))
         publish_llm_result(result)
         channel.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
@@ -73,46 +179,165 @@ def on_llm_message(channel, method, properties, body):
             pass
 
 
+def _run_llm_task(body: bytes, on_partial=None) -> tuple[dict, bool]:
+    """Выполнить задачу llm.tasks. Возвращает (результат для llm.results, успех)."""
+    data = None
+    try:
+        data = json.loads(body)
+        return handle_llm_task(data, on_partial=on_partial), True
+    except Exception as e:
+        logger.exception("Failed to process LLM task: %s", e)
+        request_id = (data.get("request_id") if isinstance(data, dict) else None) or "unknown"
+        return {"request_id": request_id, "status": "error", "error": str(e)}, False
+
+
+def _publish_partial(channel, result: dict) -> None:
+    """Промежуточный результат (status=partial): не персистентный, потеря не страшна — придёт финальный."""
+    channel.basic_publish(exchange=EXCHANGE_LLM_RESULTS, routing_key="", body=json.dumps(result))
+
+
+def _publish_result_and_ack(channel, delivery_tag: int, result: dict, ok: bool) -> None:
+    """Выполняется в потоке соединения: pika-канал нельзя трогать из потоков пула."""
+    channel.basic_publish(
+        exchange=EXCHANGE_LLM_RESULTS,
+        routing_key="",
+        body=json.dumps(result),
+        properties=pika.BasicProperties(delivery_mode=2),
+    )
+    if ok:
+        channel.basic_ack(delivery_tag=delivery_tag)
+    else:
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+
+
+def _llm_worker(connection, channel, delivery_tag: int, body: bytes) -> None:
+    """Поток пула: долгий вызов LLM, затем публикация и ack через add_callback_threadsafe."""
+
+    def on_partial(result: dict) -> None:
+        connection.add_callback_threadsafe(partial(_publish_partial, channel, result))
+
+    result, ok = _run_llm_task(body, on_partial)
+    try:
+        connection.add_callback_threadsafe(partial(_publish_result_and_ack, channel, delivery_tag, result, ok))
+    except Exception as e:
+        # Соединение уже закрыто: неподтверждённое сообщение брокер отдаст заново
+        logger.warning("Cannot publish LLM result %s, connection closed: %s", result.get("request_id"), e)
+
+
+def _consume_llm_pool(connection, channel, pool: ThreadPoolExecutor) -> None:
+    """prefetch = размер пула: брокер не выдаёт больше задач, чем есть свободных обработчиков."""
+    channel.exchange_declare(exchange=EXCHANGE_LLM_RESULTS, exchange_type="fanout", durable=True)
+    channel.basic_qos(prefetch_count=settings.llm_workers)
+    channel.basic_consume(
+        queue=QUEUE_LLM_TASKS,
+        on_message_callback=lambda ch, method, props, body: pool.submit(
+            _llm_worker, connection, ch, method.delivery_tag, body
+        ),
+    )
+    logger.info("LLM tasks consumer started (workers=%d)", settings.llm_workers)
+    channel.start_consuming()
+
+
+def _consume_graph_batches(connection, channel) -> None:
+    """Собирать до graph_batch_size сообщений или graph_batch_max_wait_ms и писать пакетом."""
+    batch_size = settings.graph_batch_size
+    max_wait = settings.graph_batch_max_wait_ms / 1000
+    batch = []
+    channel.basic_qos(prefetch_count=batch_size)
+    channel.basic_consume(
+        queue=QUEUE_GRAPH_TASKS,
+        on_message_callback=lambda ch, method, props, body: batch.append((method, body)),
+    )
+    logger.info("Graph tasks consumer started (batch_size=%d, max_wait_ms=%d)", batch_size, settings.graph_batch_max_wait_ms)
+    while not _stopping.is_set():
+        connection.process_data_events(time_limit=None)
+        if not batch:
+            continue
+        deadline = time.monotonic() + max_wait
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            connection.process_data_events(time_limit=remaining)
+        messages = batch[:]
+        batch.clear()
+        on_graph_batch(channel, messages)
+
+
 def consume_graph_tasks():
-    """Поток: потребление graph.tasks."""
-    while True:
+    """Поток: потребление graph.tasks (пакетами, если graph_batch_size > 1) до request_stop."""
+    while not _stopping.is_set():
         try:
             params = pika.URLParameters(settings.rabbitmq_url)
             connection = pika.BlockingConnection(params)
             channel = connection.channel()
             channel.queue_declare(queue=QUEUE_GRAPH_TASKS, durable=True)
-            channel.basic_consume(queue=QUEUE_GRAPH_TASKS, on_message_callback=on_graph_message)
-            logger.info("Graph tasks consumer started")
-            channel.start_consuming()
+            channel.exchange_declare(exchange=EXCHANGE_GRAPH_CHANGES, exchange_type="fanout", durable=True)
+            if settings.graph_batch_size > 1:
+                _consume(connection, channel, partial(_consume_graph_batches, connection, channel))
+            else:
+                channel.basic_consume(queue=QUEUE_GRAPH_TASKS, on_message_callback=on_graph_message)
+                logger.info("Graph tasks consumer started")
+                _consume(connection, channel, channel.start_consuming)
         except Exception as e:
             logger.exception("Graph consumer error: %s", e)
-        time.sleep(5)
+        _stopping.wait(5)
 
 
 def consume_llm_tasks():
-    """Поток: потребление llm.tasks."""
-    while True:
+    """Поток: потребление llm.tasks (пулом из llm_workers обработчиков, если llm_workers > 1)."""
+    pool = None
+    if settings.llm_workers > 1:
+        pool = ThreadPoolExecutor(max_workers=settings.llm_workers, thread_name_prefix="llm-worker")
+    while not _stopping.is_set():
         try:
             params = pika.URLParameters(settings.rabbitmq_url)
             connection = pika.BlockingConnection(params)
             channel = connection.channel()
             channel.queue_declare(queue=QUEUE_LLM_TASKS, durable=True)
-            channel.basic_consume(queue=QUEUE_LLM_TASKS, on_message_callback=on_llm_message)
-            logger.info("LLM tasks consumer started")
-            channel.start_consuming()
+            if pool is not None:
+                _consume(connection, channel, partial(_consume_llm_pool, connection, channel, pool))
+            else:
+                channel.basic_qos(prefetch_count=1)
+                channel.basic_consume(queue=QUEUE_LLM_TASKS, on_message_callback=on_llm_message)
+                logger.info("LLM tasks consumer started")
+                _consume(connection, channel, channel.start_consuming)
         except Exception as e:
             logger.exception("LLM consumer error: %s", e)
-        time.sleep(5)
+        _stopping.wait(5)
+    if pool is not None:
+        # Задачи, которые уже выполняются, не ждём: без ack брокер отдаст их другой реплике
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 def main():
-    """Запуск двух потребителей в отдельных потоках."""
-    t1 = threading.Thread(target=consume_graph_tasks, daemon=False)
-    t2 = threading.Thread(target=consume_llm_tasks, daemon=False)
-    t1.start()
-    t2.start()
-    t1.join()
-    t2.join()
+    """
+    Запуск потребителей в отдельных потоках: graph.tasks и/или llm.tasks по consumer_role.
+    SIGTERM/SIGINT останавливают их (request_stop), после чего очередь экспорта записывается на диск.
+    """
+    role = settings.consumer_role
+    if settings.schema_migrations_enabled and role in ("all", "graph"):
+        try:
+            run_migrations()
+        except Exception as e:
+            logger.exception("Schema migrations failed: %s", e)
+    targets = []
+    if role in ("all", "graph"):
+        targets.append(consume_graph_tasks)
+    if role in ("all", "llm"):
+        targets.append(consume_llm_tasks)
+    logger.info("Consumer role: %s", role)
+    if settings.metrics_port:
+        start_http_server(settings.metrics_port)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    threads = [threading.Thread(target=target, daemon=False) for target in targets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    close_exports()
+    logger.info("Consumer stopped")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+"""Prometheus-метрики consumer (HTTP-эндпоинт поднимается в main при metrics_port > 0)."""
+from prometheus_client import Counter, Gauge, Histogram
+
+llm_http_requests_total = Counter(
+    "llm_http_requests_total",
+    "Requests from consumer to llm-service",
+    ["endpoint", "status"],
+)
+llm_http_request_duration_seconds = Histogram(
+    "llm_http_request_duration_seconds",
+    "Duration of requests to llm-service",
+    ["endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+llm_http_in_flight = Gauge(
+    "llm_http_in_flight",
+    "Requests to llm-service currently in flight",
+)
+llm_http_pool_connections = Gauge(
+    "llm_http_pool_connections",
+    "Connections in the shared llm-service client pool by state",
+    ["state"],
+)
+llm_http_pool_max_connections = Gauge(
+    "llm_http_pool_max_connections",
+    "Connection limit of the shared llm-service client pool",
+)
+llm_knowledge_rounds = Histogram(
+    "llm_knowledge_rounds",
+    "LLM calls per answered knowledge question (mode: retrieval_first or search_first)",
+    ["mode"],
+    buckets=(1, 2, 3, 4, 5),
+)
+llm_pre_retrieval_total = Counter(
+    "llm_pre_retrieval_total",
+    "Pre-retrieval for knowledge questions by result (confident, partial, empty, error)",
+    ["result"],
+)
+llm_prompt_tokens = Histogram(
+    "llm_prompt_tokens",
+    "Estimated tokens of a knowledge prompt (system + user) by round",
+    ["round"],
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 8000, 16000),
+)
+llm_context_dropped_records_total = Counter(
+    "llm_context_dropped_records_total",
+    "Context records left out of knowledge prompts by the token budget",
+)
+export_queue_depth = Gauge(
+    "export_queue_depth",
+    "Event batches waiting in the export writer queue",
+)
+export_commit_events = Histogram(
+    "export_commit_events",
+    "Events written to the export segment by one group commit",
+    buckets=(1, 5, 10, 50, 100, 500, 1000),
+)
+export_events_written_total = Counter(
+    "export_events_written_total",
+    "Events written to export segments",
+)
+export_write_failures_total = Counter(
+    "export_write_failures_total",
+    "Events dropped because writing them to the export segment failed",
+)
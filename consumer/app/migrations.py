@@ -0,0 +1,33 @@
+"""Применение общих миграций схемы (shared/schema.py) к Neo4j при старте consumer."""
+import logging
+
+from shared.schema import CURRENT_VERSION_QUERY, RECORD_VERSION_QUERY, pending_migrations
+
+from app.config import settings
+from app.graph import get_driver
+
+logger = logging.getLogger(__name__)
+
+
+def run_migrations() -> int:
+    """Применить недостающие миграции. Возвращает число применённых."""
+    driver = get_driver()
+    with driver.session() as session:
+        record = session.run(CURRENT_VERSION_QUERY).single()
+        current = record["version"] if record else None
+        applied = 0
+        for migration in pending_migrations(current):
+            logger.info("Applying schema migration %d: %s", migration.version, migration.description)
+            for statement in migration.statements:
+                session.run(statement).consume()
+            for backfill in migration.backfills:
+                while True:
+                    record = session.run(backfill, {"batch_size": settings.schema_backfill_batch_size}).single()
+                    if not record or not record["updated"]:
+                        break
+            session.run(
+                RECORD_VERSION_QUERY,
+                {"version": migration.version, "description": migration.description},
+            ).consume()
+            applied += 1
+    return applied
@@ -0,0 +1,314 @@
+"""
+Восстановление графа из экспорта событий (app/export.py): сегменты по index.json и старый events.jsonl.
+
+События читаются потоком, окнами по --window: в окне события одной сущности (тип узла, id) сворачиваются
+в одну запись — create с наложенными поверх update или один update со всеми полями, — и окно пишется
+пакетными UNWIND (те же запросы, что у handle_events_batch) в --workers параллельных транзакций:
+сначала локации, персонажи и понятия, потом сцены (ссылаются на них). В окне у каждой сущности одна
+запись, так что параллельные пакеты не пишут один узел. После окна — +1 к версии графа и checkpoint
+(номер следующего события): прерванный запуск продолжается с него. В конце пересобираются документы
+контекста ролей (shared/role_context.py) всех персонажей и рассказчика.
+
+Смещение — номер строки во всём журнале: сначала events.jsonl (экспорт до сегментов), затем сегменты.
+
+    cd consumer && PYTHONPATH=.:.. python -m app.replay [--dir exports] [--workers 4] [--batch-size 1000]
+        [--window 200000] [--from-offset N | --restart] [--checkpoint exports/replay-checkpoint.json]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from shared.events import EventType, expand_events
+
+from app.config import settings
+from app.export import find_segment, load_index
+from app.graph import (
+    bump_graph_version,
+    create_characters,
+    create_concepts,
+    create_locations,
+    create_scenes,
+    refresh_role_contexts,
+    run_read,
+    update_characters,
+    update_concepts,
+    update_locations,
+    update_scenes,
+    write_in_transaction,
+)
+from app.migrations import run_migrations
+
+logger = logging.getLogger(__name__)
+
+LEGACY_FILE = "events.jsonl"
+CHECKPOINT_FILE = "replay-checkpoint.json"
+
+# Фазы окна: узлы, на которые ссылаются сцены, затем сцены
+_NODE_WRITERS = {
+    EventType.LOCATION_CREATE.value: create_locations,
+    EventType.LOCATION_UPDATE.value: update_locations,
+    EventType.CHARACTER_CREATE.value: create_characters,
+    EventType.CHARACTER_UPDATE.value: update_characters,
+    EventType.CONCEPT_CREATE.value: create_concepts,
+    EventType.CONCEPT_UPDATE.value: update_concepts,
+}
+_SCENE_WRITERS = {
+    EventType.SCENE_CREATE.value: create_scenes,
+    EventType.SCENE_UPDATE.value: update_scenes,
+}
+_WRITERS = {**_NODE_WRITERS, **_SCENE_WRITERS}
+
+
+# --- Чтение журнала ---
+
+
+def _open_lines(path: Path):
+    return gzip.open(path, "rt", encoding="utf-8") if path.suffix == ".gz" else path.open(encoding="utf-8")
+
+
+def _count_lines(path: Path) -> int:
+    count = 0
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            count += chunk.count(b"\n")
+    return count
+
+
+def log_index(directory: str | Path) -> dict:
+    """
+    Индекс всего журнала (как index.json): events.jsonl — первым «закрытым сегментом», сегменты —
+    со смещениями, сдвинутыми на его длину.
+    """
+    directory = Path(directory)
+    segments = []
+    shift = 0
+    legacy = directory / LEGACY_FILE
+    if legacy.exists():
+        shift = _count_lines(legacy)
+        segments.append({"file": LEGACY_FILE, "first_offset": 0, "events": shift, "closed_at": 0})
+    for segment in load_index(directory)["segments"]:
+        segments.append({**segment, "first_offset": shift + segment["first_offset"]})
+    return {"segments": segments}
+
+
+def iter_events(directory: str | Path, start_offset: int = 0) -> Iterator[tuple[int, str, dict]]:
+    """
+    (смещение, тип, payload) начиная с события start_offset. Файл, с которого начинать, находится
+    по индексу (find_segment), предыдущие не читаются. Строки, которые не разбираются (оборванная
+    при сбое запись), пропускаются, но смещение занимают — как и в индексе.
+    """
+    directory = Path(directory)
+    index = log_index(directory)
+    first = find_segment(index, start_offset)
+    if first is None:
+        return
+    segments = index["segments"]
+    for segment in segments[segments.index(first):]:
+        path = directory / segment["file"]
+        if not path.exists():
+            logger.warning("Export segment %s is missing, skipped", path)
+            continue
+        offset = segment["first_offset"]
+        with _open_lines(path) as f:
+            for line in f:
+                if offset >= start_offset:
+                    try:
+                        event = json.loads(line)
+                        yield offset, event["type"], event.get("payload") or {}
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("Skipping unreadable export line at offset %d", offset)
+                offset += 1
+
+
+# --- Свёртка окна ---
+
+
+class Coalescer:
+    """
+    События окна, свёрнутые по сущности: create поглощает всё, что было до него (MERGE + SET всех полей),
+    update поверх create или update добавляет/заменяет поля (location_id, character_ids сцены заменяют
+    связи целиком — как и в update_scenes). Повторный create сцены заменяет прежние связи, а не добавляет
+    к ним: при экспорте через API id сцены создаётся один раз.
+    """
+
+    def __init__(self) -> None:
+        self._ops: dict[tuple[str, str], tuple[str, dict]] = {}  # (тип узла, id) -> (тип события, payload)
+        self._anonymous = 0
+        self.events = 0
+        self.skipped = 0
+
+    def add(self, event_type: str, payload: dict) -> None:
+        for event_type, payload in expand_events([(event_type, payload)]):
+            if event_type not in _WRITERS:
+                self.skipped += 1
+                continue
+            kind, action = event_type.split(".", 1)
+            uid = payload.get("id")
+            if not uid and action != "create":
+                self.skipped += 1
+                continue
+            self.events += 1
+            if not uid:
+                # create без id: id сгенерируется при записи, свернуть не с чем
+                self._anonymous += 1
+                self._ops[(kind, f"\0{self._anonymous}")] = (event_type, payload)
+                continue
+            previous = self._ops.get((kind, uid))
+            if action == "create" or previous is None:
+                self._ops[(kind, uid)] = (event_type, payload)
+            else:
+                self._ops[(kind, uid)] = (previous[0], {**previous[1], **payload})
+
+    def __len__(self) -> int:
+        return len(self._ops)
+
+    def phases(self) -> list[dict[str, list[dict]]]:
+        """[узлы, сцены]: {тип события: payloads}."""
+        nodes: dict[str, list[dict]] = {}
+        scenes: dict[str, list[dict]] = {}
+        for event_type, payload in self._ops.values():
+            (scenes if event_type in _SCENE_WRITERS else nodes).setdefault(event_type, []).append(payload)
+        return [nodes, scenes]
+
+
+# --- Запись ---
+
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def write_window(coalescer: Coalescer, pool: ThreadPoolExecutor, batch_size: int) -> int:
+    """Записать окно: фазы по очереди, пакеты фазы — параллельно. Возвращает число записанных сущностей."""
+    written = 0
+    for phase in coalescer.phases():
+        futures = []
+        for event_type, payloads in phase.items():
+            writer = _WRITERS[event_type]
+            for batch in _chunks(payloads, batch_size):
+                futures.append(pool.submit(write_in_transaction, lambda tx, w=writer, b=batch: w(tx, b)))
+                written += len(batch)
+        for future in futures:
+            future.result()
+    return written
+
+
+def rebuild_role_contexts(pool: ThreadPoolExecutor, batch_size: int) -> int:
+    """Документы контекста всех персонажей (пакетами, параллельно) и рассказчика. Возвращает число ролей."""
+    ids = [r["id"] for r in run_read("MATCH (c:Character) RETURN c.id AS id") if r.get("id")]
+    futures = [
+        pool.submit(write_in_transaction, lambda tx, b=batch: refresh_role_contexts(tx, b, narrator=False))
+        for batch in _chunks(ids, batch_size)
+    ]
+    futures.append(pool.submit(write_in_transaction, lambda tx: refresh_role_contexts(tx, [], narrator=True)))
+    for future in futures:
+        future.result()
+    return len(ids) + 1
+
+
+def load_checkpoint(path: str | Path) -> int:
+    path = Path(path)
+    if not path.exists():
+        return 0
+    return int(json.loads(path.read_text(encoding="utf-8")).get("offset", 0))
+
+
+def save_checkpoint(path: str | Path, offset: int, events: int) -> None:
+    """Атомарно: временный файл + rename."""
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps({"offset": offset, "events": events, "updated_at": time.time()}), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def replay(
+    directory: str | Path,
+    checkpoint: str | Path,
+    start_offset: int | None = None,
+    workers: int = 4,
+    batch_size: int = 1000,
+    window: int = 200000,
+    progress_interval_sec: float = 5.0,
+    role_contexts: bool = True,
+) -> dict:
+    """
+    Проиграть журнал с start_offset (None — с checkpoint). Возвращает сводку:
+    {"start_offset", "offset", "events", "written", "skipped"}.
+    """
+    offset = load_checkpoint(checkpoint) if start_offset is None else start_offset
+    summary = {"start_offset": offset, "offset": offset, "events": 0, "written": 0, "skipped": 0}
+    started = last_report = time.monotonic()
+    coalescer = Coalescer()
+
+    def flush(next_offset: int) -> None:
+        nonlocal coalescer
+        if len(coalescer):
+            summary["written"] += write_window(coalescer, pool, batch_size)
+            write_in_transaction(bump_graph_version)
+        summary["events"] += coalescer.events
+        summary["skipped"] += coalescer.skipped
+        summary["offset"] = next_offset
+        save_checkpoint(checkpoint, next_offset, summary["events"])
+        coalescer = Coalescer()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="replay") as pool:
+        for event_offset, event_type, payload in iter_events(directory, offset):
+            coalescer.add(event_type, payload)
+            if coalescer.events + coalescer.skipped >= window:
+                flush(event_offset + 1)
+            now = time.monotonic()
+            if now - last_report >= progress_interval_sec:
+                last_report = now
+                done = summary["events"] + coalescer.events
+                logger.info(
+                    "Replay: offset %d, %d events (%.0f/s), %d entities written",
+                    event_offset + 1, done, done / (now - started), summary["written"],
+                )
+            summary["offset"] = event_offset + 1
+        flush(summary["offset"])
+        if role_contexts and settings.role_context_enabled and summary["written"]:
+            logger.info("Replay: rebuilt %d role context documents", rebuild_role_contexts(pool, batch_size))
+    logger.info(
+        "Replay done: offset %d, %d events -> %d entities, %d skipped in %.1fs",
+        summary["offset"], summary["events"], summary["written"], summary["skipped"], time.monotonic() - started,
+    )
+    return summary
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=settings.export_dir, help="Export directory (default: EXPORT_DIR)")
+    parser.add_argument("--checkpoint", help=f"Checkpoint file (default: <dir>/{CHECKPOINT_FILE})")
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument("--from-offset", type=int, help="Start at this event offset, ignoring the checkpoint")
+    start.add_argument("--restart", action="store_true", help="Start from the first event")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel write transactions")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Entities per UNWIND transaction")
+    parser.add_argument("--window", type=int, default=200000, help="Events coalesced between checkpoints")
+    parser.add_argument("--skip-role-contexts", action="store_true", help="Do not rebuild role context documents")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    if settings.schema_migrations_enabled:
+        run_migrations()
+    replay(
+        args.dir,
+        args.checkpoint or Path(args.dir) / CHECKPOINT_FILE,
+        start_offset=0 if args.restart else args.from_offset,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        window=args.window,
+        role_contexts=not args.skip_role_contexts,
+    )
+
+
+if __name__ == "__main__":
+    main()
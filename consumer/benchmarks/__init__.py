@@ -0,0 +1 @@
+"""Benchmarks against a real Neo4j / local stubs (run manually, not part of the test suite)."""
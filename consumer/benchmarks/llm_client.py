@@ -0,0 +1,95 @@
+"""
+Benchmark: consumer -> llm-service calls — new httpx.Client per call (old) vs the shared pooled client.
+
+Starts a local stub llm-service (HTTP/1.1 keep-alive, answers /chat instantly), so the numbers are
+pure per-round client overhead: client construction, TCP connect, connection teardown.
+
+    cd consumer && PYTHONPATH=.:.. python -m benchmarks.llm_client --calls 500 --threads 1 4
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from app import llm_client
+from app.config import settings
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    connections = 0
+
+    def setup(self) -> None:
+        super().setup()
+        type(self).connections += 1
+
+    def do_POST(self) -> None:  # noqa: N802
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = json.dumps({"answer": "ANSWER: ok"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_stub() -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def legacy_call(url: str) -> str:
+    """Pre-pool implementation: a new client (and TCP connection) per call."""
+    with httpx.Client(timeout=120.0) as client:
+        r = client.post(f"{url}/chat", json={"prompt": "q", "system": None})
+        r.raise_for_status()
+        return r.json().get("answer", "")
+
+
+def pooled_call(url: str) -> str:
+    return llm_client.post_json("/chat", {"prompt": "q", "system": None}).get("answer", "")
+
+
+def run(call, url: str, calls: int, threads: int) -> tuple[float, int]:
+    """Returns (seconds, TCP connections opened)."""
+    before = _StubHandler.connections
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: call(url), range(calls)))
+    return time.perf_counter() - start, _StubHandler.connections - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    server, url = start_stub()
+    settings.llm_service_url = url
+    try:
+        print(f"{'threads':>7} {'variant':>8} {'total s':>8} {'ms/call':>8} {'conns':>6}")
+        for threads in args.threads:
+            settings.llm_workers = threads
+            llm_client.close_client()
+            for name, call in (("legacy", legacy_call), ("pooled", pooled_call)):
+                call(url)  # warm-up (imports, first connection)
+                seconds, conns = run(call, url, args.calls, threads)
+                print(f"{threads:>7} {name:>8} {seconds:>8.3f} {seconds / args.calls * 1000:>8.3f} {conns:>6}")
+    finally:
+        llm_client.close_client()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark: scene create/update — per-character statements (old) vs one UNWIND statement (current).
+
+Needs a running Neo4j (NEO4J_URI / NEO4J_USER / NEO4J_PASSWORD as for the consumer). Writes nodes
+with ids prefixed "bench-scene-" and deletes them at the end.
+
+    cd consumer && PYTHONPATH=.:.. python -m benchmarks.scene_writes --cast 1 5 10 30 100 --repeat 20
+"""
+import argparse
+import statistics
+import time
+
+from app.graph import create_scenes, get_driver, run_write, update_scenes, write_in_transaction
+
+PREFIX = "bench-scene-"
+
+
+class RoundTripCounter:
+    """Counts Session.run / Transaction.run calls (one round trip each)."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __enter__(self):
+        from neo4j import ManagedTransaction, Session, Transaction
+
+        self._patched = []
+        for cls in (Session, Transaction, ManagedTransaction):
+            original = cls.run
+
+            def counted(obj, *args, _original=original, **kwargs):
+                self.count += 1
+                return _original(obj, *args, **kwargs)
+
+            self._patched.append((cls, cls.__dict__.get("run")))
+            cls.run = counted
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for cls, own in self._patched:
+            if own is None:
+                del cls.run
+            else:
+                cls.run = own
+
+
+def legacy_create_scene(payload: dict) -> None:
+    """Pre-UNWIND implementation: one statement (and session) per character."""
+    run_write(
+        """
+        MERGE (s:Scene {id: $id}) SET s.title = $title, s.description = $description
+        WITH s
+        OPTIONAL MATCH (l:Location {id: $location_id})
+        FOREACH (_ IN CASE WHEN l IS NOT NULL THEN [1] ELSE [] END |
+            MERGE (s)-[:TAKES_PLACE_IN]->(l)
+        )
+        """,
+        {k: payload[k] for k in ("id", "title", "description", "location_id")},
+    )
+    for cid in payload["character_ids"]:
+        run_write(
+            "MATCH (s:Scene {id: $scene_id}) MATCH (c:Character {id: $char_id}) MERGE (s)-[:FEATURES]->(c)",
+            {"scene_id": payload["id"], "char_id": cid},
+        )
+
+
+def legacy_update_characters(scene_id: str, character_ids: list[str]) -> None:
+    run_write("MATCH (s:Scene {id: $id}) OPTIONAL MATCH (s)-[r:FEATURES]->() DELETE r", {"id": scene_id})
+    for cid in character_ids:
+        run_write(
+            "MATCH (s:Scene {id: $scene_id}) MATCH (c:Character {id: $char_id}) MERGE (s)-[:FEATURES]->(c)",
+            {"scene_id": scene_id, "char_id": cid},
+        )
+
+
+def _seed(max_cast: int) -> None:
+    run_write(f"MERGE (l:Location {{id: '{PREFIX}loc'}}) SET l.name = 'Bench location'")
+    run_write(
+        "UNWIND range(0, $n - 1) AS i MERGE (c:Character {id: $prefix + 'char-' + toString(i)}) "
+        "SET c.name = 'Bench character ' + toString(i)",
+        {"n": max_cast, "prefix": PREFIX},
+    )
+
+
+def _cleanup() -> None:
+    run_write("MATCH (n) WHERE n.id STARTS WITH $prefix DETACH DELETE n", {"prefix": PREFIX})
+
+
+def _measure(fn, repeat: int) -> tuple[float, int]:
+    timings = []
+    with RoundTripCounter() as counter:
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn(i)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, counter.count // repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cast", type=int, nargs="+", default=[1, 5, 10, 30, 100])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    _cleanup()
+    _seed(max(args.cast))
+    print(f"{'cast':>5} | {'op':<6} | {'legacy ms':>9} | {'legacy rt':>9} | {'unwind ms':>9} | {'unwind rt':>9}")
+    try:
+        for cast in args.cast:
+            chars = [f"{PREFIX}char-{i}" for i in range(cast)]
+
+            def payload(i: int, variant: str) -> dict:
+                return {
+                    "id": f"{PREFIX}{variant}-{cast}-{i}",
+                    "title": f"Scene {i}",
+                    "description": "",
+                    "location_id": f"{PREFIX}loc",
+                    "character_ids": chars,
+                }
+
+            legacy_ms, legacy_rt = _measure(lambda i: legacy_create_scene(payload(i, "legacy")), args.repeat)
+            unwind_ms, unwind_rt = _measure(
+                lambda i: write_in_transaction(lambda tx: create_scenes(tx, [payload(i, "unwind")])), args.repeat
+            )
+            print(f"{cast:>5} | {'create':<6} | {legacy_ms:>9.2f} | {legacy_rt:>9} | {unwind_ms:>9.2f} | {unwind_rt:>9}")
+
+            legacy_ms, legacy_rt = _measure(
+                lambda i: legacy_update_characters(f"{PREFIX}legacy-{cast}-{i}", chars[::-1]), args.repeat
+            )
+            unwind_ms, unwind_rt = _measure(
+                lambda i: write_in_transaction(
+                    lambda tx: update_scenes(tx, [{"id": f"{PREFIX}unwind-{cast}-{i}", "character_ids": chars[::-1]}])
+                ),
+                args.repeat,
+            )
+            print(f"{cast:>5} | {'update':<6} | {legacy_ms:>9.2f} | {legacy_rt:>9} | {unwind_ms:>9.2f} | {unwind_rt:>9}")
+    finally:
+        _cleanup()
+        get_driver().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,27 @@
 """Pytest fixtures for consumer."""
+from unittest.mock import patch
+
 import pytest
+
+from app.export import close_exports
+
+
+@pytest.fixture(autouse=True)
+def no_pre_retrieval():
+    """Вопросы по базе знаний в тестах не ходят в Neo4j за предвыборкой (по умолчанию — ничего не найдено)."""
+    with patch("app.llm_task_handler.retrieve_context", return_value=[]) as mock_retrieve:
+        yield mock_retrieve
+
+
+@pytest.fixture(autouse=True)
+def no_role_context():
+    """Контекст роли в тестах обработчика LLM не читается из Neo4j (по умолчанию — пустой)."""
+    with patch("app.llm_task_handler.get_role_context", return_value="") as mock_context:
+        yield mock_context
+
+
+@pytest.fixture(autouse=True)
+def close_export_writers():
+    """Фоновые писатели экспорта (по одному на каталог tmp_path) останавливаются после каждого теста."""
+    yield
+    close_exports()
@@ -0,0 +1,50 @@
+"""Tests for the knowledge prompt context assembler (relevance, dedup, token budget)."""
+from app.context import NO_DATA, ContextAssembler, estimate_tokens
+
+
+def _record(i, name, snippet=""):
+    return {"type": "Concept", "id": f"k{i}", "name": name, "snippet": snippet}
+
+
+def test_estimate_tokens_splits_long_words_and_punctuation():
+    assert estimate_tokens("кот") == 1
+    assert estimate_tokens("таверна, кот!") == 5
+    assert estimate_tokens("") == 0
+
+
+def test_empty_context():
+    assert ContextAssembler("Кто такой Иван?", 100).render() == NO_DATA
+
+
+def test_records_ordered_by_relevance_to_question():
+    context = ContextAssembler("Где живёт Иван?", 1000)
+    context.add_search("люди", [_record(1, "Мария", "Пекарь"), _record(2, "Иван", "Кузнец")])
+    lines = context.render().splitlines()
+    assert lines[0] == "[Concept] Иван: Кузнец"
+    assert lines[1] == "[Concept] Мария: Пекарь"
+
+
+def test_duplicates_ignored_and_reported_as_nothing_new():
+    context = ContextAssembler("Иван", 1000)
+    assert context.add_search("Иван", [_record(1, "Иван")]) == 1
+    assert context.add_search("кузнец", [_record(1, "Иван")]) == 0
+    text = context.render()
+    assert text.count("[Concept] Иван") == 1
+    assert "Ничего нового не нашли: «кузнец»." in text
+
+
+def test_retrieved_scenes_cover_later_search_hits():
+    context = ContextAssembler("Иван", 1000)
+    context.add_retrieved([{"type": "Character", "id": "c1", "name": "Иван", "description": "",
+                            "scenes": [{"id": "s1", "title": "Кузня"}]}])
+    assert context.add_search("кузня", [{"type": "Scene", "id": "s1", "name": "Кузня"}]) == 0
+
+
+def test_budget_drops_least_relevant_records():
+    context = ContextAssembler("Иван", 40)
+    context.add_search("все", [_record(i, f"Сущность{i}", "описание " * 5) for i in range(5)] + [_record(9, "Иван")])
+    text = context.render()
+    assert text.startswith("[Concept] Иван")
+    assert context.dropped > 0
+    assert f"(ещё {context.dropped} записей не поместились в контекст)" in text
+    assert estimate_tokens(text) <= 40 + estimate_tokens(text.splitlines()[-1])
@@ -0,0 +1,159 @@
+"""Tests for the background export writer."""
+import gzip
+import json
+import time
+from unittest.mock import patch
+
+from app.export import ExportWriter, find_segment, load_index, segment_file
+from app.metrics import export_write_failures_total
+
+
+def _lines(start: int, count: int) -> list[str]:
+    return [json.dumps({"type": "location.create", "payload": {"id": f"loc-{i}"}}) + "\n" for i in range(start, start + count)]
+
+
+def test_writes_lines_in_order_and_indexes_open_segment(tmp_path):
+    writer = ExportWriter(tmp_path)
+    writer.write(_lines(0, 3))
+    writer.write(_lines(3, 2))
+    assert writer.flush(timeout=5)
+    ids = [json.loads(line)["payload"]["id"] for line in (tmp_path / segment_file(1)).read_text().splitlines()]
+    assert ids == [f"loc-{i}" for i in range(5)]
+    writer.close()
+    [segment] = load_index(tmp_path)["segments"]
+    assert segment["file"] == segment_file(1)
+    assert (segment["first_offset"], segment["events"], segment["closed_at"]) == (0, 5, None)
+
+
+def test_rotates_by_size_and_compresses_closed_segments(tmp_path):
+    writer = ExportWriter(tmp_path, segment_max_bytes=200, compress=True)
+    for start in range(0, 12, 2):
+        writer.write(_lines(start, 2))
+        writer.flush(timeout=5)
+    writer.close()
+    index = load_index(tmp_path)
+    # По 4 события (~230 байт) в сегменте; последний, пустой, ещё открыт
+    assert [(s["first_offset"], s["events"]) for s in index["segments"]] == [(0, 4), (4, 4), (8, 4), (12, 0)]
+    assert [s["file"] for s in index["segments"][:3]] == [segment_file(n, compressed=True) for n in (1, 2, 3)]
+    assert not (tmp_path / segment_file(1)).exists()
+    # find_segment находит событие по смещению без чтения файлов
+    segment = find_segment(index, 7)
+    assert segment["segment"] == 2
+    with gzip.open(tmp_path / segment["file"], "rt") as f:
+        line = f.read().splitlines()[7 - segment["first_offset"]]
+    assert json.loads(line)["payload"]["id"] == "loc-7"
+    assert find_segment(index, -1) is None
+
+
+def test_rotates_by_age(tmp_path):
+    writer = ExportWriter(tmp_path, segment_max_age_sec=0, compress=False)
+    writer.write(_lines(0, 1))
+    writer.flush(timeout=5)
+    writer.close()
+    first = load_index(tmp_path)["segments"][0]
+    assert first["closed_at"] is not None
+    assert (tmp_path / segment_file(1)).exists()
+
+
+def test_restart_continues_open_segment_after_torn_line(tmp_path):
+    writer = ExportWriter(tmp_path)
+    writer.write(_lines(0, 2))
+    writer.close()
+    with (tmp_path / segment_file(1)).open("a") as f:
+        f.write('{"type": "location.cre')  # строка, оборванная при сбое
+
+    writer = ExportWriter(tmp_path)
+    writer.write(_lines(2, 1))
+    writer.close()
+    lines = (tmp_path / segment_file(1)).read_text().splitlines()
+    assert json.loads(lines[-1])["payload"]["id"] == "loc-2"
+    assert load_index(tmp_path)["segments"][0]["events"] == 4
+
+
+def test_fsync_policy(tmp_path):
+    with patch("app.export.os.fsync") as mock_fsync:
+        writer = ExportWriter(tmp_path / "never", fsync="never")
+        writer.write(_lines(0, 1))
+        writer.write(_lines(1, 1))
+        writer.close()
+    assert mock_fsync.call_count == 1  # только при закрытии
+
+    with patch("app.export.os.fsync") as mock_fsync:
+        writer = ExportWriter(tmp_path / "always", fsync="always", fsync_interval_sec=3600)
+        writer.write(_lines(0, 1))
+        writer.flush(timeout=5)
+        writer.write(_lines(1, 1))
+        writer.close()
+    assert mock_fsync.call_count >= 3
+
+
+def test_write_failure_releases_flush_and_counts_events(tmp_path):
+    writer = ExportWriter(tmp_path)
+    failures = export_write_failures_total._value.get()
+    with patch.object(writer, "_write_lines", side_effect=OSError(28, "No space left on device")):
+        writer.write(_lines(0, 3))
+        assert writer.flush(timeout=5)
+    assert export_write_failures_total._value.get() - failures == 3
+    # Писатель жив: следующие события пишутся
+    writer.write(_lines(3, 1))
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert load_index(tmp_path)["segments"][0]["events"] == 1
+
+
+def _ids(path) -> list[str]:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt") as f:
+        return [json.loads(line)["payload"]["id"] for line in f.read().splitlines()]
+
+
+def test_failed_rotation_on_write_keeps_current_segment(tmp_path):
+    writer = ExportWriter(tmp_path, segment_max_bytes=100, fsync="never", compress=False)
+    failures = export_write_failures_total._value.get()
+    with patch("app.export.os.fsync", side_effect=OSError(5, "Input/output error")):
+        writer.write(_lines(0, 2))
+        assert writer.flush(timeout=5)
+    # Ротация не удалась: события записаны в текущий сегмент, он открыт
+    assert [s["events"] for s in writer._index["segments"]] == [2]
+    writer.write(_lines(2, 1))
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert export_write_failures_total._value.get() == failures
+    segments = load_index(tmp_path)["segments"]
+    assert [(s["first_offset"], s["events"]) for s in segments] == [(0, 3), (3, 0)]
+    assert _ids(tmp_path / segments[0]["file"]) == ["loc-0", "loc-1", "loc-2"]
+
+
+def test_idle_rotation_survives_failed_compression_and_retries(tmp_path):
+    with patch("app.export.IDLE_SEC", 0.01), patch("app.export.COMPRESS_RETRY_SEC", 0.05):
+        writer = ExportWriter(tmp_path, segment_max_age_sec=3600, compress=True)
+        writer.write(_lines(0, 2))
+        assert writer.flush(timeout=5)
+        with patch("app.export.gzip.open", side_effect=OSError(28, "No space left on device")):
+            writer._segment_max_age_sec = 0  # ротация — в простое
+            deadline = time.monotonic() + 5
+            while len(writer._index["segments"]) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            writer._segment_max_age_sec = 3600
+        assert writer._thread.is_alive()
+        # Новый сегмент уже открыт: запись идёт, несжатый закрытый сегмент сожмётся при повторе
+        writer.write(_lines(2, 1))
+        assert writer.flush(timeout=5)
+        deadline = time.monotonic() + 5
+        while not writer._index["segments"][0]["file"].endswith(".gz") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.close()
+    first, second = load_index(tmp_path)["segments"]
+    assert first["file"] == segment_file(1, compressed=True) and not (tmp_path / segment_file(1)).exists()
+    assert _ids(tmp_path / first["file"]) == ["loc-0", "loc-1"]
+    assert _ids(tmp_path / second["file"]) == ["loc-2"]
+
+
+def test_stopped_writer_does_not_block_write_or_flush(tmp_path):
+    writer = ExportWriter(tmp_path, queue_size=1)
+    writer.close()
+    failures = export_write_failures_total._value.get()
+    writer.write(_lines(0, 2))
+    writer.write(_lines(2, 2))
+    assert writer.flush() is False
+    assert export_write_failures_total._value.get() - failures == 4
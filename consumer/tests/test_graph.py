@@ -3,21 +3,34 @@ from unittest.mock import patch, MagicMock
 
 import pytest
 
+from shared.role_context import missing_character_context
+
 from app import graph as graph_module
 from app.graph import (
     ensure_id,
     get_driver,
-    create_location,
-    update_location,
-    create_character,
-    update_character,
-    create_scene,
-    update_scene,
-    create_concept,
-    update_concept,
+    create_locations,
+    update_characters,
+    update_locations,
+    create_scenes,
+    update_scenes,
+    write_in_transaction,
+    search_graph,
 )
 
 
+def _tx_session(mock_get_driver):
+    """Session mock whose execute_write runs the work function against a tx mock."""
+    mock_session = MagicMock()
+    mock_tx = MagicMock()
+    mock_session.execute_write.side_effect = lambda work: work(mock_tx)
+    mock_driver = MagicMock()
+    mock_driver.session.return_value.__enter__ = lambda self: mock_session
+    mock_driver.session.return_value.__exit__ = lambda *a: None
+    mock_get_driver.return_value = mock_driver
+    return mock_session, mock_tx
+
+
 def test_ensure_id_with_id():
     assert ensure_id({"id": "custom-1"}) == "custom-1"
 
@@ -28,229 +41,186 @@ def test_ensure_id_without_id():
     assert len(uid) == 36  # uuid4 hex
 
 
-@patch("app.graph.get_driver")
-def test_create_location(mock_get_driver):
-    mock_session = MagicMock()
+@patch("app.graph.GraphDatabase")
+def test_get_driver_creates_driver(mock_graph_db):
+    """Covers get_driver when _driver is None (lines 15-20)."""
     mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = create_location({"id": "loc-1", "name": "Tavern", "description": "A tavern"})
-    assert uid == "loc-1"
-    mock_session.run.assert_called()
+    mock_graph_db.driver.return_value = mock_driver
+    graph_module._driver = None
+    try:
+        driver = get_driver()
+        assert driver is mock_driver
+        mock_graph_db.driver.assert_called_once()
+    finally:
+        graph_module._driver = None
 
 
-@patch("app.graph.get_driver")
-def test_update_location(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_location({"id": "loc-1", "name": "New Tavern"})
-    assert uid == "loc-1"
-    mock_session.run.assert_called()
+# --- Batch writers (UNWIND in caller's transaction) ---
 
 
-@patch("app.graph.get_driver")
-def test_update_location_with_description_only(mock_get_driver):
+def test_write_in_transaction_uses_execute_write():
     mock_session = MagicMock()
     mock_driver = MagicMock()
     mock_driver.session.return_value.__enter__ = lambda self: mock_session
     mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_location({"id": "loc-1", "description": "New description"})
-    assert uid == "loc-1"
-    mock_session.run.assert_called_once()
-    params = mock_session.run.call_args[0][1]
-    assert params.get("description") == "New description"
+    work = MagicMock()
+    with patch("app.graph.get_driver", return_value=mock_driver):
+        write_in_transaction(work)
+    mock_session.execute_write.assert_called_once_with(work)
 
 
-@patch("app.graph.get_driver")
-def test_update_location_with_name_and_description(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_location({"id": "loc-1", "name": "Tavern", "description": "A tavern"})
-    assert uid == "loc-1"
-    assert mock_session.run.call_count >= 1
+def test_create_locations_single_unwind():
+    tx = MagicMock()
+    ids = create_locations(tx, [{"id": "l1", "name": "A"}, {"id": "l2", "name": "B", "description": "d"}])
+    assert ids == ["l1", "l2"]
+    tx.run.assert_called_once()
+    query, params = tx.run.call_args[0]
+    assert "UNWIND $rows" in query
+    assert params["rows"][1] == {"id": "l2", "name": "B", "name_norm": "b", "description": "d"}
 
 
-@patch("app.graph.get_driver")
-def test_create_character(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = create_character({"id": "c1", "name": "Alice", "description": ""})
-    assert uid == "c1"
+def test_update_characters_only_passed_fields():
+    tx = MagicMock()
+    update_characters(tx, [{"id": "c1", "name": "Alice"}, {"id": "c2"}])
+    query, params = tx.run.call_args[0]
+    assert "SET n += row.props" in query
+    assert params["rows"] == [{"id": "c1", "props": {"name": "Alice", "name_norm": "alice"}}]
 
 
-@patch("app.graph.get_driver")
-def test_create_scene(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = create_scene({
-        "id": "s1",
-        "title": "Meet",
-        "description": "",
-        "location_id": "loc-1",
-        "character_ids": ["c1"],
-    })
-    assert uid == "s1"
+def test_update_locations_description_only_keeps_name():
+    tx = MagicMock()
+    update_locations(tx, [{"id": "l1", "description": "New description"}])
+    assert tx.run.call_args[0][1]["rows"] == [{"id": "l1", "props": {"description": "New description"}}]
 
 
-@patch("app.graph.get_driver")
-def test_create_scene_with_multiple_characters(mock_get_driver):
-    """Covers run_write inside character_ids loop (line ~110)."""
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = create_scene({
-        "id": "s1",
-        "title": "Meet",
-        "description": "",
-        "location_id": "loc-1",
-        "character_ids": ["c1", "c2"],
-    })
-    assert uid == "s1"
-    # First run_write for MERGE Scene, then one per character for FEATURES
-    assert mock_session.run.call_count >= 3
+def test_create_scenes_rows():
+    tx = MagicMock()
+    create_scenes(tx, [{"id": "s1", "title": "Meet", "location_id": "l1", "character_ids": ["c1", "", "c2"]}])
+    tx.run.assert_called_once()
+    row = tx.run.call_args[0][1]["rows"][0]
+    assert row["character_ids"] == ["c1", "c2"]
+    assert row["location_id"] == "l1"
 
 
-@patch("app.graph.get_driver")
-def test_create_concept(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = create_concept({"id": "concept-1", "name": "Magic", "description": ""})
-    assert uid == "concept-1"
+def test_update_scenes_flags():
+    tx = MagicMock()
+    update_scenes(tx, [{"id": "s1", "title": "New"}, {"id": "s2", "character_ids": ["c1"]}])
+    rows = tx.run.call_args[0][1]["rows"]
+    assert rows[0]["props"] == {"title": "New", "title_norm": "new"}
+    assert rows[0]["set_location"] is False and rows[0]["set_characters"] is False
+    assert rows[1]["set_characters"] is True and rows[1]["character_ids"] == ["c1"]
 
 
-@patch("app.graph.get_driver")
-def test_update_character(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_character({"id": "c1", "name": "Alice Updated"})
-    assert uid == "c1"
+def test_search_graph_fulltext():
+    with patch("app.graph.run_read", return_value=[{"type": "Location", "id": "l1"}]) as mock_read:
+        assert search_graph("таверна") == [{"type": "Location", "id": "l1"}]
+    assert "db.index.fulltext.queryNodes" in mock_read.call_args[0][0]
 
 
-@patch("app.graph.get_driver")
-def test_update_character_with_description_only(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_character({"id": "c1", "description": "Hero"})
-    assert uid == "c1"
-    mock_session.run.assert_called_once()
+def test_search_graph_falls_back_to_regex():
+    from neo4j.exceptions import ClientError
 
+    with patch("app.graph.run_read", side_effect=[ClientError("no index"), []]) as mock_read:
+        assert search_graph("таверна") == []
+    assert "=~ $pattern" in mock_read.call_args_list[1][0][0]
 
-@patch("app.graph.get_driver")
-def test_update_character_with_name_and_description(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_character({"id": "c1", "name": "Alice", "description": "Hero"})
-    assert uid == "c1"
-    mock_session.run.assert_called_once()
 
+def test_search_graph_falls_back_to_regex_when_fulltext_finds_nothing():
+    with patch("app.graph.run_read", side_effect=[[], [{"type": "Location", "id": "l1"}]]) as mock_read:
+        assert search_graph("замок на холме") == [{"type": "Location", "id": "l1"}]
+    assert "=~ $pattern" in mock_read.call_args_list[1][0][0]
 
-@patch("app.graph.get_driver")
-def test_update_scene(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_scene({"id": "s1", "title": "Updated Scene"})
-    assert uid == "s1"
 
+def test_retrieve_context_one_query_with_scene_neighbourhood():
+    from app.graph import retrieve_context
 
-@patch("app.graph.get_driver")
-def test_update_scene_with_title_and_description(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_scene({"id": "s1", "title": "New", "description": "Desc"})
-    assert uid == "s1"
-    mock_session.run.assert_called()
+    with patch("app.graph.run_read", return_value=[{"type": "Character", "id": "c1", "scenes": []}]) as mock_read:
+        assert retrieve_context("Кто такой Иван?", limit=3, scenes_per_entity=2)[0]["id"] == "c1"
+    query, params = mock_read.call_args[0]
+    assert "db.index.fulltext.queryNodes" in query and "TAKES_PLACE_IN|FEATURES" in query
+    assert params["query"] == "иван^3 OR иван~1"  # «кто», «такой» — стоп-слова индекса
+    assert params["limit"] == 3 and params["scenes"] == 2
 
 
-@patch("app.graph.get_driver")
-def test_update_scene_with_location_id(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_scene({"id": "s1", "location_id": "loc-2"})
-    assert uid == "s1"
-    assert mock_session.run.call_count >= 1
+def test_retrieve_context_without_words_skips_query():
+    from app.graph import retrieve_context
 
+    with patch("app.graph.run_read") as mock_read:
+        assert retrieve_context("?!") == []
+    mock_read.assert_not_called()
 
-@patch("app.graph.get_driver")
-def test_update_scene_with_character_ids(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_scene({"id": "s1", "character_ids": ["c1", "c2"]})
-    assert uid == "s1"
-    assert mock_session.run.call_count >= 2
 
+def test_bump_graph_version_returns_new_version():
+    from app.graph import bump_graph_version
 
-@patch("app.graph.get_driver")
-def test_update_concept(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_concept({"id": "concept-1", "description": "Updated"})
-    assert uid == "concept-1"
+    tx = MagicMock()
+    tx.run.return_value.single.return_value = {"version": 5}
+    assert bump_graph_version(tx) == 5
+    query, params = tx.run.call_args[0]
+    assert "MERGE (v:GraphVersion" in query
+    assert params == {"id": "graph"}
 
 
 @patch("app.graph.get_driver")
-def test_update_concept_with_name_and_description(mock_get_driver):
-    mock_session = MagicMock()
-    mock_driver = MagicMock()
-    mock_driver.session.return_value.__enter__ = lambda self: mock_session
-    mock_driver.session.return_value.__exit__ = lambda *a: None
-    mock_get_driver.return_value = mock_driver
-    uid = update_concept({"id": "concept-1", "name": "Magic", "description": "Updated"})
-    assert uid == "concept-1"
-    mock_session.run.assert_called_once()
+def test_store_cached_answer_upserts_and_purges_expired(mock_get_driver):
+    from app.graph import store_cached_answer
 
+    _, mock_tx = _tx_session(mock_get_driver)
+    store_cached_answer("3:abc", "Ответ", "narrator", 60)
+    (store_query, store_params), (purge_query, _) = (c[0] for c in mock_tx.run.call_args_list)
+    assert "MERGE (c:AnswerCache {key: $key})" in store_query
+    assert store_params == {"key": "3:abc", "answer": "Ответ", "role": "narrator", "ttl_ms": 60000}
+    assert "c.expires_at < timestamp()" in purge_query
 
-@patch("app.graph.GraphDatabase")
-def test_get_driver_creates_driver(mock_graph_db):
-    """Covers get_driver when _driver is None (lines 15-20)."""
-    mock_driver = MagicMock()
-    mock_graph_db.driver.return_value = mock_driver
-    graph_module._driver = None
-    try:
-        driver = get_driver()
-        assert driver is mock_driver
-        mock_graph_db.driver.assert_called_once()
-    finally:
-        graph_module._driver = None
+
+def test_refresh_role_contexts_writes_documents_in_one_statement():
+    from app.graph import refresh_role_contexts
+
+    tx = MagicMock()
+    character = {"id": "c1", "name": "Иван", "description": "Кузнец", "scenes": [{"title": "Кузня", "location": "Деревня"}]}
+    narrator = {"location_count": 1, "character_count": 1, "concept_count": 0, "locations": ["Деревня"],
+                "characters": ["Иван"], "concepts": []}
+    tx.run.side_effect = [[character], MagicMock(single=MagicMock(return_value=narrator)), None]
+    texts = refresh_role_contexts(tx, {"c1"}, True)
+    assert texts["c1"] == "Персонаж: Иван. Кузнец Участвует в сценах: Кузня (локация: Деревня)"
+    assert texts["narrator"] == "Контекст мира (граф): Location: Деревня; Character: Иван"
+    query, params = tx.run.call_args[0]
+    assert "MERGE (r:RoleContext {role: row.role})" in query
+    assert [row["role"] for row in params["rows"]] == ["c1", "narrator"]
+
+
+def test_get_role_context_single_lookup():
+    from app.graph import get_role_context
+
+    with patch("app.graph.run_read", return_value=[{"text": "Персонаж: Иван."}]) as mock_read, \
+            patch("app.graph.write_in_transaction") as mock_write:
+        assert get_role_context("c1") == "Персонаж: Иван."
+    assert mock_read.call_args[0][1] == {"role": "c1"}
+    mock_write.assert_not_called()
+
+
+def test_get_role_context_unknown_character_skips_write():
+    from app.graph import get_role_context
+
+    with patch("app.graph.run_read", return_value=[{"text": None, "character": False}]), \
+            patch("app.graph.write_in_transaction") as mock_write:
+        assert get_role_context("no-such-id") == missing_character_context("no-such-id")
+    mock_write.assert_not_called()
+
+
+def test_get_role_context_builds_document_of_existing_character():
+    from app.graph import get_role_context
+
+    with patch("app.graph.run_read", return_value=[{"text": None, "character": True}]), \
+            patch("app.graph.write_in_transaction", return_value={"c1": "Персонаж: Иван."}) as mock_write:
+        assert get_role_context("c1") == "Персонаж: Иван."
+    mock_write.assert_called_once()
+
+
+def test_get_role_context_builds_missing_document():
+    from app.graph import get_role_context
+
+    with patch("app.graph.run_read", return_value=[]), \
+            patch("app.graph.write_in_transaction", return_value={"narrator": "Мир"}) as mock_write:
+        assert get_role_context("") == "Мир"
+    mock_write.assert_called_once()
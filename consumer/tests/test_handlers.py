@@ -1,179 +1,139 @@
 """Tests for event handlers."""
-from unittest.mock import patch
+import json
+from unittest.mock import MagicMock, patch
 
 import pytest
 
-from app.handlers import handle_event, export_to_file, _normalize_name
+from app.export import flush_exports, segment_file
+from app.handlers import handle_event, handle_events_batch, export_to_file, _normalize_name
 from shared.events import EventType
 
 
-def test_handle_location_create(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_location") as mock_create:
-            mock_create.return_value = "loc-1"
-            handle_event(EventType.LOCATION_CREATE.value, {"id": "loc-1", "name": "Tavern", "description": ""})
-            mock_create.assert_called_once_with({"id": "loc-1", "name": "Tavern", "description": ""})
-    assert (tmp_path / "events.jsonl").exists()
-
-
-def test_handle_location_create_normalizes_name(tmp_path):
-    """Name is stripped before write (case/whitespace consistent with server)."""
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_location") as mock_create:
-            handle_event(
-                EventType.LOCATION_CREATE.value,
-                {"id": "loc-1", "name": "  таверна  ", "description": "первое место"},
-            )
-            mock_create.assert_called_once()
-            call_payload = mock_create.call_args[0][0]
-            assert call_payload["name"] == "таверна"
-            assert call_payload["description"] == "первое место"
-
-
-def test_handle_character_create(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_character") as mock_create:
-            mock_create.return_value = "c1"
-            handle_event(EventType.CHARACTER_CREATE.value, {"id": "c1", "name": "Alice", "description": ""})
-            mock_create.assert_called_once()
-
-
-def test_handle_character_create_normalizes_name(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_character") as mock_create:
-            handle_event(
-                EventType.CHARACTER_CREATE.value,
-                {"id": "c1", "name": "\t Alice \n", "description": ""},
-            )
-            call_payload = mock_create.call_args[0][0]
-            assert call_payload["name"] == "Alice"
-
-
-def test_handle_scene_create(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_scene") as mock_create:
-            mock_create.return_value = "s1"
-            handle_event(
-                EventType.SCENE_CREATE.value,
-                {"id": "s1", "title": "Meet", "description": "", "location_id": "loc-1", "character_ids": []},
-            )
-            mock_create.assert_called_once()
-
-
-def test_handle_concept_create(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_concept") as mock_create:
-            mock_create.return_value = "concept-1"
-            handle_event(EventType.CONCEPT_CREATE.value, {"id": "concept-1", "name": "Magic", "description": ""})
-            mock_create.assert_called_once()
-
-
-def test_handle_concept_create_normalizes_name(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_concept") as mock_create:
-            handle_event(
-                EventType.CONCEPT_CREATE.value,
-                {"id": "concept-1", "name": "  Magic  ", "description": ""},
-            )
-            call_payload = mock_create.call_args[0][0]
-            assert call_payload["name"] == "Magic"
-
-
-def test_handle_scene_create_normalizes_title(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.create_scene") as mock_create:
-            handle_event(
-                EventType.SCENE_CREATE.value,
-                {"id": "s1", "title": "  Meet  ", "description": "", "location_id": "loc-1", "character_ids": []},
-            )
-            call_payload = mock_create.call_args[0][0]
-            assert call_payload["title"] == "Meet"
-
-
-def test_handle_location_update(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.update_location") as mock_update:
-            mock_update.return_value = "loc-1"
-            handle_event(EventType.LOCATION_UPDATE.value, {"id": "loc-1", "name": "New Tavern"})
-            mock_update.assert_called_once()
-
-
-def test_handle_character_update(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.update_character") as mock_update:
-            mock_update.return_value = "c1"
-            handle_event(EventType.CHARACTER_UPDATE.value, {"id": "c1", "description": "Updated"})
-            mock_update.assert_called_once()
-
-
-def test_handle_character_update_with_name_normalizes(tmp_path):
-    """Covers handlers line 39: CHARACTER_UPDATE with 'name' in payload."""
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.update_character") as mock_update:
-            handle_event(
-                EventType.CHARACTER_UPDATE.value,
-                {"id": "c1", "name": "  Alice  ", "description": "Hero"},
-            )
-            mock_update.assert_called_once()
-            call_payload = mock_update.call_args[0][0]
-            assert call_payload["name"] == "Alice"
-
-
-def test_handle_scene_update(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.update_scene") as mock_update:
-            mock_update.return_value = "s1"
-            handle_event(EventType.SCENE_UPDATE.value, {"id": "s1", "title": "Updated"})
-            mock_update.assert_called_once()
-
-
-def test_handle_concept_update(tmp_path):
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.update_concept") as mock_update:
-            mock_update.return_value = "concept-1"
-            handle_event(EventType.CONCEPT_UPDATE.value, {"id": "concept-1", "description": "Updated"})
-            mock_update.assert_called_once()
-
-
-def test_handle_concept_update_with_name_normalizes(tmp_path):
-    """Covers handlers line 53: CONCEPT_UPDATE with 'name' in payload."""
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.update_concept") as mock_update:
-            handle_event(
-                EventType.CONCEPT_UPDATE.value,
-                {"id": "concept-1", "name": "  Magic  ", "description": "Updated"},
-            )
-            mock_update.assert_called_once()
-            call_payload = mock_update.call_args[0][0]
-            assert call_payload["name"] == "Magic"
-
-
-def test_handle_scene_update_with_title_normalizes(tmp_path):
-    """Covers handlers: SCENE_UPDATE with 'title' in payload."""
-    with patch("app.handlers.settings") as mock_settings:
-        mock_settings.export_dir = str(tmp_path)
-        with patch("app.handlers.update_scene") as mock_update:
-            handle_event(
-                EventType.SCENE_UPDATE.value,
-                {"id": "s1", "title": "  Updated Title  "},
-            )
-            mock_update.assert_called_once()
-            call_payload = mock_update.call_args[0][0]
-            assert call_payload["title"] == "Updated Title"
+@pytest.fixture(autouse=True)
+def graph_tx():
+    """Транзакция записи без Neo4j: work выполняется на MagicMock, версия графа из неё — 1."""
+    tx = MagicMock()
+    tx.run.return_value.single.return_value = {"version": 1}
+    with patch("app.handlers.write_in_transaction", side_effect=lambda work: work(tx)):
+        yield tx
+
+
+@pytest.fixture(autouse=True)
+def mock_featured_characters():
+    """Участники сцен до записи (для контекста ролей) — без Neo4j."""
+    with patch("app.handlers.featured_characters", return_value=[]) as mock_featured:
+        yield mock_featured
+
+
+def _exported(directory) -> str:
+    """Текст текущего сегмента экспорта (после записи очереди фоновым писателем)."""
+    flush_exports()
+    return (directory / segment_file(1)).read_text()
+
+
+@pytest.fixture(autouse=True)
+def mock_refresh_role_contexts():
+    with patch("app.handlers.refresh_role_contexts") as mock_refresh:
+        yield mock_refresh
+
+
+def test_handle_location_create(tmp_path, graph_tx):
+    with patch("app.handlers.settings") as mock_settings, patch("app.handlers.create_locations") as mock_create:
+        mock_settings.export_dir = str(tmp_path)
+        handle_event(EventType.LOCATION_CREATE.value, {"id": "loc-1", "name": "Tavern", "description": ""})
+    mock_create.assert_called_once_with(graph_tx, [{"id": "loc-1", "name": "Tavern", "description": ""}])
+    assert "Tavern" in _exported(tmp_path)
+
+
+@pytest.mark.parametrize("event_type, writer, payload, written", [
+    (
+        EventType.LOCATION_CREATE, "create_locations",
+        {"id": "loc-1", "name": "  таверна  ", "description": "первое место"},
+        {"id": "loc-1", "name": "таверна", "description": "первое место"},
+    ),
+    (
+        EventType.CHARACTER_CREATE, "create_characters",
+        {"id": "c1", "name": "\t Alice \n", "description": ""},
+        {"id": "c1", "name": "Alice", "description": ""},
+    ),
+    (
+        EventType.SCENE_CREATE, "create_scenes",
+        {"id": "s1", "title": "  Meet  ", "description": "", "location_id": "loc-1", "character_ids": []},
+        {"id": "s1", "title": "Meet", "description": "", "location_id": "loc-1", "character_ids": []},
+    ),
+    (
+        EventType.CONCEPT_CREATE, "create_concepts",
+        {"id": "concept-1", "name": "  Magic  ", "description": ""},
+        {"id": "concept-1", "name": "Magic", "description": ""},
+    ),
+    (EventType.LOCATION_UPDATE, "update_locations", {"id": "loc-1", "name": "New Tavern"}, {"id": "loc-1", "name": "New Tavern"}),
+    (EventType.CHARACTER_UPDATE, "update_characters", {"id": "c1", "description": "Updated"}, {"id": "c1", "description": "Updated"}),
+    (
+        EventType.CHARACTER_UPDATE, "update_characters",
+        {"id": "c1", "name": "  Alice  ", "description": "Hero"},
+        {"id": "c1", "name": "Alice", "description": "Hero"},
+    ),
+    (EventType.SCENE_UPDATE, "update_scenes", {"id": "s1", "title": "  Updated Title  "}, {"id": "s1", "title": "Updated Title"}),
+    (EventType.CONCEPT_UPDATE, "update_concepts", {"id": "concept-1", "description": "Updated"}, {"id": "concept-1", "description": "Updated"}),
+    (
+        EventType.CONCEPT_UPDATE, "update_concepts",
+        {"id": "concept-1", "name": "  Magic  ", "description": "Updated"},
+        {"id": "concept-1", "name": "Magic", "description": "Updated"},
+    ),
+])
+def test_handle_event_writes_normalized_payload(tmp_path, graph_tx, event_type, writer, payload, written):
+    """Name/title is stripped before write (case/whitespace consistent with server)."""
+    with patch("app.handlers.settings") as mock_settings, patch(f"app.handlers.{writer}") as mock_writer:
+        mock_settings.export_dir = str(tmp_path)
+        handle_event(event_type.value, payload)
+    mock_writer.assert_called_once_with(graph_tx, [written])
+
+
+def test_handle_event_bumps_graph_version_in_write_transaction(tmp_path, graph_tx, mock_refresh_role_contexts):
+    graph_tx.run.return_value.single.return_value = {"version": 42}
+    with patch("app.handlers.settings") as mock_settings, patch("app.handlers.update_locations") as mock_update:
+        mock_settings.export_dir = str(tmp_path)
+        version = handle_event(EventType.LOCATION_UPDATE.value, {"id": "loc-1", "description": "Old"})
+    assert version == 42
+    mock_update.assert_called_once()
+    assert "GraphVersion" in graph_tx.run.call_args[0][0]
+    # Описание локации не входит ни в один контекст ролей — только версия графа
+    mock_refresh_role_contexts.assert_not_called()
+
+
+def test_character_update_refreshes_its_context_with_version(tmp_path, graph_tx, mock_refresh_role_contexts):
+    with patch("app.handlers.settings") as mock_settings, patch("app.handlers.update_characters"):
+        mock_settings.export_dir = str(tmp_path)
+        handle_event(EventType.CHARACTER_UPDATE.value, {"id": "c1", "description": "Кузнец"})
+    mock_refresh_role_contexts.assert_called_once_with(graph_tx, {"c1"}, False)
+    assert "GraphVersion" in graph_tx.run.call_args[0][0]
+
+
+def test_scene_update_reads_participants_writes_and_refreshes_in_one_transaction(
+    tmp_path, graph_tx, mock_featured_characters, mock_refresh_role_contexts
+):
+    steps = []
+    mock_featured_characters.side_effect = lambda tx, scenes, locations: steps.append(("read", tx)) or ["c-old"]
+    mock_refresh_role_contexts.side_effect = lambda tx, *args: steps.append(("refresh", tx))
+    with patch("app.handlers.settings") as mock_settings, \
+            patch("app.handlers.write_in_transaction", side_effect=lambda work: work(graph_tx)) as mock_write, \
+            patch("app.handlers.update_scenes", side_effect=lambda tx, rows: steps.append(("write", tx))):
+        mock_settings.export_dir = str(tmp_path)
+        handle_event(EventType.SCENE_UPDATE.value, {"id": "s1", "character_ids": ["c-new"]})
+    mock_write.assert_called_once()
+    # Участники до записи (в т.ч. удаляемые из сцены) читаются в той же транзакции, что и запись
+    assert steps == [("read", graph_tx), ("write", graph_tx), ("refresh", graph_tx)]
+    assert mock_featured_characters.call_args[0][1:] == (["s1"], [])
+    mock_refresh_role_contexts.assert_called_once_with(graph_tx, {"c-old", "c-new"}, False)
+
+
+def test_role_context_disabled_skips_lookup(tmp_path, mock_featured_characters, mock_refresh_role_contexts):
+    with patch("app.handlers.settings") as mock_settings, patch("app.handlers.create_characters"):
+        mock_settings.export_dir = str(tmp_path)
+        mock_settings.role_context_enabled = False
+        handle_event(EventType.CHARACTER_CREATE.value, {"id": "c1", "name": "Иван"})
+    mock_featured_characters.assert_not_called()
+    mock_refresh_role_contexts.assert_not_called()
 
 
 def test_handle_unknown_event():
@@ -185,9 +145,7 @@ def test_export_to_file(tmp_path):
     with patch("app.handlers.settings") as mock_settings:
         mock_settings.export_dir = str(tmp_path)
         export_to_file("location.create", {"id": "loc-1", "name": "Tavern"})
-    p = tmp_path / "events.jsonl"
-    assert p.exists()
-    content = p.read_text()
+    content = _exported(tmp_path)
     assert "location.create" in content
     assert "Tavern" in content
 
@@ -204,3 +162,81 @@ def test_normalize_name_empty():
     assert _normalize_name("   ") == ""
     assert _normalize_name("") == ""
     assert _normalize_name(None) == ""
+
+
+# --- handle_events_batch (one transaction, UNWIND per type) ---
+
+
+def test_handle_events_batch_groups_by_type_in_one_transaction(tmp_path):
+    tx = MagicMock()
+    with patch("app.handlers.settings") as mock_settings:
+        mock_settings.export_dir = str(tmp_path)
+        with patch("app.handlers.write_in_transaction", side_effect=lambda work: work(tx)) as mock_write:
+            with patch("app.handlers.create_scenes") as mock_scenes, patch("app.handlers.create_locations") as mock_locs:
+                handle_events_batch([
+                    (EventType.SCENE_CREATE.value, {"id": "s1", "title": " Meet ", "location_id": "loc-1"}),
+                    (EventType.LOCATION_CREATE.value, {"id": "loc-1", "name": " Tavern "}),
+                    (EventType.LOCATION_CREATE.value, {"id": "loc-2", "name": "Forest"}),
+                ])
+    mock_write.assert_called_once()
+    # Версия графа увеличивается в той же транзакции, последним запросом
+    assert "GraphVersion" in tx.run.call_args[0][0]
+    # Локации пишутся раньше сцен, имена нормализованы
+    mock_locs.assert_called_once_with(tx, [{"id": "loc-1", "name": "Tavern"}, {"id": "loc-2", "name": "Forest"}])
+    mock_scenes.assert_called_once_with(tx, [{"id": "s1", "title": "Meet", "location_id": "loc-1"}])
+    assert len(_exported(tmp_path).splitlines()) == 3
+
+
+def test_handle_events_batch_refreshes_narrator_and_location_characters(
+    tmp_path, mock_featured_characters, mock_refresh_role_contexts
+):
+    tx = MagicMock()
+    mock_featured_characters.return_value = ["c1"]
+    with patch("app.handlers.export_events_to_file"), \
+            patch("app.handlers.write_in_transaction", side_effect=lambda work: work(tx)), \
+            patch("app.handlers.create_concepts"), patch("app.handlers.update_locations"):
+        handle_events_batch([
+            (EventType.CONCEPT_CREATE.value, {"id": "k1", "name": "Магия"}),
+            (EventType.LOCATION_UPDATE.value, {"id": "loc-1", "name": "Кузня"}),
+        ])
+    mock_featured_characters.assert_called_once_with(tx, [], ["loc-1"])
+    mock_refresh_role_contexts.assert_called_once_with(tx, {"c1"}, True)
+
+
+def test_handle_events_batch_repeated_id_keeps_order():
+    with patch("app.handlers.export_events_to_file"):
+        calls = []
+        with patch("app.handlers.write_in_transaction", side_effect=lambda work: work(MagicMock())):
+            with patch("app.handlers.update_locations", side_effect=lambda tx, rows: calls.append(("update", rows))):
+                with patch("app.handlers.create_locations", side_effect=lambda tx, rows: calls.append(("create", rows))):
+                    handle_events_batch([
+                        (EventType.LOCATION_UPDATE.value, {"id": "loc-1", "description": "old"}),
+                        (EventType.LOCATION_CREATE.value, {"id": "loc-1", "name": "Tavern"}),
+                    ])
+    assert [c[0] for c in calls] == ["update", "create"]
+
+
+def test_handle_events_batch_unknown_type_raises():
+    with patch("app.handlers.write_in_transaction") as mock_write:
+        with pytest.raises(ValueError, match="Unknown event type"):
+            handle_events_batch([("unknown.type", {})])
+    mock_write.assert_not_called()
+
+
+def test_handle_event_batch_expands_into_one_transaction(tmp_path):
+    tx = MagicMock()
+    batch = {"events": [
+        {"type": EventType.LOCATION_CREATE.value, "payload": {"id": "loc-1", "name": "Tavern"}},
+        {"type": EventType.SCENE_CREATE.value, "payload": {"id": "s1", "title": "Meet", "location_id": "loc-1"}},
+    ]}
+    with patch("app.handlers.settings") as mock_settings:
+        mock_settings.export_dir = str(tmp_path)
+        with patch("app.handlers.write_in_transaction", side_effect=lambda work: work(tx)) as mock_write:
+            with patch("app.handlers.create_scenes") as mock_scenes, patch("app.handlers.create_locations") as mock_locs:
+                handle_event(EventType.BATCH.value, batch)
+    mock_write.assert_called_once()
+    mock_locs.assert_called_once_with(tx, [{"id": "loc-1", "name": "Tavern"}])
+    mock_scenes.assert_called_once_with(tx, [{"id": "s1", "title": "Meet", "location_id": "loc-1"}])
+    # В экспорт попадают отдельные события, а не пакет
+    exported = [json.loads(line)["type"] for line in _exported(tmp_path).splitlines()]
+    assert exported == [EventType.LOCATION_CREATE.value, EventType.SCENE_CREATE.value]
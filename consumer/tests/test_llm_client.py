@@ -0,0 +1,113 @@
+"""Tests for llm_client (общий пул соединений к llm-service, таймауты от дедлайна задачи)."""
+import time
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from app import llm_client
+from app.llm_client import DeadlineExceeded, call_timeout, get_client, post_json, stream_sse
+
+
+@pytest.fixture
+def mock_llm_service():
+    """Общий клиент с MockTransport вместо реального llm-service; запросы складываются в список."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == "/fail":
+            return httpx.Response(500, json={"detail": "boom"})
+        if request.url.path == "/chat/stream":
+            body = (
+                'event: delta\ndata: {"delta": "ANSWER: "}\n\n'
+                'event: delta\ndata: {"delta": "ok"}\n\n'
+                'event: done\ndata: {"answer": "ANSWER: ok"}\n\n'
+            )
+            return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(200, json={"answer": "ok"})
+
+    client = httpx.Client(base_url="http://llm", transport=httpx.MockTransport(handler))
+    with patch.object(llm_client, "_client", client):
+        yield requests
+    client.close()
+
+
+def test_post_json_uses_shared_client(mock_llm_service):
+    assert get_client() is get_client()
+    assert post_json("/chat", {"prompt": "hi"}) == {"answer": "ok"}
+    assert post_json("/chat", {"prompt": "again"}) == {"answer": "ok"}
+    assert [r.url.path for r in mock_llm_service] == ["/chat", "/chat"]
+
+
+def test_post_json_timeout_capped_by_deadline(mock_llm_service):
+    post_json("/chat", {"prompt": "hi"}, deadline=time.monotonic() + 2)
+    timeout = mock_llm_service[0].extensions["timeout"]
+    assert 0 < timeout["read"] <= 2
+    assert timeout["connect"] <= 2
+
+
+def test_post_json_expired_deadline_does_not_call(mock_llm_service):
+    with pytest.raises(DeadlineExceeded):
+        post_json("/chat", {"prompt": "hi"}, deadline=time.monotonic() - 1)
+    assert mock_llm_service == []
+
+
+def test_post_json_http_error_raises(mock_llm_service):
+    with pytest.raises(httpx.HTTPStatusError):
+        post_json("/fail", {})
+
+
+def test_stream_sse_yields_events(mock_llm_service):
+    assert list(stream_sse("/chat/stream", {"prompt": "hi"})) == [
+        ("delta", {"delta": "ANSWER: "}),
+        ("delta", {"delta": "ok"}),
+        ("done", {"answer": "ANSWER: ok"}),
+    ]
+
+
+def test_stream_sse_http_error_raises(mock_llm_service):
+    with pytest.raises(httpx.HTTPStatusError):
+        list(stream_sse("/fail", {}))
+
+
+def test_call_timeout_without_deadline_is_request_timeout():
+    with patch("app.llm_client.settings") as mock_settings:
+        mock_settings.llm_request_timeout_sec = 120.0
+        assert call_timeout(None) == 120.0
+        assert call_timeout(time.monotonic() + 1000) == 120.0
+
+
+def test_build_client_pool_limits_follow_workers():
+    with patch("app.llm_client.settings") as mock_settings:
+        mock_settings.llm_http_max_connections = 0
+        mock_settings.llm_workers = 6
+        mock_settings.llm_generate_concurrency = 3
+        mock_settings.llm_http2 = True
+        mock_settings.llm_service_url = "http://llm:8001/"
+        mock_settings.llm_http_keepalive_expiry_sec = 30.0
+        mock_settings.llm_request_timeout_sec = 120.0
+        mock_settings.llm_http_connect_timeout_sec = 5.0
+        with patch("app.llm_client._http2_available", return_value=False):
+            client = llm_client._build_client()
+    pool = client._transport._pool
+    assert pool._max_connections == 8  # 6 задач, одна из них может вести 3 запроса генерации
+    assert pool._http2 is False
+    assert str(client.base_url) == "http://llm:8001"
+    client.close()
+
+
+def test_handle_knowledge_shares_one_deadline_across_rounds():
+    from app.llm_task_handler import handle_knowledge
+
+    calls = []
+
+    def fake_post(path, payload, deadline=None):
+        calls.append(deadline)
+        return {"answer": "SEARCH: таверна" if len(calls) == 1 else "ANSWER: да"}
+
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", return_value=[]):
+        result = handle_knowledge("r1", "Где таверна?", "narrator")
+    assert result["answer"] == "да"
+    assert len(calls) == 2 and calls[0] is not None and calls[0] == calls[1]
@@ -0,0 +1,399 @@
+"""Tests for llm.tasks handler: cache_key echo, the shared answer cache, streamed partial answers,
+pre-retrieval for knowledge questions, batched generation."""
+from unittest.mock import patch
+
+import pytest
+
+from app.config import settings
+from app.llm_task_handler import handle_llm_task
+
+
+def _knowledge_task(**extra) -> dict:
+    return {"request_id": "r1", "type": "knowledge", "question": "Кто такой Иван?", "role": "narrator", **extra}
+
+
+def test_knowledge_result_echoes_cache_key():
+    with patch("app.llm_task_handler.post_json", return_value={"answer": "ANSWER: Кузнец"}):
+        with patch("app.llm_task_handler.store_cached_answer") as mock_store:
+            result = handle_llm_task(_knowledge_task(cache_key="3:abc"))
+    assert result["answer"] == "Кузнец"
+    assert result["cache_key"] == "3:abc"
+    mock_store.assert_not_called()
+
+
+def test_knowledge_result_stored_in_neo4j_cache():
+    with patch("app.llm_task_handler.post_json", return_value={"answer": "ANSWER: Кузнец"}):
+        with patch("app.llm_task_handler.store_cached_answer") as mock_store:
+            handle_llm_task(_knowledge_task(cache_key="3:abc", cache_store="neo4j", cache_ttl_sec=60))
+    mock_store.assert_called_once_with("3:abc", "Кузнец", "narrator", 60)
+
+
+def test_knowledge_error_is_not_cached():
+    with patch("app.llm_task_handler.post_json", side_effect=RuntimeError("down")):
+        with patch("app.llm_task_handler.store_cached_answer") as mock_store:
+            result = handle_llm_task(_knowledge_task(cache_key="3:abc", cache_store="neo4j"))
+    assert result["status"] == "error"
+    assert "cache_key" not in result
+    mock_store.assert_not_called()
+
+
+def test_cache_store_failure_does_not_fail_task():
+    with patch("app.llm_task_handler.post_json", return_value={"answer": "ANSWER: Кузнец"}):
+        with patch("app.llm_task_handler.store_cached_answer", side_effect=RuntimeError("neo4j down")):
+            result = handle_llm_task(_knowledge_task(cache_key="3:abc", cache_store="neo4j"))
+    assert result["status"] == "done"
+
+
+def _stream(*deltas: str):
+    def fake_stream(path, payload, deadline=None):
+        assert path == "/chat/stream"
+        for delta in deltas:
+            yield "delta", {"delta": delta}
+        yield "done", {"answer": "".join(deltas)}
+    return fake_stream
+
+
+@pytest.fixture
+def publish_every_delta(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream", True)
+    monkeypatch.setattr(settings, "llm_stream_publish_interval_ms", 0)
+
+
+def test_streamed_answer_publishes_partials(publish_every_delta):
+    partials = []
+    with patch("app.llm_task_handler.stream_sse", side_effect=_stream("ANS", "WER: Кузн", "ец из ", "деревни")):
+        result = handle_llm_task(_knowledge_task(), on_partial=partials.append)
+    assert [p["answer"] for p in partials] == ["Кузн", "Кузнец из ", "Кузнец из деревни"]
+    assert all(p["status"] == "partial" and p["request_id"] == "r1" for p in partials)
+    assert result["status"] == "done"
+    assert result["answer"] == "Кузнец из деревни"
+
+
+def test_search_round_is_not_published_as_partial(publish_every_delta):
+    partials = []
+    rounds = iter([_stream("SEA", "RCH: Иван"), _stream("ANSWER: Кузнец")])
+    with patch("app.llm_task_handler.stream_sse", side_effect=lambda *a, **kw: next(rounds)(*a, **kw)):
+        with patch("app.llm_task_handler.search_graph", return_value=[]):
+            result = handle_llm_task(_knowledge_task(), on_partial=partials.append)
+    assert [p["answer"] for p in partials] == ["Кузнец"]
+    assert result["answer"] == "Кузнец"
+
+
+def test_partials_throttled_by_publish_interval(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream", True)
+    monkeypatch.setattr(settings, "llm_stream_publish_interval_ms", 60000)
+    partials = []
+    with patch("app.llm_task_handler.stream_sse", side_effect=_stream("ANSWER: a", " b", " c")):
+        handle_llm_task(_knowledge_task(), on_partial=partials.append)
+    assert [p["answer"] for p in partials] == ["a"]
+
+
+def test_stream_error_event_fails_task(publish_every_delta):
+    def failing(path, payload, deadline=None):
+        yield "error", {"detail": "model crashed"}
+
+    with patch("app.llm_task_handler.stream_sse", side_effect=failing):
+        result = handle_llm_task(_knowledge_task(), on_partial=lambda p: None)
+    assert result["status"] == "error"
+    assert "model crashed" in result["error"]
+
+
+_IVAN = {
+    "type": "Character", "id": "c1", "name": "Иван", "description": "Кузнец", "score": 5.0,
+    "scenes": [{"id": "s1", "title": "Кузня", "description": "Иван куёт меч", "location": "Деревня", "characters": ["Иван"]}],
+}
+
+
+def _chat(*answers: str, payloads: list | None = None):
+    """Фейковый /chat: prompts — текст последней реплики пользователя каждого раунда."""
+    prompts = []
+
+    def fake_post(path, payload, deadline=None):
+        prompts.append(payload["messages"][-1]["content"])
+        if payloads is not None:
+            payloads.append(payload)
+        return {"answer": answers[len(prompts) - 1]}
+
+    return fake_post, prompts
+
+
+def test_pre_retrieval_puts_entities_and_scenes_into_first_prompt(monkeypatch, no_pre_retrieval):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    no_pre_retrieval.return_value = [_IVAN]
+    fake_post, prompts = _chat("ANSWER: Кузнец")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post):
+        result = handle_llm_task(_knowledge_task(question="Где работает Ивана?"))
+    assert result["answer"] == "Кузнец"
+    assert len(prompts) == 1
+    assert "[Character] Иван: Кузнец" in prompts[0]
+    assert "сцена «Кузня» (локация: Деревня; персонажи: Иван)" in prompts[0]
+
+
+def test_confident_pre_retrieval_limits_search_rounds(monkeypatch, no_pre_retrieval):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    no_pre_retrieval.return_value = [_IVAN]
+    fake_post, prompts = _chat("SEARCH: меч", "SEARCH: ещё", "ANSWER: не нашёл")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", return_value=[{"type": "Concept", "id": "k1", "name": "Меч"}]):
+        result = handle_llm_task(_knowledge_task())
+    assert result["answer"] == "(исчерпан лимит раундов поиска)"
+    assert len(prompts) == 2
+    assert "Поиск больше недоступен" in prompts[1]
+
+
+def test_search_without_new_results_forces_answer(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    fake_post, prompts = _chat("SEARCH: Иван", "ANSWER: не знаю")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", return_value=[]):
+        result = handle_llm_task(_knowledge_task())
+    assert result["answer"] == "не знаю"
+    assert "Поиск больше недоступен" in prompts[1]
+
+
+def test_pre_retrieval_failure_falls_back_to_search_rounds(monkeypatch, no_pre_retrieval):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    no_pre_retrieval.side_effect = RuntimeError("no index")
+    fake_post, prompts = _chat("ANSWER: Кузнец")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post):
+        result = handle_llm_task(_knowledge_task())
+    assert result["answer"] == "Кузнец"
+    assert "Пока нет данных из поиска." in prompts[0]
+
+
+def test_several_search_lines_run_in_one_round(monkeypatch):
+    import threading
+
+    monkeypatch.setattr(settings, "llm_stream", False)
+    barrier = threading.Barrier(2, timeout=5)
+    found = {
+        "Иван": [{"type": "Character", "id": "c1", "name": "Иван"}, {"type": "Location", "id": "l1", "name": "Кузня"}],
+        "Мария": [{"type": "Character", "id": "c2", "name": "Мария"}, {"type": "Location", "id": "l1", "name": "Кузня"}],
+    }
+
+    def fake_search(q):
+        barrier.wait()  # оба поиска выполняются одновременно
+        return found[q]
+
+    fake_post, prompts = _chat("SEARCH: Иван\nSEARCH: Мария\nsearch: иван", "ANSWER: соседи")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", side_effect=fake_search) as mock_search:
+        result = handle_llm_task(_knowledge_task())
+    assert result["answer"] == "соседи"
+    assert mock_search.call_count == 2
+    assert "Выполненные поиски: «Иван», «Мария»." in prompts[1]
+    assert prompts[1].count("[Location] Кузня") == 1
+
+
+def test_failed_search_query_keeps_other_results(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream", False)
+
+    def fake_search(q):
+        if q == "b":
+            raise RuntimeError("neo4j down")
+        return [{"type": "Concept", "id": "k1", "name": "Магия"}]
+
+    fake_post, prompts = _chat("SEARCH: a\nSEARCH: b", "ANSWER: ок")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", side_effect=fake_search):
+        handle_llm_task(_knowledge_task())
+    assert "[Concept] Магия" in prompts[1]
+
+
+def test_search_rounds_share_one_pool():
+    """Поиски раундов идут в общем пуле модуля, а не в новом ThreadPoolExecutor на каждый раунд."""
+    from app.llm_task_handler import _search_many
+
+    with patch("app.llm_task_handler.search_graph", side_effect=lambda q: [{"id": q}]), \
+            patch("app.llm_task_handler.ThreadPoolExecutor") as mock_executor:
+        assert _search_many(["a", "b"]) == [("a", [{"id": "a"}]), ("b", [{"id": "b"}])]
+        assert _search_many(["c", "d"])[1] == ("d", [{"id": "d"}])
+    mock_executor.assert_not_called()
+
+
+def test_failed_search_gives_empty_records_for_one_and_many_queries():
+    """Ошибка Neo4j в одиночном запросе не роняет вопрос — как и в параллельных."""
+    from app.llm_task_handler import _search_many
+
+    def fake_search(q):
+        if q == "a":
+            raise RuntimeError("neo4j down")
+        return [{"id": q}]
+
+    with patch("app.llm_task_handler.search_graph", side_effect=fake_search):
+        assert _search_many(["a"]) == [("a", [])]
+        assert _search_many(["a", "b"]) == [("a", []), ("b", [{"id": "b"}])]
+
+
+def test_search_queries_capped(monkeypatch):
+    from app.llm_task_handler import _search_queries
+
+    monkeypatch.setattr(settings, "llm_search_max_queries", 2)
+    assert _search_queries("SEARCH: a\nSEARCH:\nSEARCH: b\nSEARCH: c") == ["a", "b"]
+
+
+def test_role_context_goes_into_system_prompt(monkeypatch, no_role_context):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    no_role_context.return_value = "Персонаж: Иван. Кузнец"
+    with patch("app.llm_task_handler.post_json", return_value={"answer": "ANSWER: да"}) as mock_post:
+        handle_llm_task(_knowledge_task(role="c1"))
+    no_role_context.assert_called_once_with("c1")
+    system = mock_post.call_args[0][1]["messages"][0]
+    assert system["role"] == "system" and "Персонаж: Иван. Кузнец" in system["content"]
+
+
+def test_context_not_repeated_across_rounds(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    monkeypatch.setattr(settings, "llm_search_max_queries", 1)
+    found = {"Иван": [{"type": "Character", "id": "c1", "name": "Иван", "snippet": "Кузнец"}],
+             "меч": [{"type": "Character", "id": "c1", "name": "Иван", "snippet": "Кузнец"},
+                     {"type": "Concept", "id": "k1", "name": "Меч", "snippet": "Оружие"}]}
+    fake_post, prompts = _chat("SEARCH: Иван", "SEARCH: меч", "ANSWER: да")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", side_effect=lambda q: found[q]):
+        handle_llm_task(_knowledge_task())
+    assert "[Character] Иван: Кузнец" in prompts[1]
+    assert "[Character] Иван: Кузнец" not in prompts[2]
+    assert "[Concept] Меч: Оружие" in prompts[2]
+
+
+def test_rounds_send_only_new_turns_of_conversation(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    payloads = []
+    fake_post, _ = _chat("SEARCH: Иван", "ANSWER: Кузнец", payloads=payloads)
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", return_value=[{"type": "Character", "id": "c1", "name": "Иван"}]):
+        handle_llm_task(_knowledge_task())
+    first, second = payloads
+    assert [m["role"] for m in first["messages"]] == ["system", "user"]
+    assert first["conversation_id"] == second["conversation_id"] == "r1"
+    assert first["append"] is False and second["append"] is True
+    assert [m["role"] for m in second["messages"]] == ["user"]
+    assert second["messages"][0]["content"].startswith("Результаты поиска:\n[Character] Иван")
+
+
+def test_lost_conversation_resent_with_full_history(monkeypatch):
+    import httpx
+
+    monkeypatch.setattr(settings, "llm_stream", False)
+    payloads = []
+
+    def fake_post(path, payload, deadline=None):
+        payloads.append(payload)
+        if len(payloads) == 1:
+            return {"answer": "SEARCH: Иван"}
+        if payload["append"]:
+            response = httpx.Response(409, request=httpx.Request("POST", "http://llm/chat"))
+            raise httpx.HTTPStatusError("conflict", request=response.request, response=response)
+        return {"answer": "ANSWER: Кузнец"}
+
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", return_value=[]):
+        result = handle_llm_task(_knowledge_task())
+    assert result["answer"] == "Кузнец"
+    assert [m["role"] for m in payloads[2]["messages"]] == ["system", "user", "assistant", "user"]
+    assert payloads[2]["append"] is False
+
+
+def test_conversations_disabled_sends_full_history(monkeypatch):
+    monkeypatch.setattr(settings, "llm_stream", False)
+    monkeypatch.setattr(settings, "llm_conversations", False)
+    payloads = []
+    fake_post, _ = _chat("SEARCH: Иван", "ANSWER: Кузнец", payloads=payloads)
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", return_value=[]):
+        handle_llm_task(_knowledge_task())
+    assert "conversation_id" not in payloads[1]
+    assert [m["role"] for m in payloads[1]["messages"]] == ["system", "user", "assistant", "user"]
+
+
+def test_rounds_histogram_by_mode(monkeypatch):
+    from app.metrics import llm_knowledge_rounds
+
+    def observed(mode):
+        return llm_knowledge_rounds.labels(mode=mode)._sum.get()
+
+    monkeypatch.setattr(settings, "llm_stream", False)
+    monkeypatch.setattr(settings, "llm_retrieval_first", False)
+    before = observed("search_first")
+    fake_post, _ = _chat("SEARCH: Иван", "ANSWER: Кузнец")
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post), \
+            patch("app.llm_task_handler.search_graph", return_value=[{"type": "Character", "id": "c1"}]):
+        handle_llm_task(_knowledge_task())
+    assert observed("search_first") - before == 2
+
+
+def _generate_service(fail_starts=(), invalid=()):
+    """Фейковый /generate: имена по номеру подсказки/позиции; части с fail_starts падают."""
+    calls = []
+
+    def fake_post(path, body, deadline=None):
+        calls.append(body)
+        names = body.get("prompts") or [f"npc{len(calls)}-{i}" for i in range(body.get("count", 1))]
+        if names and names[0] in fail_starts:
+            raise RuntimeError("provider down")
+        items = [{"name": n, "description": ""} for n in names if n not in invalid]
+        errors = [{"index": i, "error": "name: пустое значение"} for i, n in enumerate(names) if n in invalid]
+        return {"entity_type": body["entity_type"], "payload": items[0] if items else {}, "items": items, "errors": errors}
+
+    return fake_post, calls
+
+
+def test_generate_many_in_chunks_keeps_order(monkeypatch):
+    monkeypatch.setattr(settings, "llm_generate_chunk_size", 3)
+    prompts = [f"p{i}" for i in range(8)]
+    fake_post, calls = _generate_service(invalid={"p4"})
+    partials = []
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post):
+        result = handle_llm_task(
+            {"request_id": "g1", "type": "generate", "entity_type": "character", "prompts": prompts},
+            on_partial=partials.append,
+        )
+    assert sorted(len(c["prompts"]) for c in calls) == [2, 3, 3]
+    assert [i["name"] for i in result["items"]] == ["p0", "p1", "p2", "p3", "p5", "p6", "p7"]
+    assert result["errors"] == [{"index": 4, "error": "name: пустое значение"}]
+    assert result["payload"] == {"name": "p0", "description": ""}
+    # Частичные результаты — по мере готовности частей (кроме последней: её несёт итог), только новые сущности
+    assert len(partials) == 2
+    assert all(p["status"] == "partial" and p["count"] == 8 for p in partials)
+    assert all([i["name"] for i in p["items"]] == [prompts[i] for i in p["indices"]] for p in partials)
+    assert len({i for p in partials for i in p["indices"]}) == sum(len(p["indices"]) for p in partials)
+
+
+def test_generate_many_by_count_and_failed_chunk(monkeypatch):
+    monkeypatch.setattr(settings, "llm_generate_chunk_size", 2)
+    monkeypatch.setattr(settings, "llm_generate_concurrency", 1)
+    fake_post, calls = _generate_service(fail_starts={"npc2-0"})
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post):
+        result = handle_llm_task({"request_id": "g2", "type": "generate", "entity_type": "location", "count": 5})
+    assert [c["count"] for c in calls] == [2, 2, 1]
+    assert result["status"] == "done"
+    assert len(result["items"]) == 3
+    assert [e["index"] for e in result["errors"]] == [2, 3]
+
+
+def test_generate_many_sends_count_for_single_entity_chunk(monkeypatch):
+    """Часть из одной сущности тоже уходит с count: llm-service проверяет её как элемент пакета."""
+    monkeypatch.setattr(settings, "llm_generate_chunk_size", 10)
+
+    def fake_post(path, body, deadline=None):
+        n = body["count"]
+        if n == 1:
+            # Пустое имя не прошло проверку — в errors, а не в items
+            return {"entity_type": body["entity_type"], "payload": {}, "items": [], "errors": [{"index": 0, "error": "name: пустое значение"}]}
+        items = [{"name": f"npc{i}", "description": ""} for i in range(n)]
+        return {"entity_type": body["entity_type"], "payload": items[0], "items": items, "errors": []}
+
+    with patch("app.llm_task_handler.post_json", side_effect=fake_post) as mock_post:
+        result = handle_llm_task({"request_id": "g4", "type": "generate", "entity_type": "character", "count": 11})
+    assert sorted(c[0][1]["count"] for c in mock_post.call_args_list) == [1, 10]
+    assert len(result["items"]) == 10
+    assert result["errors"] == [{"index": 10, "error": "name: пустое значение"}]
+
+
+def test_generate_single_keeps_old_request():
+    with patch("app.llm_task_handler.post_json", return_value={"entity_type": "concept", "payload": {"name": "x"}}) as p:
+        result = handle_llm_task({"request_id": "g3", "type": "generate", "entity_type": "concept", "prompt": "магия"})
+    assert p.call_args[0][1] == {"entity_type": "concept", "prompt": "магия"}
+    assert result["payload"] == {"name": "x"}
+    assert "items" not in result
@@ -1,12 +1,22 @@
 """Tests for consumer main (on_graph_message для graph.tasks)."""
 import json
+import signal
 from unittest.mock import patch, MagicMock
 
 import pytest
 
+from app import main as consumer_main
 from app.main import on_graph_message
 
 
+@pytest.fixture(autouse=True)
+def stop_state():
+    """main() не ставит обработчики сигналов в процесс pytest; флаг остановки сбрасывается после теста."""
+    with patch("app.main.signal.signal") as mock_signal:
+        yield mock_signal
+    consumer_main._stopping.clear()
+
+
 def test_on_message_success():
     channel = MagicMock()
     method = MagicMock()
@@ -52,8 +62,235 @@ def test_main_starts_two_consumers():
 
     with patch("app.main.consume_graph_tasks") as mock_graph:
         with patch("app.main.consume_llm_tasks") as mock_llm:
-            mock_graph.side_effect = lambda: None
+            with patch("app.main.run_migrations") as mock_migrations, patch("app.main.start_http_server"):
+                mock_graph.side_effect = lambda: None
+                mock_llm.side_effect = lambda: None
+                main()
+    mock_migrations.assert_called_once()
+    mock_graph.assert_called_once()
+    mock_llm.assert_called_once()
+
+def _msg(tag, data):
+    method = MagicMock()
+    method.delivery_tag = tag
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    return method, body
+
+
+def test_on_graph_batch_writes_once_and_acks_multiple():
+    from app.main import on_graph_batch
+
+    channel = MagicMock()
+    messages = [
+        _msg(1, {"type": "location.create", "payload": {"id": "loc-1", "name": "Tavern"}}),
+        _msg(2, {"type": "character.create", "payload": {"id": "c1", "name": "Alice"}}),
+    ]
+    with patch("app.main.handle_events_batch") as mock_batch:
+        on_graph_batch(channel, messages)
+    mock_batch.assert_called_once_with([
+        ("location.create", {"id": "loc-1", "name": "Tavern"}),
+        ("character.create", {"id": "c1", "name": "Alice"}),
+    ])
+    channel.basic_ack.assert_called_once_with(delivery_tag=2, multiple=True)
+    channel.basic_nack.assert_not_called()
+
+
+def test_on_graph_batch_nacks_invalid_messages_individually():
+    from app.main import on_graph_batch
+
+    channel = MagicMock()
+    messages = [
+        _msg(1, b"not json"),
+        _msg(2, {"payload": {}}),
+        _msg(3, {"type": "location.create", "payload": {"id": "loc-1", "name": "Tavern"}}),
+    ]
+    with patch("app.main.handle_events_batch") as mock_batch:
+        on_graph_batch(channel, messages)
+    assert mock_batch.call_args[0][0] == [("location.create", {"id": "loc-1", "name": "Tavern"})]
+    assert channel.basic_nack.call_count == 2
+    channel.basic_ack.assert_called_once_with(delivery_tag=3, multiple=True)
+
+
+def test_on_graph_batch_falls_back_to_single_events_on_failure():
+    from app.main import on_graph_batch
+
+    channel = MagicMock()
+    messages = [
+        _msg(1, {"type": "location.create", "payload": {"id": "loc-1", "name": "Tavern"}}),
+        _msg(2, {"type": "unknown.type", "payload": {}}),
+    ]
+    with patch("app.main.handle_events_batch", side_effect=ValueError("Unknown event type")):
+        with patch("app.main.handle_event", side_effect=[None, ValueError("Unknown event type")]) as mock_handle:
+            on_graph_batch(channel, messages)
+    assert mock_handle.call_count == 2
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+    channel.basic_nack.assert_called_once_with(delivery_tag=2, requeue=False)
+
+
+def test_on_graph_batch_publishes_graph_changes_after_ack():
+    from app.main import on_graph_batch
+
+    channel = MagicMock()
+    messages = [
+        _msg(1, {"type": "location.create", "payload": {"id": "loc-1", "name": "Tavern"}}),
+        _msg(2, {"type": "batch", "payload": {"events": [
+            {"type": "scene.create", "payload": {"id": "s1", "title": "Meet"}},
+            {"type": "location.update", "payload": {"id": "loc-1", "description": "x"}},
+        ]}}),
+    ]
+    with patch("app.main.handle_events_batch", return_value=7):
+        on_graph_batch(channel, messages)
+    channel.basic_publish.assert_called_once()
+    kwargs = channel.basic_publish.call_args.kwargs
+    assert kwargs["exchange"] == "graph.changes"
+    assert json.loads(kwargs["body"]) == {
+        "changes": [
+            {"label": "Location", "id": "loc-1"},
+            {"label": "Scene", "id": "s1"},
+        ],
+        "graph_version": 7,
+    }
+
+
+def test_on_message_failure_publishes_no_changes():
+    channel = MagicMock()
+    method = MagicMock()
+    method.delivery_tag = 1
+    body = json.dumps({"type": "location.create", "payload": {"id": "loc-1", "name": "x"}})
+    with patch("app.main.handle_event", side_effect=ValueError("err")):
+        on_graph_message(channel, method, properties=None, body=body.encode())
+    channel.basic_publish.assert_not_called()
+
+
+# --- пул обработчиков llm.tasks ---
+
+
+def test_llm_worker_marshals_publish_and_ack_to_connection_thread():
+    from app.main import _llm_worker
+
+    connection, channel = MagicMock(), MagicMock()
+    body = json.dumps({"request_id": "r1", "type": "knowledge", "question": "q"}).encode()
+    with patch("app.main.handle_llm_task", return_value={"request_id": "r1", "status": "done"}):
+        _llm_worker(connection, channel, 7, body)
+    # Из потока пула канал не трогаем — только add_callback_threadsafe
+    channel.basic_publish.assert_not_called()
+    channel.basic_ack.assert_not_called()
+    callback = connection.add_callback_threadsafe.call_args[0][0]
+    callback()
+    assert json.loads(channel.basic_publish.call_args.kwargs["body"]) == {"request_id": "r1", "status": "done"}
+    channel.basic_ack.assert_called_once_with(delivery_tag=7)
+
+
+def test_llm_worker_publishes_partials_through_connection_thread():
+    from app.main import _llm_worker
+
+    def task(data, on_partial=None):
+        on_partial({"request_id": "r1", "status": "partial", "answer": "Куз"})
+        return {"request_id": "r1", "status": "done", "answer": "Кузнец"}
+
+    connection, channel = MagicMock(), MagicMock()
+    connection.add_callback_threadsafe.side_effect = lambda cb: cb()
+    with patch("app.main.handle_llm_task", side_effect=task):
+        _llm_worker(connection, channel, 5, json.dumps({"request_id": "r1", "type": "knowledge"}).encode())
+    bodies = [json.loads(c.kwargs["body"]) for c in channel.basic_publish.call_args_list]
+    assert [b["status"] for b in bodies] == ["partial", "done"]
+    assert connection.add_callback_threadsafe.call_count == 2
+    channel.basic_ack.assert_called_once_with(delivery_tag=5)
+
+
+def test_llm_worker_error_publishes_error_and_nacks():
+    from app.main import _llm_worker
+
+    connection, channel = MagicMock(), MagicMock()
+    connection.add_callback_threadsafe.side_effect = lambda cb: cb()
+    with patch("app.main.handle_llm_task", side_effect=RuntimeError("boom")):
+        _llm_worker(connection, channel, 3, json.dumps({"request_id": "r2", "type": "knowledge"}).encode())
+    assert json.loads(channel.basic_publish.call_args.kwargs["body"]) == {
+        "request_id": "r2", "status": "error", "error": "boom",
+    }
+    channel.basic_nack.assert_called_once_with(delivery_tag=3, requeue=False)
+
+
+def test_llm_worker_connection_closed_does_not_raise():
+    from app.main import _llm_worker
+
+    connection = MagicMock()
+    connection.add_callback_threadsafe.side_effect = RuntimeError("closed")
+    with patch("app.main.handle_llm_task", return_value={"request_id": "r1", "status": "done"}):
+        _llm_worker(connection, MagicMock(), 1, json.dumps({"request_id": "r1", "type": "generate"}).encode())
+
+
+def test_llm_pool_runs_tasks_concurrently_with_prefetch_equal_to_pool():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from app.main import _consume_llm_pool
+
+    barrier = threading.Barrier(3, timeout=5)
+
+    def slow_task(data, on_partial=None):
+        barrier.wait()  # пройдёт, только если все три задачи выполняются одновременно
+        return {"request_id": data["request_id"], "status": "done"}
+
+    connection, channel = MagicMock(), MagicMock()
+    acked = []
+    connection.add_callback_threadsafe.side_effect = lambda cb: cb()
+    channel.basic_ack.side_effect = lambda delivery_tag: acked.append(delivery_tag)
+
+    def start_consuming():
+        on_message = channel.basic_consume.call_args.kwargs["on_message_callback"]
+        for tag in (1, 2, 3):
+            method = MagicMock(delivery_tag=tag)
+            on_message(channel, method, None, json.dumps({"request_id": f"r{tag}", "type": "knowledge"}).encode())
+
+    channel.start_consuming.side_effect = start_consuming
+    with patch("app.main.settings") as mock_settings, patch("app.main.handle_llm_task", side_effect=slow_task):
+        mock_settings.llm_workers = 3
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            _consume_llm_pool(connection, channel, pool)
+    channel.basic_qos.assert_called_once_with(prefetch_count=3)
+    assert sorted(acked) == [1, 2, 3]
+
+
+def test_main_role_llm_starts_only_llm_consumer():
+    from app.main import main
+
+    with patch("app.main.consume_graph_tasks") as mock_graph, patch("app.main.consume_llm_tasks") as mock_llm:
+        with patch("app.main.run_migrations") as mock_migrations, patch("app.main.settings") as mock_settings:
+            mock_settings.consumer_role = "llm"
+            mock_settings.metrics_port = 0
             mock_llm.side_effect = lambda: None
             main()
-    mock_graph.assert_called_once()
-    mock_llm.assert_called_once()
\ No newline at end of file
+    mock_llm.assert_called_once()
+    mock_graph.assert_not_called()
+    mock_migrations.assert_not_called()
+
+
+def test_main_installs_stop_handlers_and_flushes_exports_after_consumers(stop_state):
+    from app.main import main, request_stop
+
+    steps = []
+    with patch("app.main.consume_graph_tasks", side_effect=lambda: steps.append("graph")), \
+            patch("app.main.consume_llm_tasks", side_effect=lambda: steps.append("llm")), \
+            patch("app.main.close_exports", side_effect=lambda: steps.append("close_exports")), \
+            patch("app.main.run_migrations"), patch("app.main.start_http_server"):
+        main()
+    assert steps[-1] == "close_exports" and sorted(steps[:-1]) == ["graph", "llm"]
+    stop_state.assert_any_call(signal.SIGTERM, request_stop)
+
+
+def test_sigterm_stops_graph_consumer_and_closes_connection():
+    from app.main import consume_graph_tasks, request_stop
+
+    connection = MagicMock()
+    connection.add_callback_threadsafe.side_effect = lambda cb: cb()
+    channel = connection.channel.return_value
+    # Сигнал приходит, пока поток слушает очередь
+    channel.start_consuming.side_effect = lambda: request_stop(signal.SIGTERM)
+    with patch("app.main.pika.URLParameters"), \
+            patch("app.main.pika.BlockingConnection", return_value=connection) as mock_connect, \
+            patch("app.main.settings") as mock_settings:
+        mock_settings.graph_batch_size = 1
+        consume_graph_tasks()
+    mock_connect.assert_called_once()
+    channel.stop_consuming.assert_called_once()
+    connection.close.assert_called_once()
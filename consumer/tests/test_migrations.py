@@ -0,0 +1,43 @@
+"""Tests for schema migration runner (consumer)."""
+from unittest.mock import MagicMock, patch
+
+from app.migrations import run_migrations
+from shared.schema import MIGRATIONS
+
+
+def _session(run):
+    session = MagicMock()
+    session.run.side_effect = run
+    driver = MagicMock()
+    driver.session.return_value.__enter__ = lambda self: session
+    driver.session.return_value.__exit__ = lambda *a: None
+    return session, driver
+
+
+def test_run_migrations_applies_pending():
+    def run(query, params=None):
+        result = MagicMock()
+        if "max(m.version)" in query:
+            result.single.return_value = {"version": None}
+        else:
+            result.single.return_value = {"updated": 0}
+        return result
+
+    session, driver = _session(run)
+    with patch("app.migrations.get_driver", return_value=driver):
+        assert run_migrations() == len(MIGRATIONS)
+    queries = [c.args[0] for c in session.run.call_args_list]
+    assert any("REQUIRE n.id IS UNIQUE" in q for q in queries)
+    assert any("MERGE (m:SchemaMigration" in q for q in queries)
+
+
+def test_run_migrations_nothing_pending():
+    def run(query, params=None):
+        result = MagicMock()
+        result.single.return_value = {"version": MIGRATIONS[-1].version}
+        return result
+
+    session, driver = _session(run)
+    with patch("app.migrations.get_driver", return_value=driver):
+        assert run_migrations() == 0
+    session.run.assert_called_once()
@@ -0,0 +1,111 @@
+"""Tests for replaying the event export into the graph."""
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.export import ExportWriter
+from app.replay import Coalescer, iter_events, load_checkpoint, replay
+from shared.events import EventType
+
+
+def _line(event_type: str, payload: dict) -> str:
+    return json.dumps({"type": event_type, "payload": payload}) + "\n"
+
+
+def _export(directory, events: list[tuple[str, dict]], **writer_options) -> None:
+    writer = ExportWriter(directory, **writer_options)
+    for event_type, payload in events:
+        writer.write([_line(event_type, payload)])
+        writer.flush(timeout=5)
+    writer.close()
+
+
+@pytest.fixture
+def graph_writes():
+    """Транзакции replay без Neo4j: запросы каждой транзакции записываются в список."""
+    calls = []
+
+    def run_work(work):
+        tx = MagicMock()
+        result = work(tx)
+        calls.append([(c.args[0], c.args[1]) for c in tx.run.call_args_list if len(c.args) > 1])
+        return result
+
+    with patch("app.replay.write_in_transaction", side_effect=run_work), \
+            patch("app.replay.run_read", return_value=[]):
+        yield calls
+
+
+def _rows(calls, marker: str) -> list[dict]:
+    return [row for tx in calls for query, params in tx if marker in query for row in params.get("rows", [])]
+
+
+def test_coalescer_folds_updates_into_create_and_updates_together():
+    c = Coalescer()
+    c.add(EventType.LOCATION_CREATE.value, {"id": "l1", "name": "Tavern", "description": ""})
+    c.add(EventType.LOCATION_UPDATE.value, {"id": "l1", "description": "Dark"})
+    c.add(EventType.CHARACTER_UPDATE.value, {"id": "c1", "name": "Ivan"})
+    c.add(EventType.CHARACTER_UPDATE.value, {"id": "c1", "description": "Smith"})
+    c.add(EventType.SCENE_CREATE.value, {"id": "s1", "title": "Meet", "location_id": "l1", "character_ids": ["c1"]})
+    c.add(EventType.SCENE_UPDATE.value, {"id": "s1", "character_ids": []})
+    c.add(EventType.SCENE_UPDATE.value, {"title": "no id"})
+    nodes, scenes = c.phases()
+    assert nodes == {
+        EventType.LOCATION_CREATE.value: [{"id": "l1", "name": "Tavern", "description": "Dark"}],
+        EventType.CHARACTER_UPDATE.value: [{"id": "c1", "name": "Ivan", "description": "Smith"}],
+    }
+    assert scenes == {
+        EventType.SCENE_CREATE.value: [{"id": "s1", "title": "Meet", "location_id": "l1", "character_ids": []}],
+    }
+    assert (c.events, c.skipped, len(c)) == (6, 1, 3)
+
+
+def test_coalescer_create_replaces_earlier_state():
+    c = Coalescer()
+    c.add(EventType.CONCEPT_UPDATE.value, {"id": "k1", "description": "old"})
+    c.add(EventType.CONCEPT_CREATE.value, {"id": "k1", "name": "Magic"})
+    assert c.phases()[0] == {EventType.CONCEPT_CREATE.value: [{"id": "k1", "name": "Magic"}]}
+
+
+def test_iter_events_reads_legacy_file_then_segments_from_offset(tmp_path):
+    (tmp_path / "events.jsonl").write_text(
+        _line(EventType.LOCATION_CREATE.value, {"id": "legacy-0"}) + _line(EventType.LOCATION_CREATE.value, {"id": "legacy-1"})
+    )
+    _export(tmp_path, [(EventType.LOCATION_CREATE.value, {"id": f"l{i}"}) for i in range(6)], segment_max_bytes=150)
+    ids = [(offset, payload["id"]) for offset, _, payload in iter_events(tmp_path)]
+    assert ids == [(0, "legacy-0"), (1, "legacy-1")] + [(i + 2, f"l{i}") for i in range(6)]
+    assert [payload["id"] for _, _, payload in iter_events(tmp_path, 5)] == ["l3", "l4", "l5"]
+    assert list(iter_events(tmp_path, 100)) == []
+
+
+def test_replay_writes_nodes_before_scenes_and_checkpoints(tmp_path, graph_writes):
+    _export(tmp_path, [
+        (EventType.SCENE_CREATE.value, {"id": "s1", "title": "Meet", "location_id": "l1", "character_ids": []}),
+        (EventType.LOCATION_CREATE.value, {"id": "l1", "name": "Tavern", "description": ""}),
+        (EventType.LOCATION_UPDATE.value, {"id": "l1", "name": "Inn"}),
+    ])
+    checkpoint = tmp_path / "replay-checkpoint.json"
+    summary = replay(tmp_path, checkpoint, workers=2)
+    assert summary == {"start_offset": 0, "offset": 3, "events": 3, "written": 2, "skipped": 0}
+    assert load_checkpoint(checkpoint) == 3
+    queries = [query for tx in graph_writes for query, _ in tx]
+    first_location = next(i for i, q in enumerate(queries) if "MERGE (n:Location" in q)
+    first_scene = next(i for i, q in enumerate(queries) if "MERGE (s:Scene" in q)
+    assert first_location < first_scene
+    assert [r["name"] for r in _rows(graph_writes, "MERGE (n:Location")] == ["Inn"]
+
+    # Повторный запуск продолжает с checkpoint: новых событий нет — ничего не пишется
+    graph_writes.clear()
+    assert replay(tmp_path, checkpoint)["written"] == 0
+    assert graph_writes == []
+
+
+def test_replay_windows_batches_and_resume(tmp_path, graph_writes):
+    _export(tmp_path, [(EventType.CHARACTER_CREATE.value, {"id": f"c{i}", "name": f"C{i}"}) for i in range(5)])
+    checkpoint = tmp_path / "cp.json"
+    summary = replay(tmp_path, checkpoint, start_offset=2, batch_size=2, window=2, role_contexts=False)
+    assert (summary["start_offset"], summary["offset"], summary["written"]) == (2, 5, 3)
+    assert sorted(r["id"] for r in _rows(graph_writes, "MERGE (n:Character")) == ["c2", "c3", "c4"]
+    # Окна [c2, c3] и [c4]: по одному пакету на окно
+    assert sum(1 for tx in graph_writes for query, _ in tx if "MERGE (n:Character" in query) == 2
@@ -1,4 +1,6 @@
 """Configuration for LLM (GigaChat) service."""
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 
 
@@ -6,6 +8,21 @@ class Settings(BaseSettings):
     """Settings from environment."""
 
     gigachat_credentials: str | None = None  # Base64 key; if unset, /chat returns stub
+    gigachat_scope: str | None = None  # GIGACHAT_API_PERS / _B2B / _CORP; None — по умолчанию SDK
+    gigachat_verify_ssl_certs: bool = True
+    gigachat_timeout_sec: float = 120.0
+    gigachat_token_refresh_margin_sec: float = 120.0  # обновлять токен заранее, за столько секунд до истечения
+    # Провайдер: auto — GigaChat при заданных credentials, иначе заглушка; fake — локальный фейк (тесты, нагрузка)
+    llm_provider: Literal["auto", "gigachat", "fake"] = "auto"
+    fake_llm_latency_sec: float = 0.0
+    # Ограничения вызовов провайдера
+    llm_max_concurrency: int = 8  # одновременных запросов к провайдеру
+    llm_queue_timeout_sec: float = 60.0  # сколько запрос может ждать слота/токена, затем 503
+    llm_rate_limit_per_sec: float = 0.0  # token bucket под квоту провайдера; 0 — без ограничения
+    llm_rate_limit_burst: int = 5
+    # Диалоги /chat по conversation_id (история в памяти процесса)
+    llm_conversation_max: int = 1000
+    llm_conversation_ttl_sec: float = 600.0
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,36 @@
+"""
+Диалоги /chat по conversation_id: история сообщений хранится в памяти процесса, и вызывающая сторона
+шлёт только новые реплики (append=true). Неизвестный или вытесненный диалог — 409: вызывающий
+повторяет запрос с полной историей. Объём ограничен: не больше max_conversations (LRU) и TTL
+с последнего обращения.
+"""
+import time
+from collections import OrderedDict
+
+
+class ConversationStore:
+    """История диалогов. Используется из одного event loop — без блокировок."""
+
+    def __init__(self, max_conversations: int = 1000, ttl_sec: float = 600) -> None:
+        self._max = max_conversations
+        self._ttl_sec = ttl_sec
+        self._items: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+
+    def get(self, conversation_id: str) -> list[dict] | None:
+        item = self._items.get(conversation_id)
+        if item is None:
+            return None
+        if time.monotonic() - item[0] > self._ttl_sec:
+            del self._items[conversation_id]
+            return None
+        self._items.move_to_end(conversation_id)
+        return item[1]
+
+    def put(self, conversation_id: str, messages: list[dict]) -> None:
+        self._items[conversation_id] = (time.monotonic(), messages)
+        self._items.move_to_end(conversation_id)
+        while len(self._items) > self._max:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
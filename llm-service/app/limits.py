@@ -0,0 +1,75 @@
+"""Ограничение вызовов провайдера: семафор (одновременные запросы) и token bucket (квота в секунду)."""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from app.metrics import llm_in_flight, llm_queue_depth, llm_queue_wait_seconds
+
+
+class QueueTimeout(Exception):
+    """Запрос не дождался слота или токена за queue_timeout."""
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше burst про запас. rate <= 0 — без ограничения."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate = rate
+        self._capacity = max(burst, 1)
+        self._tokens = float(self._capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self._rate <= 0:
+            return
+        # Под lock очередь ждущих справедливая (FIFO): каждый ждёт ровно до своего токена
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class CallLimiter:
+    """Не больше max_concurrency вызовов одновременно и не чаще rate в секунду; ожидание — в метрике."""
+
+    def __init__(self, max_concurrency: int, rate: float, burst: int, queue_timeout: float) -> None:
+        self._semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+        self._bucket = TokenBucket(rate, burst)
+        self._queue_timeout = queue_timeout
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self) -> None:
+        """Занять слот (для потоковых ответов, где слот держится дольше вызова обработчика). QueueTimeout."""
+        start = time.monotonic()
+        llm_queue_depth.inc()
+        acquired = False
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._queue_timeout)
+            acquired = True
+            remaining = self._queue_timeout - (time.monotonic() - start)
+            await asyncio.wait_for(self._bucket.acquire(), max(remaining, 0))
+        except asyncio.TimeoutError:
+            if acquired:
+                self._semaphore.release()
+            raise QueueTimeout(f"LLM provider is busy (waited {self._queue_timeout:.0f}s)")
+        finally:
+            llm_queue_depth.dec()
+        llm_queue_wait_seconds.observe(time.monotonic() - start)
+        llm_in_flight.inc()
+
+    def release(self) -> None:
+        llm_in_flight.dec()
+        self._semaphore.release()
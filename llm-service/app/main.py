@@ -2,24 +2,73 @@
 LLM microservice: два режима работы.
 
 1) Вопросы по базе знаний (context передаётся снаружи): вызывающая сторона решает
-   применять поиск до ~3 раз и передаёт накопленный context в каждом вызове /chat.
+   применять поиск до ~3 раз. /chat принимает prompt/system или список сообщений messages
+   (system, user, assistant); с conversation_id история диалога хранится здесь (app/conversations.py),
+   и следующий раунд присылает только новые реплики (append=true). Модели уходит весь диалог (история
+   без изменений + новые реплики) с conversation_id в качестве id сессии провайдера (GigaChat — X-Session-ID).
+   /chat/stream — то же, но ответ приходит по мере генерации (Server-Sent Events).
 2) Генерация сущностей (локация, персонаж, понятие, сцена): ответ — JSON в формате
    сообщения для создания объекта (без сохранения в БД).
 """
 import json
+import logging
 import re
+import time
+from collections.abc import AsyncIterator, Callable
 from typing import Literal
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field, model_validator
+
+from app.config import settings
+from app.conversations import ConversationStore
+from app.limits import CallLimiter, QueueTimeout
+from app.metrics import (
+    llm_conversation_requests_total,
+    llm_request_duration_seconds,
+    llm_requests_total,
+    llm_time_to_first_token_seconds,
+)
+from app.providers import NOT_CONFIGURED, LLMProvider, build_provider, to_messages
+
+logger = logging.getLogger(__name__)
+
+MAX_GENERATE_COUNT = 50  # сущностей за один вызов /generate; больше — частями на стороне вызывающего
 
 
 # --- Schemas ---
 
+class ChatMessage(BaseModel):
+    role: Literal["system", "user", "assistant"]
+    content: str = Field(..., min_length=1)
+
+
 class ChatRequest(BaseModel):
-    """Запрос к /chat (вопрос по базе знаний с уже подставленным context)."""
-    prompt: str = Field(..., min_length=1)
+    """
+    Запрос к /chat (вопрос по базе знаний с уже подставленным context): prompt/system или messages.
+    conversation_id — сохранить диалог; append=true — messages продолжают сохранённую историю.
+    """
+    prompt: str | None = Field(default=None, min_length=1)
     system: str | None = None
+    messages: list[ChatMessage] | None = Field(default=None, min_length=1)
+    conversation_id: str | None = Field(default=None, min_length=1, max_length=200)
+    append: bool = False
+
+    @model_validator(mode="after")
+    def _prompt_or_messages(self):
+        if (self.prompt is None) == (self.messages is None):
+            raise ValueError("either prompt or messages is required")
+        if self.append and not self.conversation_id:
+            raise ValueError("append requires conversation_id")
+        return self
+
+    def new_messages(self) -> list[dict]:
+        if self.messages is not None:
+            return [m.model_dump() for m in self.messages]
+        return to_messages(self.prompt, self.system)
 
 
 class ChatResponse(BaseModel):
@@ -31,12 +80,23 @@ class GenerateRequest(BaseModel):
     """Запрос на генерацию сущности (не сохраняется в БД)."""
     entity_type: Literal["location", "character", "concept", "scene"] = Field(...)
     prompt: str = Field(default="", description="Подсказка для генерации")
+    count: int = Field(
+        default=1,
+        ge=1,
+        le=MAX_GENERATE_COUNT,
+        description="Сколько сущностей сгенерировать; задан (даже 1) — ответ с items/errors, каждая сущность проверена",
+    )
+    prompts: list[str] | None = Field(
+        default=None, min_length=1, max_length=MAX_GENERATE_COUNT, description="Подсказка на каждую сущность"
+    )
 
 
 class GenerateResponse(BaseModel):
-    """Ответ генерации: payload готов для отправки в API создания."""
+    """Ответ генерации: payload готов для отправки в API создания. При count/prompts — items и errors."""
     entity_type: Literal["location", "character", "concept", "scene"]
     payload: dict
+    items: list[dict] | None = None
+    errors: list[dict] | None = None
 
 
 # --- Entity schemas for LLM instructions ---
@@ -47,36 +107,229 @@ ENTITY_SCHEMAS = {
     "concept": '{"name": "string", "description": "string"}',
     "scene": '{"title": "string", "description": "string", "location_id": "string", "character_ids": ["string"]}',
 }
+_ENTITY_FIELDS = {entity_type: json.loads(schema) for entity_type, schema in ENTITY_SCHEMAS.items()}
+_IDS_HINT = (
+    "Для location_id и character_ids используй существующие id или заглушки вроде \"loc-1\", \"char-1\" если не задано."
+)
+
+
+def _extract_json(text: str):
+    """JSON из ответа модели (может быть обёрнут в ```json ... ``` или окружён текстом). ValueError — не найден."""
+    text_clean = text.strip()
+    m = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text_clean)
+    if m:
+        text_clean = m.group(1).strip()
+    try:
+        return json.loads(text_clean)
+    except json.JSONDecodeError:
+        pass
+    for open_char, close_char in (("[", "]"), ("{", "}")):
+        start, end = text_clean.find(open_char), text_clean.rfind(close_char) + 1
+        if start != -1 and end > start:
+            try:
+                return json.loads(text_clean[start:end])
+            except json.JSONDecodeError:
+                continue
+    raise ValueError("no JSON in model answer")
+
+
+def _with_defaults(entity_type: str, payload: dict) -> dict:
+    if entity_type == "scene":
+        payload.setdefault("title", payload.get("name", "Сцена"))
+        payload.setdefault("description", "")
+        payload.setdefault("location_id", "")
+        payload.setdefault("character_ids", [])
+    else:
+        payload.setdefault("name", "")
+        payload.setdefault("description", "")
+    return payload
+
+
+def validate_item(entity_type: str, item) -> dict:
+    """Объект из массива модели по ENTITY_SCHEMAS: только поля схемы, типы строк/списков строк, непустое имя."""
+    if not isinstance(item, dict):
+        raise ValueError("не JSON-объект")
+    if entity_type == "scene" and not item.get("title"):
+        item = {**item, "title": item.get("name")}
+    clean = {}
+    for field, kind in _ENTITY_FIELDS[entity_type].items():
+        value = item.get(field)
+        if isinstance(kind, list):
+            value = [] if value is None else value
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                raise ValueError(f"{field}: ожидается список строк")
+        else:
+            value = "" if value is None else value
+            if not isinstance(value, str):
+                raise ValueError(f"{field}: ожидается строка")
+        clean[field] = value
+    key = "title" if entity_type == "scene" else "name"
+    if not clean[key].strip():
+        raise ValueError(f"{key}: пустое значение")
+    return clean
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _chat_events(
+    provider: LLMProvider,
+    messages: list[dict],
+    release: Callable[[], None],
+    on_done: Callable[[str], None] | None = None,
+    session_id: str | None = None,
+) -> AsyncIterator[str]:
+    """События /chat/stream: delta на каждый кусок текста, в конце done с полным ответом (или error)."""
+    status = "error"
+    parts: list[str] = []
+    start = time.perf_counter()
+    try:
+        async for delta in provider.stream_chat(messages, session_id=session_id):
+            if not parts:
+                llm_time_to_first_token_seconds.labels(endpoint="chat_stream").observe(time.perf_counter() - start)
+            parts.append(delta)
+            yield _sse("delta", {"delta": delta})
+        status = "ok"
+        answer = "".join(parts) or "(пустой ответ модели)"
+        if on_done is not None:
+            on_done(answer)
+        yield _sse("done", {"answer": answer})
+    except Exception as e:
+        logger.exception("LLM stream failed: %s", e)
+        yield _sse("error", {"detail": str(e)})
+    finally:
+        llm_request_duration_seconds.labels(endpoint="chat_stream").observe(time.perf_counter() - start)
+        llm_requests_total.labels(endpoint="chat_stream", status=status).inc()
+        release()
+
+
+def create_app(provider: LLMProvider | None = None) -> FastAPI:
+    """provider — для тестов (FakeProvider или GigaChatProvider с фейковым клиентом); иначе по настройкам."""
+    app = FastAPI(title="WinM LLM Service", version="0.3.0")
+    app.state.provider = provider or build_provider(settings)
+    app.state.limiter = CallLimiter(
+        max_concurrency=settings.llm_max_concurrency,
+        rate=settings.llm_rate_limit_per_sec,
+        burst=settings.llm_rate_limit_burst,
+        queue_timeout=settings.llm_queue_timeout_sec,
+    )
+    app.state.conversations = ConversationStore(
+        max_conversations=settings.llm_conversation_max,
+        ttl_sec=settings.llm_conversation_ttl_sec,
+    )
 
+    @app.on_event("startup")
+    async def startup() -> None:
+        await app.state.provider.start()
 
-def create_app() -> FastAPI:
-    app = FastAPI(title="WinM LLM Service", version="0.2.0")
+    @app.on_event("shutdown")
+    async def shutdown() -> None:
+        await app.state.provider.close()
 
     @app.get("/health")
     def health() -> dict:
         return {"status": "ok"}
 
-    def _call_giga(prompt: str, system: str | None = None) -> str:
-        from app.config import settings
-        if not settings.gigachat_credentials:
-            return "[LLM не настроен] Задайте GIGACHAT_CREDENTIALS."
-        from gigachat import GigaChat
-        full = (f"{system}\n\n" if system else "") + prompt
-        with GigaChat(credentials=settings.gigachat_credentials) as giga:
-            response = giga.chat(full)
-            return (response.choices[0].message.content if response.choices else "") or ""
+    @app.get("/metrics")
+    def metrics() -> Response:
+        """Prometheus scrape endpoint."""
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    async def _call_llm(request: Request, endpoint: str, messages: list[dict], session_id: str | None = None) -> str:
+        """
+        Вызов провайдера через общий лимитер (семафор + token bucket). Очередь переполнена — 503.
+        session_id — conversation_id диалога: провайдер связывает по нему раунды (GigaChat — X-Session-ID).
+        """
+        provider: LLMProvider = request.app.state.provider
+        if not provider.configured:
+            return await provider.chat(messages)
+        status = "error"
+        try:
+            async with request.app.state.limiter.slot():
+                start = time.perf_counter()
+                try:
+                    text = await provider.chat(messages, session_id=session_id)
+                finally:
+                    llm_request_duration_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - start)
+            status = "ok"
+            return text
+        except QueueTimeout as e:
+            status = "queue_timeout"
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        finally:
+            llm_requests_total.labels(endpoint=endpoint, status=status).inc()
+
+    def _dialog(body: ChatRequest, request: Request) -> tuple[list[dict], Callable[[str], None]]:
+        """
+        Сообщения для модели (сохранённая история + новые) и remember(answer) — сохранить диалог с ответом.
+        append для неизвестного (истёкшего, вытесненного, с другой реплики) диалога — 409.
+        """
+        conversations: ConversationStore = request.app.state.conversations
+        messages = body.new_messages()
+        if body.append:
+            history = conversations.get(body.conversation_id)
+            if history is None:
+                llm_conversation_requests_total.labels(result="not_found").inc()
+                raise HTTPException(status_code=409, detail="Conversation not found; send the full history")
+            llm_conversation_requests_total.labels(result="continued").inc()
+            messages = history + messages
+        elif body.conversation_id:
+            llm_conversation_requests_total.labels(result="new").inc()
+
+        def remember(answer: str) -> None:
+            if body.conversation_id:
+                conversations.put(body.conversation_id, messages + [{"role": "assistant", "content": answer}])
+
+        return messages, remember
 
     @app.post("/chat", response_model=ChatResponse)
-    def chat(body: ChatRequest) -> ChatResponse:
+    async def chat(body: ChatRequest, request: Request) -> ChatResponse:
         """Один раунд диалога. Для вопросов по базе знаний вызывающая сторона сама решает применять поиск и передаёт context в prompt/system."""
-        text = _call_giga(body.prompt, body.system)
-        return ChatResponse(answer=text or "(пустой ответ модели)")
-
-    @app.post("/generate", response_model=GenerateResponse)
-    def generate(body: GenerateRequest) -> GenerateResponse:
-        """Сгенерировать одну сущность. Ответ — JSON, готовый для тела запроса создания (POST /api/locations и т.д.). В БД не сохраняется."""
-        from app.config import settings
-        if not settings.gigachat_credentials:
+        messages, remember = _dialog(body, request)
+        text = await _call_llm(request, "chat", messages, session_id=body.conversation_id) or "(пустой ответ модели)"
+        remember(text)
+        return ChatResponse(answer=text)
+
+    @app.post("/chat/stream")
+    async def chat_stream(body: ChatRequest, request: Request) -> StreamingResponse:
+        """
+        /chat с потоковым ответом (text/event-stream): `delta` {"delta"} по мере генерации, затем `done` {"answer"}
+        или `error` {"detail"}. Слот лимитера занят до конца потока; не дождались слота — 503 до начала потока.
+        """
+        provider: LLMProvider = request.app.state.provider
+        limiter: CallLimiter = request.app.state.limiter
+        messages, remember = _dialog(body, request)
+        released = not provider.configured
+        if provider.configured:
+            try:
+                await limiter.acquire()
+            except QueueTimeout as e:
+                llm_requests_total.labels(endpoint="chat_stream", status="queue_timeout").inc()
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+        def release() -> None:
+            # Из генератора (поток дочитан или оборван) или фоновой задачей ответа, если поток не начался
+            nonlocal released
+            if not released:
+                released = True
+                limiter.release()
+
+        return StreamingResponse(
+            _chat_events(provider, messages, release, on_done=remember, session_id=body.conversation_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(release),
+        )
+
+    @app.post("/generate", response_model=GenerateResponse, response_model_exclude_none=True)
+    async def generate(body: GenerateRequest, request: Request) -> GenerateResponse:
+        """
+        Сгенерировать сущность. Ответ — JSON, готовый для тела запроса создания (POST /api/locations и т.д.). В БД не сохраняется.
+        count (задан явно, даже 1) или prompts — сущности одним вызовом модели (JSON-массив): каждая проверяется
+        по ENTITY_SCHEMAS, прошедшие — в items, остальные — в errors (index, error).
+        """
+        if not request.app.state.provider.configured:
             raise HTTPException(
                 status_code=503,
                 detail="LLM не настроен. Задайте GIGACHAT_CREDENTIALS.",
@@ -86,47 +339,61 @@ def create_app() -> FastAPI:
             "Ты помощник по созданию контента для визуальной новеллы. "
             "Отвечай только валидным JSON без markdown и пояснений."
         )
-        prompt = (
-            f"Сгенерируй один объект для сущности типа {body.entity_type}. "
-            f"Схема: {schema}. "
-        )
-        if body.prompt:
-            prompt += f"Подсказка: {body.prompt}. "
-        prompt += "Верни только JSON объект с полями по схеме. Для location_id и character_ids используй существующие id или заглушки вроде \"loc-1\", \"char-1\" если не задано."
+        count = len(body.prompts) if body.prompts else body.count
+        single = body.prompts is None and "count" not in body.model_fields_set
+        if single:
+            prompt = (
+                f"Сгенерируй один объект для сущности типа {body.entity_type}. "
+                f"Схема: {schema}. "
+            )
+            if body.prompt:
+                prompt += f"Подсказка: {body.prompt}. "
+            prompt += "Верни только JSON объект с полями по схеме. " + _IDS_HINT
+        else:
+            prompt = (
+                f"Сгенерируй {count} разных объектов для сущности типа {body.entity_type}. "
+                f"Схема одного объекта: {schema}. "
+            )
+            if body.prompt:
+                prompt += f"Общая подсказка: {body.prompt}. "
+            if body.prompts:
+                prompt += "Подсказки по порядку, по одной на объект:\n"
+                prompt += "\n".join(f"{i}. {p}" for i, p in enumerate(body.prompts, 1)) + "\n"
+            prompt += f"Верни только JSON-массив из {count} объектов по схеме, в том же порядке. " + _IDS_HINT
 
-        text = _call_giga(prompt, system)
-        if not text or "[LLM не настроен]" in text:
+        text = await _call_llm(request, "generate", to_messages(prompt, system))
+        if not text or NOT_CONFIGURED in text:
             raise HTTPException(status_code=503, detail=text or "Пустой ответ LLM")
-
-        # Вытащить JSON из ответа (модель может обернуть в ```json ... ```)
-        text_clean = text.strip()
-        m = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text_clean)
-        if m:
-            text_clean = m.group(1).strip()
         try:
-            payload = json.loads(text_clean)
-        except json.JSONDecodeError:
-            start = text_clean.find("{")
-            if start != -1:
-                end = text_clean.rfind("}") + 1
-                if end > start:
-                    try:
-                        payload = json.loads(text_clean[start:end])
-                    except json.JSONDecodeError:
-                        raise HTTPException(status_code=502, detail="LLM вернул невалидный JSON")
-            else:
-                raise HTTPException(status_code=502, detail="LLM вернул невалидный JSON")
+            parsed = _extract_json(text)
+        except ValueError:
+            raise HTTPException(status_code=502, detail="LLM вернул невалидный JSON")
 
-        if body.entity_type == "scene":
-            payload.setdefault("title", payload.get("name", "Сцена"))
-            payload.setdefault("description", "")
-            payload.setdefault("location_id", "")
-            payload.setdefault("character_ids", [])
-        else:
-            payload.setdefault("name", "")
-            payload.setdefault("description", "")
+        if single:
+            if not isinstance(parsed, dict):
+                raise HTTPException(status_code=502, detail="LLM вернул невалидный JSON")
+            return GenerateResponse(entity_type=body.entity_type, payload=_with_defaults(body.entity_type, parsed))
 
-        return GenerateResponse(entity_type=body.entity_type, payload=payload)
+        if isinstance(parsed, dict):
+            # {"items": [...]} или один объект вместо массива
+            parsed = next((v for v in parsed.values() if isinstance(v, list)), [parsed])
+        if not isinstance(parsed, list):
+            raise HTTPException(status_code=502, detail="LLM вернул не JSON-массив")
+        items, errors = [], []
+        for index in range(count):
+            if index >= len(parsed):
+                errors.append({"index": index, "error": "нет в ответе модели"})
+                continue
+            try:
+                items.append(validate_item(body.entity_type, parsed[index]))
+            except ValueError as e:
+                errors.append({"index": index, "error": str(e)})
+        return GenerateResponse(
+            entity_type=body.entity_type,
+            payload=items[0] if items else {},
+            items=items,
+            errors=errors,
+        )
 
     return app
 
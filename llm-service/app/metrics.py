@@ -0,0 +1,43 @@
+"""Prometheus-метрики llm-service (GET /metrics)."""
+from prometheus_client import Counter, Gauge, Histogram
+
+llm_requests_total = Counter(
+    "llm_provider_requests_total",
+    "Requests to the LLM provider",
+    ["endpoint", "status"],
+)
+llm_request_duration_seconds = Histogram(
+    "llm_provider_request_duration_seconds",
+    "Duration of LLM provider calls (without queue wait)",
+    ["endpoint"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+llm_time_to_first_token_seconds = Histogram(
+    "llm_provider_time_to_first_token_seconds",
+    "Streaming calls: time from the provider call to the first text delta",
+    ["endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+llm_queue_wait_seconds = Histogram(
+    "llm_queue_wait_seconds",
+    "Time a request waited for a concurrency slot and a rate-limit token",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+llm_in_flight = Gauge(
+    "llm_in_flight",
+    "Provider calls currently in flight",
+)
+llm_queue_depth = Gauge(
+    "llm_queue_depth",
+    "Requests waiting for a concurrency slot or rate-limit token",
+)
+llm_token_refresh_total = Counter(
+    "llm_provider_token_refresh_total",
+    "Provider OAuth token refreshes (cached: the client still had a usable token)",
+    ["result"],
+)
+llm_conversation_requests_total = Counter(
+    "llm_conversation_requests_total",
+    "Chat requests with conversation_id: new, continued (only new turns sent) or not_found (409)",
+    ["result"],
+)
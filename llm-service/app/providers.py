@@ -0,0 +1,258 @@
+"""
+Провайдеры LLM. Один долгоживущий экземпляр на процесс (создаётся при старте приложения).
+
+- GigaChatProvider — постоянный клиент GigaChat: одно TLS-соединение/пул и OAuth-токен на весь
+  процесс; токен обновляется заранее фоновой задачей, чтобы запросы не ждали авторизацию.
+- StubProvider — GIGACHAT_CREDENTIALS не заданы: прежний ответ-заглушка.
+- FakeProvider — локальный фейк без сети (тесты, нагрузочные прогоны): LLM_PROVIDER=fake.
+
+Вызов модели — список сообщений [{"role": "system" | "user" | "assistant", "content"}] (chat / stream_chat);
+complete(prompt, system) — то же для одного вопроса. Провайдер без поддержки ролей получает диалог
+одним текстом (flatten_messages). session_id — id диалога (conversation_id): GigaChat получает его
+заголовком X-Session-ID и может кэшировать общий префикс раундов; остальные провайдеры его не используют.
+"""
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import contextmanager
+
+from app.config import Settings
+from app.metrics import llm_token_refresh_total
+
+logger = logging.getLogger(__name__)
+
+NOT_CONFIGURED = "[LLM не настроен] Задайте GIGACHAT_CREDENTIALS."
+
+_ROLE_TITLES = {"user": "Пользователь", "assistant": "Ассистент"}
+
+
+def to_messages(prompt: str, system: str | None = None) -> list[dict]:
+    return ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+
+
+def flatten_messages(messages: list[dict]) -> tuple[str, str | None]:
+    """(prompt, system) из списка сообщений: system — системные сообщения, prompt — реплики по порядку."""
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system") or None
+    turns = [m for m in messages if m["role"] != "system"]
+    if len(turns) == 1 and turns[0]["role"] == "user":
+        return turns[0]["content"], system
+    return "\n\n".join(f"{_ROLE_TITLES[m['role']]}: {m['content']}" for m in turns), system
+
+
+class LLMProvider(ABC):
+    """
+    Интерфейс провайдера: start/close вокруг жизни приложения, complete и chat — один вызов модели.
+    Провайдер без поддержки ролей реализует chat через complete(*flatten_messages(messages)).
+    """
+
+    configured = True
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def complete(self, prompt: str, system: str | None = None) -> str:
+        ...
+
+    async def stream(self, prompt: str, system: str | None = None) -> AsyncIterator[str]:
+        """Ответ по частям (дельты текста). По умолчанию — одним куском после complete."""
+        yield await self.complete(prompt, system)
+
+    @abstractmethod
+    async def chat(self, messages: list[dict], session_id: str | None = None) -> str:
+        """Ответ на диалог; session_id связывает раунды одного диалога на стороне провайдера."""
+
+    async def stream_chat(self, messages: list[dict], session_id: str | None = None) -> AsyncIterator[str]:
+        async for delta in self.stream(*flatten_messages(messages)):
+            yield delta
+
+
+class StubProvider(LLMProvider):
+    configured = False
+
+    async def complete(self, prompt: str, system: str | None = None) -> str:
+        return NOT_CONFIGURED
+
+    async def chat(self, messages: list[dict], session_id: str | None = None) -> str:
+        return NOT_CONFIGURED
+
+
+class FakeProvider(LLMProvider):
+    """
+    Отвечает без сети: responder(prompt, system) или по умолчанию — JSON-объект, если system просит JSON
+    (генерация), иначе «ANSWER: …». latency_sec имитирует время ответа модели.
+    """
+
+    def __init__(self, latency_sec: float = 0.0, responder: Callable[[str, str | None], str] | None = None) -> None:
+        self._latency_sec = latency_sec
+        self._responder = responder or self._default_answer
+        self.calls = 0
+
+    async def complete(self, prompt: str, system: str | None = None) -> str:
+        self.calls += 1
+        if self._latency_sec:
+            await asyncio.sleep(self._latency_sec)
+        return self._responder(prompt, system)
+
+    async def chat(self, messages: list[dict], session_id: str | None = None) -> str:
+        return await self.complete(*flatten_messages(messages))
+
+    async def stream(self, prompt: str, system: str | None = None) -> AsyncIterator[str]:
+        """Ответ по словам; latency_sec распределяется между ними, как при генерации токенов."""
+        self.calls += 1
+        words = self._responder(prompt, system).split(" ")
+        for i, word in enumerate(words):
+            if self._latency_sec:
+                await asyncio.sleep(self._latency_sec / len(words))
+            yield word if i == 0 else " " + word
+
+    @staticmethod
+    def _default_answer(prompt: str, system: str | None) -> str:
+        if system and "JSON" in system:
+            return json.dumps({"name": "Fake", "title": "Fake", "description": prompt[:100]}, ensure_ascii=False)
+        return f"ANSWER: fake answer ({len(prompt)} chars of prompt)"
+
+
+@contextmanager
+def _session(session_id: str | None) -> Iterator[None]:
+    """
+    X-Session-ID для запросов GigaChat внутри блока (SDK берёт его из contextvar). Раунды одного диалога
+    идут с одним id и начинаются с одного и того же префикса (история без изменений + новые реплики),
+    поэтому GigaChat может не обрабатывать префикс заново.
+    """
+    if not session_id:
+        yield
+        return
+    from gigachat.context import session_id_cvar
+
+    token = session_id_cvar.set(session_id)
+    try:
+        yield
+    finally:
+        session_id_cvar.reset(token)
+
+
+class GigaChatProvider(LLMProvider):
+    """
+    Постоянный клиент GigaChat. client_factory() возвращает объект с async-методами
+    achat({"messages": [...]}), astream(...), aget_token() -> AccessToken(expires_at в мс) и aclose() — в тестах подставляется фейк.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], object],
+        refresh_margin_sec: float = 120.0,
+        min_refresh_interval_sec: float = 5.0,
+    ) -> None:
+        self._client_factory = client_factory
+        self._refresh_margin_sec = refresh_margin_sec
+        self._min_refresh_interval_sec = min_refresh_interval_sec
+        self._client = None
+        self._refresh_task: asyncio.Task | None = None
+        self._token_expires_at = 0
+
+    async def start(self) -> None:
+        self._client = self._client_factory()
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def complete(self, prompt: str, system: str | None = None) -> str:
+        return await self.chat(to_messages(prompt, system))
+
+    async def stream(self, prompt: str, system: str | None = None) -> AsyncIterator[str]:
+        async for delta in self.stream_chat(to_messages(prompt, system)):
+            yield delta
+
+    async def chat(self, messages: list[dict], session_id: str | None = None) -> str:
+        """Системная инструкция и реплики уходят сообщениями с ролями (а не одним текстом)."""
+        if self._client is None:
+            await self.start()
+        # SDK сам берёт кэшированный токен и обновляет его, только если он истёк
+        with _session(session_id):
+            response = await self._client.achat({"messages": messages})
+        return (response.choices[0].message.content if response.choices else "") or ""
+
+    async def stream_chat(self, messages: list[dict], session_id: str | None = None) -> AsyncIterator[str]:
+        if self._client is None:
+            await self.start()
+        with _session(session_id):
+            async for chunk in self._client.astream({"messages": messages}):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+
+    async def refresh_token(self) -> float | None:
+        """
+        Получить/обновить токен. Возвращает секунды до его истечения (None — неизвестно).
+        SDK отдаёт кэшированный токен, пока до истечения больше token_expiry_buffer_ms, — такой
+        вызов считается как result="cached", а не как обновление.
+        """
+        try:
+            token = await self._client.aget_token()
+        except Exception:
+            llm_token_refresh_total.labels(result="error").inc()
+            raise
+        expires_at = getattr(token, "expires_at", 0) or 0
+        cached = bool(expires_at) and expires_at == self._token_expires_at
+        llm_token_refresh_total.labels(result="cached" if cached else "ok").inc()
+        self._token_expires_at = expires_at
+        return expires_at / 1000 - time.time() if expires_at else None
+
+    async def _refresh_loop(self) -> None:
+        """
+        Держать токен свежим: обновлять за refresh_margin_sec до истечения. Клиент должен считать токен
+        непригодным за то же время (token_expiry_buffer_ms в build_provider), иначе aget_token вернёт
+        кэшированный и цикл будет опрашивать его каждые min_refresh_interval_sec до обновления самим SDK.
+        """
+        while True:
+            try:
+                expires_in = await self.refresh_token()
+                delay = (expires_in - self._refresh_margin_sec) if expires_in is not None else 600
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("GigaChat token refresh failed: %s", e)
+                delay = self._min_refresh_interval_sec
+            await asyncio.sleep(max(delay, self._min_refresh_interval_sec))
+
+
+def build_provider(settings: Settings) -> LLMProvider:
+    """Провайдер по настройкам (LLM_PROVIDER, GIGACHAT_*)."""
+    if settings.llm_provider == "fake":
+        return FakeProvider(latency_sec=settings.fake_llm_latency_sec)
+    if not settings.gigachat_credentials:
+        return StubProvider()
+
+    def factory():
+        from gigachat import GigaChat
+
+        kwargs = {
+            "credentials": settings.gigachat_credentials,
+            "verify_ssl_certs": settings.gigachat_verify_ssl_certs,
+            "timeout": settings.gigachat_timeout_sec,
+            "max_connections": settings.llm_max_concurrency,
+            # SDK обновляет токен, когда до истечения меньше этого запаса, — тот же, что у _refresh_loop
+            "token_expiry_buffer_ms": int(settings.gigachat_token_refresh_margin_sec * 1000),
+        }
+        if settings.gigachat_scope:
+            kwargs["scope"] = settings.gigachat_scope
+        return GigaChat(**kwargs)
+
+    return GigaChatProvider(factory, refresh_margin_sec=settings.gigachat_token_refresh_margin_sec)
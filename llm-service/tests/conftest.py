@@ -0,0 +1,17 @@
+"""Pytest fixtures for llm-service: приложение с локальным фейковым провайдером."""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import create_app
+from app.providers import FakeProvider
+
+
+@pytest.fixture
+def fake_provider():
+    return FakeProvider()
+
+
+@pytest.fixture
+def client(fake_provider):
+    with TestClient(create_app(provider=fake_provider)) as c:
+        yield c
@@ -0,0 +1,23 @@
+"""Tests for the in-memory conversation store (LRU + TTL)."""
+from unittest.mock import patch
+
+from app.conversations import ConversationStore
+
+
+def test_store_evicts_least_recently_used():
+    store = ConversationStore(max_conversations=2)
+    store.put("a", [1])
+    store.put("b", [2])
+    store.get("a")
+    store.put("c", [3])
+    assert store.get("b") is None
+    assert store.get("a") == [1]
+
+
+def test_store_expires_idle_conversations():
+    store = ConversationStore(ttl_sec=10)
+    with patch("app.conversations.time.monotonic", return_value=100.0):
+        store.put("a", [1])
+    with patch("app.conversations.time.monotonic", return_value=111.0):
+        assert store.get("a") is None
+    assert len(store) == 0
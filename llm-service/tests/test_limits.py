@@ -0,0 +1,60 @@
+"""Tests for limits (семафор и token bucket перед провайдером)."""
+import asyncio
+import time
+
+import pytest
+
+from app.limits import CallLimiter, QueueTimeout, TokenBucket
+
+
+async def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    # 2 сразу (burst), ещё 2 — по 1/20 с
+    assert 0.08 <= time.monotonic() - start < 0.5
+
+
+async def test_token_bucket_unlimited():
+    bucket = TokenBucket(rate=0, burst=1)
+    for _ in range(1000):
+        await bucket.acquire()
+
+
+async def test_limiter_caps_concurrency():
+    limiter = CallLimiter(max_concurrency=2, rate=0, burst=1, queue_timeout=5)
+    active = 0
+    peak = 0
+
+    async def call():
+        nonlocal active, peak
+        async with limiter.slot():
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*(call() for _ in range(10)))
+    assert peak == 2
+
+
+async def test_limiter_queue_timeout_releases_nothing_extra():
+    limiter = CallLimiter(max_concurrency=1, rate=0, burst=1, queue_timeout=0.02)
+    async with limiter.slot():
+        with pytest.raises(QueueTimeout):
+            async with limiter.slot():
+                pass
+    # Слот свободен снова
+    async with limiter.slot():
+        pass
+
+
+async def test_limiter_rate_timeout_returns_slot():
+    limiter = CallLimiter(max_concurrency=1, rate=1, burst=1, queue_timeout=0.05)
+    async with limiter.slot():
+        pass
+    with pytest.raises(QueueTimeout):  # токен кончился, следующий через 1 с
+        async with limiter.slot():
+            pass
+    assert not limiter._semaphore.locked()
@@ -0,0 +1,233 @@
+"""Tests for llm-service API (/chat, /generate, /metrics)."""
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import create_app
+from app.providers import FakeProvider, StubProvider
+
+
+def test_chat(client, fake_provider):
+    r = client.post("/chat", json={"prompt": "Кто такая Алиса?", "system": "Ты помощник"})
+    assert r.status_code == 200
+    assert r.json()["answer"].startswith("ANSWER: fake answer")
+    assert fake_provider.calls == 1
+
+
+def test_generate_parses_fenced_json():
+    provider = FakeProvider(responder=lambda prompt, system: '```json\n{"name": "Таверна"}\n```')
+    with TestClient(create_app(provider=provider)) as client:
+        r = client.post("/generate", json={"entity_type": "location", "prompt": "уютная"})
+    assert r.status_code == 200
+    assert r.json() == {"entity_type": "location", "payload": {"name": "Таверна", "description": ""}}
+
+
+def test_generate_invalid_json_502():
+    provider = FakeProvider(responder=lambda prompt, system: "не JSON")
+    with TestClient(create_app(provider=provider)) as client:
+        r = client.post("/generate", json={"entity_type": "character"})
+    assert r.status_code == 502
+
+
+def test_not_configured_stub():
+    with TestClient(create_app(provider=StubProvider())) as client:
+        assert "[LLM не настроен]" in client.post("/chat", json={"prompt": "x"}).json()["answer"]
+        assert client.post("/generate", json={"entity_type": "concept"}).status_code == 503
+
+
+def test_queue_timeout_503(monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main.settings, "llm_max_concurrency", 1)
+    monkeypatch.setattr(main.settings, "llm_queue_timeout_sec", 0.05)
+    app = create_app(provider=FakeProvider())
+
+    async def scenario():
+        async with app.state.limiter.slot():  # единственный слот занят
+            from httpx import ASGITransport, AsyncClient
+
+            async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as c:
+                return await c.post("/chat", json={"prompt": "x"})
+
+    r = asyncio.run(scenario())
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "5"
+
+
+def test_metrics(client):
+    client.post("/chat", json={"prompt": "x"})
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert "llm_queue_wait_seconds" in r.text
+    assert 'llm_provider_requests_total{endpoint="chat",status="ok"}' in r.text
+
+
+def _events(text: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_stream_sends_deltas_then_full_answer(client, fake_provider):
+    r = client.post("/chat/stream", json={"prompt": "Кто такая Алиса?"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = _events(r.text)
+    deltas = [data["delta"] for event, data in events if event == "delta"]
+    assert len(deltas) > 1
+    assert events[-1] == ("done", {"answer": "".join(deltas)})
+    assert events[-1][1]["answer"].startswith("ANSWER: fake answer")
+
+
+def test_chat_stream_first_delta_before_full_generation():
+    """Первый кусок отдаётся раньше, чем модель закончит весь ответ."""
+    import time
+
+    from app.main import _chat_events
+
+    provider = FakeProvider(latency_sec=0.5, responder=lambda prompt, system: " ".join(["слово"] * 10))
+
+    async def scenario():
+        start = time.monotonic()
+        events = _chat_events(provider, [{"role": "user", "content": "x"}], release=lambda: None)
+        first = await events.__anext__()
+        first_at = time.monotonic() - start
+        rest = [event async for event in events]
+        return first, first_at, time.monotonic() - start, rest
+
+    first, first_at, total, rest = asyncio.run(scenario())
+    assert first.startswith("event: delta")
+    assert first_at < 0.2 and total >= 0.45
+    assert rest[-1].startswith("event: done")
+
+
+def test_chat_stream_provider_error_event():
+    class Failing(FakeProvider):
+        async def stream(self, prompt, system=None):
+            yield "ANSWER: начало"
+            raise RuntimeError("model crashed")
+
+    app = create_app(provider=Failing())
+    with TestClient(app) as client:
+        events = _events(client.post("/chat/stream", json={"prompt": "x"}).text)
+    assert events[0] == ("delta", {"delta": "ANSWER: начало"})
+    assert events[-1] == ("error", {"detail": "model crashed"})
+    # Слот лимитера освобождён
+    assert app.state.limiter._semaphore._value == settings.llm_max_concurrency
+
+
+def test_generate_batch_validates_each_item():
+    answer = json.dumps([
+        {"name": "Иван", "description": "кузнец", "extra": 1},
+        {"name": "", "description": "без имени"},
+        {"name": "Марья", "description": ["не строка"]},
+    ], ensure_ascii=False)
+    seen = []
+    provider = FakeProvider(responder=lambda prompt, system: seen.append(prompt) or answer)
+    with TestClient(create_app(provider=provider)) as client:
+        r = client.post("/generate", json={"entity_type": "character", "count": 4})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["items"] == [{"name": "Иван", "description": "кузнец"}]
+    assert data["payload"] == {"name": "Иван", "description": "кузнец"}
+    assert [e["index"] for e in data["errors"]] == [1, 2, 3]
+    assert provider.calls == 1
+    assert "JSON-массив из 4" in seen[0]
+
+
+def test_generate_explicit_count_one_is_validated_as_batch():
+    """Часть пакета из одной сущности (count=1) проверяется как элемент массива, а не отдаётся как есть."""
+    provider = FakeProvider(responder=lambda prompt, system: '{"name": "", "description": "без имени"}')
+    with TestClient(create_app(provider=provider)) as client:
+        batch = client.post("/generate", json={"entity_type": "character", "count": 1}).json()
+        single = client.post("/generate", json={"entity_type": "character"}).json()
+    assert batch["items"] == [] and [e["index"] for e in batch["errors"]] == [0]
+    assert single["payload"] == {"name": "", "description": "без имени"} and "items" not in single
+
+
+def test_generate_per_item_prompts():
+    seen = []
+    answer = '{"items": [{"title": "Встреча"}, {"name": "Погоня", "character_ids": ["c1"]}]}'
+    provider = FakeProvider(responder=lambda prompt, system: seen.append(prompt) or answer)
+    with TestClient(create_app(provider=provider)) as client:
+        r = client.post("/generate", json={"entity_type": "scene", "prompts": ["встреча", "погоня"]})
+    items = r.json()["items"]
+    assert [i["title"] for i in items] == ["Встреча", "Погоня"]
+    assert items[1] == {"title": "Погоня", "description": "", "location_id": "", "character_ids": ["c1"]}
+    assert "1. встреча\n2. погоня" in seen[0]
+
+
+def test_generate_count_limit():
+    with TestClient(create_app(provider=FakeProvider())) as client:
+        assert client.post("/generate", json={"entity_type": "concept", "count": 51}).status_code == 422
+
+
+def _echo_provider():
+    """Отвечает текстом, который получила модель (диалог одним текстом), — видно всю историю."""
+    return FakeProvider(responder=lambda prompt, system: f"[{system}] {prompt}")
+
+
+def test_chat_messages_with_roles():
+    with TestClient(create_app(provider=_echo_provider())) as client:
+        r = client.post("/chat", json={"messages": [
+            {"role": "system", "content": "S"},
+            {"role": "user", "content": "вопрос"},
+        ]})
+    assert r.json()["answer"] == "[S] вопрос"
+
+
+def test_chat_requires_prompt_or_messages(client):
+    assert client.post("/chat", json={"system": "S"}).status_code == 422
+    assert client.post("/chat", json={"prompt": "x", "messages": [{"role": "user", "content": "y"}]}).status_code == 422
+    assert client.post("/chat", json={"prompt": "x", "append": True}).status_code == 422
+
+
+def test_conversation_sends_only_new_turns():
+    with TestClient(create_app(provider=_echo_provider())) as client:
+        first = client.post("/chat", json={"conversation_id": "c1", "messages": [
+            {"role": "system", "content": "S"}, {"role": "user", "content": "вопрос"},
+        ]}).json()["answer"]
+        r = client.post("/chat", json={"conversation_id": "c1", "append": True, "messages": [
+            {"role": "user", "content": "результаты"},
+        ]})
+    assert r.json()["answer"] == f"[S] Пользователь: вопрос\n\nАссистент: {first}\n\nПользователь: результаты"
+
+
+def test_conversation_id_is_provider_session_with_stable_prefix():
+    class SessionProvider(FakeProvider):
+        def __init__(self):
+            super().__init__()
+            self.rounds = []
+
+        async def chat(self, messages, session_id=None):
+            self.rounds.append((session_id, messages))
+            return "ответ"
+
+    provider = SessionProvider()
+    with TestClient(create_app(provider=provider)) as client:
+        first = [{"role": "system", "content": "S"}, {"role": "user", "content": "вопрос"}]
+        client.post("/chat", json={"conversation_id": "c1", "messages": first})
+        client.post("/chat", json={"conversation_id": "c1", "append": True, "messages": [{"role": "user", "content": "ещё"}]})
+    (s1, m1), (s2, m2) = provider.rounds
+    assert s1 == s2 == "c1"
+    # Второй раунд начинается ровно с первого (с ответом): провайдер может не обрабатывать префикс заново
+    assert m2[:len(m1) + 1] == m1 + [{"role": "assistant", "content": "ответ"}]
+
+
+def test_unknown_conversation_409(client):
+    r = client.post("/chat", json={"conversation_id": "nope", "append": True, "prompt": "x"})
+    assert r.status_code == 409
+
+
+def test_stream_remembers_answer_in_conversation():
+    app = create_app(provider=_echo_provider())
+    with TestClient(app) as client:
+        client.post("/chat/stream", json={"conversation_id": "c1", "prompt": "вопрос"})
+        r = client.post("/chat/stream", json={"conversation_id": "c1", "append": True, "prompt": "ещё"})
+    answer = _events(r.text)[-1][1]["answer"]
+    assert answer.startswith("[None] Пользователь: вопрос\n\nАссистент: [None] вопрос")
+    assert len(app.state.conversations) == 1
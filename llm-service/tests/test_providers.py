@@ -0,0 +1,189 @@
+"""Tests for providers: постоянный клиент GigaChat с кэшем токена и фоновым обновлением."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import Settings
+from app.providers import FakeProvider, GigaChatProvider, LLMProvider, StubProvider, build_provider, flatten_messages, to_messages
+
+
+class FakeGigaChat:
+    """Локальный фейк клиента GigaChat: считает вызовы авторизации и чата."""
+
+    instances = 0
+
+    def __init__(self, token_ttl_sec: float = 1800) -> None:
+        type(self).instances += 1
+        self.token_ttl_sec = token_ttl_sec
+        self.token_requests = 0
+        self.chats = []
+        self.closed = False
+
+    async def aget_token(self):
+        self.token_requests += 1
+        return SimpleNamespace(access_token="t", expires_at=int((time.time() + self.token_ttl_sec) * 1000))
+
+    async def achat(self, payload):
+        self.chats.append(payload)
+        message = SimpleNamespace(content=f"echo: {payload}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    async def astream(self, payload):
+        self.chats.append(payload)
+        for part in ("ANSWER: ", "", "по ", "частям"):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def test_gigachat_provider_reuses_one_client():
+    clients = []
+    provider = GigaChatProvider(lambda: clients.append(FakeGigaChat()) or clients[-1])
+    await provider.start()
+    assert (await provider.complete("вопрос", system="система")).startswith("echo: ")
+    await provider.complete("ещё")
+    await asyncio.sleep(0)
+    await provider.close()
+    assert len(clients) == 1
+    # Системная инструкция — отдельным сообщением, а не приклеена к тексту вопроса
+    assert clients[0].chats == [
+        {"messages": [{"role": "system", "content": "система"}, {"role": "user", "content": "вопрос"}]},
+        {"messages": [{"role": "user", "content": "ещё"}]},
+    ]
+    assert clients[0].token_requests == 1  # токен получен один раз при старте
+    assert clients[0].closed
+
+
+async def test_gigachat_provider_refreshes_token_before_expiry():
+    client = FakeGigaChat(token_ttl_sec=0.3)
+    provider = GigaChatProvider(lambda: client, refresh_margin_sec=0.2, min_refresh_interval_sec=0.05)
+    await provider.start()
+    await asyncio.sleep(0.35)
+    await provider.close()
+    assert client.token_requests >= 3
+
+
+async def test_gigachat_provider_refresh_error_retries():
+    client = FakeGigaChat()
+    failures = [RuntimeError("auth down")]
+
+    async def flaky_token():
+        client.token_requests += 1
+        if failures:
+            raise failures.pop()
+        return SimpleNamespace(expires_at=int((time.time() + 1800) * 1000))
+
+    client.aget_token = flaky_token
+    provider = GigaChatProvider(lambda: client, min_refresh_interval_sec=0.01)
+    await provider.start()
+    await asyncio.sleep(0.05)
+    await provider.close()
+    assert client.token_requests == 2
+
+
+async def test_gigachat_provider_sends_session_id_per_call():
+    from gigachat.context import session_id_cvar
+
+    client = FakeGigaChat()
+    sessions = []
+    achat, astream = client.achat, client.astream
+
+    async def recording_achat(payload):
+        sessions.append(session_id_cvar.get())
+        return await achat(payload)
+
+    async def recording_astream(payload):
+        sessions.append(session_id_cvar.get())
+        async for chunk in astream(payload):
+            yield chunk
+
+    client.achat, client.astream = recording_achat, recording_astream
+    provider = GigaChatProvider(lambda: client)
+    await provider.start()
+    await provider.chat([{"role": "user", "content": "раунд 1"}], session_id="conv-1")
+    await provider.chat([{"role": "user", "content": "без диалога"}])
+    assert "".join([d async for d in provider.stream_chat([{"role": "user", "content": "x"}], session_id="conv-2")])
+    await provider.close()
+    assert sessions == ["conv-1", None, "conv-2"]
+    # Заголовок не «прилипает» к следующим запросам
+    assert session_id_cvar.get() is None
+
+
+class BufferedGigaChat(FakeGigaChat):
+    """
+    Как SDK gigachat: aget_token отдаёт кэшированный токен, пока до истечения больше token_expiry_buffer_ms
+    (по умолчанию — меньше запаса провайдера, как 60 с у SDK против 120 с).
+    """
+
+    def __init__(self, token_expiry_buffer_ms: int = 50, **kwargs) -> None:
+        super().__init__(token_ttl_sec=0.3)
+        self.kwargs = kwargs
+        self.buffer_ms = token_expiry_buffer_ms
+        self.token = None
+        self.issued = 0
+
+    async def aget_token(self):
+        self.token_requests += 1
+        if self.token is None or self.token.expires_at <= time.time() * 1000 + self.buffer_ms:
+            self.issued += 1
+            self.token = SimpleNamespace(access_token="t", expires_at=int((time.time() + self.token_ttl_sec) * 1000))
+        return self.token
+
+
+async def test_gigachat_refresh_margin_drives_sdk_token_buffer(monkeypatch):
+    import gigachat
+
+    clients = []
+    monkeypatch.setattr(gigachat, "GigaChat", lambda **kwargs: clients.append(BufferedGigaChat(**kwargs)) or clients[-1])
+    provider = build_provider(Settings(gigachat_credentials="key", gigachat_token_refresh_margin_sec=0.2))
+    provider._min_refresh_interval_sec = 0.01
+    await provider.start()
+    await asyncio.sleep(0.35)
+    await provider.close()
+    [client] = clients
+    assert client.buffer_ms == 200
+    # Каждый вызов цикла действительно обновляет токен — без опроса кэшированного
+    assert client.issued >= 3
+    assert client.token_requests == client.issued
+
+
+def test_build_provider():
+    assert isinstance(build_provider(Settings(gigachat_credentials=None)), StubProvider)
+    assert isinstance(build_provider(Settings(llm_provider="fake")), FakeProvider)
+    assert isinstance(build_provider(Settings(gigachat_credentials="key")), GigaChatProvider)
+
+
+def test_provider_without_chat_cannot_be_created():
+    class CompleteOnly(LLMProvider):
+        async def complete(self, prompt, system=None):
+            return ""
+
+    with pytest.raises(TypeError):
+        CompleteOnly()
+
+
+async def test_gigachat_provider_streams_deltas():
+    client = FakeGigaChat()
+    provider = GigaChatProvider(lambda: client)
+    await provider.start()
+    deltas = [delta async for delta in provider.stream("вопрос")]
+    await provider.close()
+    assert deltas == ["ANSWER: ", "по ", "частям"]  # пустые куски пропущены
+    assert client.chats == [{"messages": [{"role": "user", "content": "вопрос"}]}]
+
+
+def test_flatten_messages_for_providers_without_roles():
+    messages = [
+        {"role": "system", "content": "система"},
+        {"role": "user", "content": "вопрос"},
+        {"role": "assistant", "content": "SEARCH: x"},
+        {"role": "user", "content": "результаты"},
+    ]
+    assert flatten_messages(messages) == (
+        "Пользователь: вопрос\n\nАссистент: SEARCH: x\n\nПользователь: результаты",
+        "система",
+    )
+    assert flatten_messages(to_messages("вопрос")) == ("вопрос", None)
@@ -0,0 +1,161 @@
+"""Answer cache for POST /api/llm/answer: a repeated question is answered without queuing a task.
+
+Key: normalised question + role + graph version (shared/changes.py). The consumer bumps the version
+in every write transaction, so a write makes all earlier answers unreachable; TTL and LRU only bound
+memory. On a miss the task carries ``cache_key``; the consumer echoes it in the result and the
+llm.results handler stores the answer. Backends (``settings.llm_answer_cache_backend``):
+
+- ``memory`` (default): per-replica LRU + TTL; with the fanout results backend every replica
+  receives every answer, so all replicas fill their caches;
+- ``neo4j``: shared by all replicas and restarts — the consumer writes (:AnswerCache {key}) nodes
+  with ``expires_at``, the server reads them by key (unique constraint, schema migration 3).
+"""
+import hashlib
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from app.core.cache import GRAPH_VERSION_TAG, read_cache
+from app.core.config import settings
+from app.core.graph import run_read_query
+from app.metrics import llm_answer_cache_requests_total, neo4j_queries_total
+from shared.changes import GRAPH_VERSION_ID, READ_GRAPH_VERSION_QUERY
+
+logger = logging.getLogger(__name__)
+
+READ_CACHED_ANSWER_QUERY = (
+    "MATCH (c:AnswerCache {key: $key}) WHERE c.expires_at > timestamp() "
+    "RETURN c.answer AS answer, c.role AS role"
+)
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation do not change the question."""
+    return " ".join(question.lower().split()).rstrip("?!.… ")
+
+
+def answer_cache_key(question: str, role: str, graph_version: int) -> str:
+    digest = hashlib.sha256(f"{role}\n{normalize_question(question)}".encode()).hexdigest()[:32]
+    return f"{graph_version}:{digest}"
+
+
+async def current_graph_version() -> int:
+    """Graph version; cached in the read cache until the next graph.changes notification."""
+
+    async def load() -> int:
+        neo4j_queries_total.labels(operation="graph_version").inc()
+        records = await run_read_query(READ_GRAPH_VERSION_QUERY, {"id": GRAPH_VERSION_ID})
+        return (records[0]["version"] if records else None) or 0
+
+    return await read_cache.get_or_load("graph_version", "graph_version", {GRAPH_VERSION_TAG}, load)
+
+
+class AnswerCache(ABC):
+    """Cached answers {"answer", "role"} by cache key."""
+
+    # Passed to the consumer in the task: where it should store the answer itself (None — nowhere)
+    store: str | None = None
+
+    @abstractmethod
+    async def get(self, key: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def put(self, key: str, value: dict) -> None:
+        """Called from the llm.results consumer thread."""
+
+    def clear(self) -> None:
+        pass
+
+
+class InMemoryAnswerCache(AnswerCache):
+    """Process-local LRU + TTL. Thread-safe."""
+
+    def __init__(self, max_entries: int = 10000, ttl_sec: float = 3600) -> None:
+        self._max_entries = max_entries
+        self._ttl_sec = ttl_sec
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self._ttl_sec:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Neo4jAnswerCache(AnswerCache):
+    """Shared cache in Neo4j; entries are written by the consumer together with the result."""
+
+    store = "neo4j"
+
+    async def get(self, key: str) -> dict | None:
+        neo4j_queries_total.labels(operation="answer_cache").inc()
+        records = await run_read_query(READ_CACHED_ANSWER_QUERY, {"key": key})
+        return records[0] if records else None
+
+    def put(self, key: str, value: dict) -> None:
+        """
+        No-op: the consumer writes the (:AnswerCache) node in its own transaction when it publishes the
+        result (the task carries store="neo4j"), so the server never writes the shared cache.
+        """
+
+
+def build_answer_cache() -> AnswerCache | None:
+    if not settings.llm_answer_cache_enabled:
+        return None
+    if settings.llm_answer_cache_backend == "neo4j":
+        return Neo4jAnswerCache()
+    return InMemoryAnswerCache(
+        max_entries=settings.llm_answer_cache_max_entries,
+        ttl_sec=settings.llm_answer_cache_ttl_sec,
+    )
+
+
+answer_cache: AnswerCache | None = build_answer_cache()
+
+
+async def lookup_answer(question: str, role: str) -> tuple[str | None, dict | None]:
+    """
+    (cache_key, cached answer or None). cache_key is None when the cache is off or the graph
+    version is unavailable — the task is then queued without caching.
+    """
+    if answer_cache is None:
+        return None, None
+    try:
+        key = answer_cache_key(question, role, await current_graph_version())
+        cached = await answer_cache.get(key)
+    except Exception as e:
+        logger.warning("Answer cache lookup failed: %s", e)
+        return None, None
+    llm_answer_cache_requests_total.labels(result="hit" if cached else "miss").inc()
+    return key, cached
+
+
+def remember_answer(data: dict) -> None:
+    """llm.results message: store a finished knowledge answer under the key the task was queued with."""
+    key = data.get("cache_key")
+    if answer_cache is None or not key or data.get("status") != "done" or data.get("type") != "knowledge":
+        return
+    answer_cache.put(key, {"answer": data.get("answer", ""), "role": data.get("role")})
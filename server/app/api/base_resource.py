@@ -2,8 +2,12 @@
 import uuid
 from typing import Generic, TypeVar
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
 
+from app.api.pagination import LIST_RESPONSES, keyset_where, list_response, parse_fields
+from app.core.cache import list_tag, node_tag, read_cache
+from app.core.config import settings
 from app.core.graph import run_read_query
 from app.core.broker import publish_event
 from app.core.validation import normalize_name
@@ -27,6 +31,7 @@ class NameResourceRouter(Generic[CreateT, UpdateT, ReadT]):
     event_create: EventType = None
     event_update: EventType = None
     entity_name: str = ""  # for error messages: "Character", "Location", "Concept"
+    fields: tuple[str, ...] = ("id", "name", "description")
 
     def __init__(self) -> None:
         self.router = APIRouter(prefix=self.prefix, tags=[self.prefix.strip("/")])
@@ -54,7 +59,7 @@ class NameResourceRouter(Generic[CreateT, UpdateT, ReadT]):
             "",
             self.list_all,
             methods=["GET"],
-            response_model=list[read_schema],
+            responses=LIST_RESPONSES,
         )
         self.router.add_api_route(
             f"/{{{self.path_id_param}}}",
@@ -76,7 +81,7 @@ class NameResourceRouter(Generic[CreateT, UpdateT, ReadT]):
         if not name_norm:
             raise HTTPException(status_code=400, detail="Name cannot be empty after trimming")
         existing = await run_read_query(
-            f"MATCH (n:{self.label}) WHERE toLower(trim(n.name)) = $name_norm RETURN n.id AS id LIMIT 1",
+            f"MATCH (n:{self.label} {{name_norm: $name_norm}}) RETURN n.id AS id LIMIT 1",
             {"name_norm": name_norm},
         )
         if existing:
@@ -89,26 +94,58 @@ class NameResourceRouter(Generic[CreateT, UpdateT, ReadT]):
             "name": body.name.strip(),
             "description": body.description,
         }
-        publish_event(self.event_create, payload)
+        await publish_event(self.event_create, payload)
         events_published_total.labels(event_type=self.event_create.value).inc()
         return {"status": "accepted", "payload": payload}
 
-    async def list_all(self) -> list:
-        neo4j_queries_total.labels(operation=f"list_{self.prefix.strip('/')}").inc()
-        records = await run_read_query(
-            f"MATCH (n:{self.label}) RETURN n.id AS id, n.name AS name, n.description AS description"
-        )
-        return [
-            self.read_schema(id=r["id"], name=r["name"], description=r.get("description") or "")
-            for r in records
-        ]
+    async def list_all(
+        self,
+        after: str | None = Query(None, description="Cursor: id of the last item of the previous page"),
+        limit: int | None = Query(None, ge=1, le=settings.list_max_limit),
+        fields: str | None = Query(None, description="Comma-separated projection, e.g. id,name"),
+    ) -> Response:
+        """List ordered by id. Without limit the whole list is streamed; with limit see X-Next-Cursor."""
+        selected = parse_fields(fields, self.fields)
+        operation = f"list_{self.prefix.strip('/')}"
+        returns = ", ".join(f"n.{f} AS {f}" for f in dict.fromkeys(["id", *selected]))
+
+        async def load_page(cursor: str | None, size: int) -> list[dict]:
+            neo4j_queries_total.labels(operation=operation).inc()
+            return await run_read_query(
+                f"MATCH (n:{self.label}) WHERE {keyset_where('n', cursor)} "
+                f"RETURN {returns} ORDER BY n.id LIMIT $limit",
+                {"after": cursor, "limit": size},
+            )
+
+        async def fetch_page(cursor: str | None, size: int) -> list[dict]:
+            # Only single pages are cached; a streamed full list would evict everything else
+            if limit is None:
+                return await load_page(cursor, size)
+            return await read_cache.get_or_load(
+                operation,
+                ("list", self.label, cursor, size, returns),
+                {list_tag(self.label)},
+                lambda: load_page(cursor, size),
+            )
+
+        def serialize(r: dict) -> dict:
+            return {f: (r.get(f) or "") if f == "description" else r.get(f) for f in selected}
+
+        return await list_response(fetch_page, serialize, after, limit)
 
     async def get_one(self, request: Request):
         resource_id = request.path_params[self.path_id_param]
-        neo4j_queries_total.labels(operation=f"get_{self.prefix.strip('/')}").inc()
-        records = await run_read_query(
-            f"MATCH (n:{self.label} {{id: $id}}) RETURN n.id AS id, n.name AS name, n.description AS description",
-            {"id": resource_id},
+        operation = f"get_{self.prefix.strip('/')}"
+
+        async def load() -> list[dict]:
+            neo4j_queries_total.labels(operation=operation).inc()
+            return await run_read_query(
+                f"MATCH (n:{self.label} {{id: $id}}) RETURN n.id AS id, n.name AS name, n.description AS description",
+                {"id": resource_id},
+            )
+
+        records = await read_cache.get_or_load(
+            operation, ("get", self.label, resource_id), {node_tag(self.label, resource_id)}, load
         )
         if not records:
             raise HTTPException(status_code=404, detail=f"{self.entity_name} not found")
@@ -123,7 +160,7 @@ class NameResourceRouter(Generic[CreateT, UpdateT, ReadT]):
             if not name_norm:
                 raise HTTPException(status_code=400, detail="Name cannot be empty after trimming")
             existing = await run_read_query(
-                f"MATCH (n:{self.label}) WHERE toLower(trim(n.name)) = $name_norm AND n.id <> $id RETURN n.id AS id LIMIT 1",
+                f"MATCH (n:{self.label} {{name_norm: $name_norm}}) WHERE n.id <> $id RETURN n.id AS id LIMIT 1",
                 {"name_norm": name_norm, "id": resource_id},
             )
             if existing:
@@ -139,6 +176,6 @@ class NameResourceRouter(Generic[CreateT, UpdateT, ReadT]):
                 status_code=400,
                 detail="At least one of name or description must be provided",
             )
-        publish_event(self.event_update, payload)
+        await publish_event(self.event_update, payload)
         events_published_total.labels(event_type=self.event_update.value).inc()
         return {"status": "accepted", "payload": payload}
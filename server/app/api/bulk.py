@@ -0,0 +1,152 @@
+"""Bulk import API: many locations, characters, concepts and scenes in one request.
+
+Body is a JSON array or NDJSON (Content-Type: application/x-ndjson), one entity per item:
+    {"type": "location", "ref": "tavern", "name": "Таверна", "description": "..."}
+    {"type": "character", "ref": "alice", "name": "Алиса"}
+    {"type": "scene", "title": "Встреча", "location_id": "tavern", "character_ids": ["alice", "<existing id>"]}
+
+``ref`` is an optional client-side handle; scene location_id / character_ids may name a ref of an
+item earlier in the same request (replaced by its generated id) or an id already in the graph.
+"""
+import asyncio
+import json
+import uuid
+from collections import Counter
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import ValidationError
+
+from app.core.broker import publish_event
+from app.core.config import settings
+from app.core.graph import run_read_query
+from app.core.validation import normalize_name
+from app.metrics import events_published_total, neo4j_queries_total
+from app.models.schemas import BulkAccepted, CharacterCreate, ConceptCreate, LocationCreate, SceneCreate
+from shared.events import EventType, build_event
+
+router = APIRouter(prefix="/bulk", tags=["bulk"])
+
+# item type -> (create schema, event, graph label, unique field)
+ENTITY_TYPES = {
+    "location": (LocationCreate, EventType.LOCATION_CREATE, "Location", "name"),
+    "character": (CharacterCreate, EventType.CHARACTER_CREATE, "Character", "name"),
+    "concept": (ConceptCreate, EventType.CONCEPT_CREATE, "Concept", "name"),
+    "scene": (SceneCreate, EventType.SCENE_CREATE, "Scene", "title"),
+}
+_MAX_REPORTED_ERRORS = 100
+
+
+def parse_items(body: bytes, content_type: str) -> list:
+    """JSON array, or one JSON object per line for NDJSON. Raises ValueError."""
+    text = body.decode("utf-8")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("Body must be a JSON array")
+    return items
+
+
+def existing_keys_query(labels: list[str]) -> str:
+    """One round trip for the whole batch: a name_norm / title_norm index lookup per label."""
+    parts = []
+    for label in labels:
+        prop = "title_norm" if label == "Scene" else "name_norm"
+        parts.append(
+            f"UNWIND ${label} AS key MATCH (n:{label} {{{prop}: key}}) RETURN '{label}' AS label, key"
+        )
+    return "\nUNION ALL\n".join(parts)
+
+
+def _error(errors: list[dict], index: int, message: str) -> None:
+    if len(errors) < _MAX_REPORTED_ERRORS:
+        errors.append({"index": index, "error": message})
+
+
+@router.post("", status_code=202, response_model=BulkAccepted)
+async def bulk_import(request: Request) -> BulkAccepted:
+    """Validate the whole batch, check uniqueness with one query, publish batched create events."""
+    try:
+        items = parse_items(await request.body(), request.headers.get("content-type", ""))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid body: {e}")
+    if not items:
+        raise HTTPException(status_code=400, detail="No items")
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"Too many items (max {settings.bulk_max_items})")
+
+    errors: list[dict] = []
+    refs: dict[str, tuple[str, str]] = {}  # ref -> (item type, id)
+    keys: dict[str, dict[str, int]] = {}  # label -> normalized name/title -> item index
+    duplicates: list[dict] = []
+    events: list[dict] = []
+    ids: list[str] = []
+
+    def resolve(value: str, expected_type: str, index: int) -> str:
+        if value in refs:
+            ref_type, ref_id = refs[value]
+            if ref_type != expected_type:
+                _error(errors, index, f"ref '{value}' is a {ref_type}, expected {expected_type}")
+            return ref_id
+        return value
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or item.get("type") not in ENTITY_TYPES:
+            _error(errors, index, f"type must be one of: {', '.join(ENTITY_TYPES)}")
+            continue
+        item_type = item["type"]
+        schema, event_type, label, field = ENTITY_TYPES[item_type]
+        try:
+            body = schema.model_validate(item)
+        except ValidationError as e:
+            _error(errors, index, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        key = normalize_name(getattr(body, field))
+        if not key:
+            _error(errors, index, f"{field} cannot be empty after trimming")
+            continue
+        if key in keys.setdefault(label, {}):
+            duplicates.append({"index": index, "type": item_type, field: getattr(body, field).strip()})
+            continue
+        keys[label][key] = index
+
+        uid = str(uuid.uuid4())
+        ref = item.get("ref")
+        if ref is not None:
+            if not isinstance(ref, str) or ref in refs:
+                _error(errors, index, f"ref must be a unique string: {ref!r}")
+                continue
+            refs[ref] = (item_type, uid)
+        payload = {"id": uid, field: getattr(body, field).strip(), "description": body.description}
+        if item_type == "scene":
+            payload["location_id"] = resolve(body.location_id, "location", index)
+            payload["character_ids"] = [resolve(c, "character", index) for c in body.character_ids]
+        events.append(build_event(event_type, payload))
+        ids.append(uid)
+
+    if errors:
+        raise HTTPException(status_code=400, detail={"errors": errors})
+
+    neo4j_queries_total.labels(operation="bulk_check_unique").inc()
+    existing = await run_read_query(existing_keys_query(list(keys)), {label: list(k) for label, k in keys.items()})
+    for r in existing:
+        index = keys[r["label"]][r["key"]]
+        item_type = items[index]["type"]
+        field = ENTITY_TYPES[item_type][3]
+        duplicates.append({"index": index, "type": item_type, field: items[index][field].strip()})
+    if duplicates:
+        duplicates.sort(key=lambda d: d["index"])
+        raise HTTPException(
+            status_code=409,
+            detail={"duplicates": duplicates[:_MAX_REPORTED_ERRORS], "count": len(duplicates)},
+        )
+
+    # Chunks go to the publisher queue in order; confirms are awaited together
+    chunk = settings.bulk_event_chunk_size
+    await asyncio.gather(*(
+        publish_event(EventType.BATCH, {"events": events[i:i + chunk]})
+        for i in range(0, len(events), chunk)
+    ))
+    for event_type, count in Counter(e["type"] for e in events).items():
+        events_published_total.labels(event_type=event_type).inc(count)
+    return BulkAccepted(count=len(ids), ids=ids, refs={ref: uid for ref, (_, uid) in refs.items()})
@@ -0,0 +1,23 @@
+"""Export API: whole graph as a streamed NDJSON dump."""
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from app.metrics import neo4j_queries_total
+from app.services.export import export_ndjson
+
+router = APIRouter(prefix="/export", tags=["export"])
+
+
+@router.get("")
+async def export_graph(
+    format: str = Query("ndjson", pattern="^ndjson$", description="Only ndjson is supported"),
+    gzip: bool = Query(False, description="gzip-compress the dump"),
+) -> StreamingResponse:
+    """Stream every node and relationship, one JSON object per line."""
+    neo4j_queries_total.labels(operation="export").inc()
+    filename = "winm-export.ndjson.gz" if gzip else "winm-export.ndjson"
+    return StreamingResponse(
+        export_ndjson(compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
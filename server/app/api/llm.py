@@ -1,10 +1,15 @@
-"""LLM API: запросы в очередь llm.tasks, результат по GET /api/llm/result/:request_id."""
+"""LLM API: запросы в очередь llm.tasks, результат по GET /api/llm/result/:request_id (long-poll или SSE)."""
+import asyncio
 import uuid
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Query, Response
+from fastapi.responses import StreamingResponse
 
+from app.answer_cache import answer_cache, lookup_answer, normalize_question
 from app.core.broker import publish_llm_task
-from app.llm_results import get_result, start_llm_results_consumer
+from app.core.config import settings
+from app.llm_results import get_result, get_store, in_flight, is_final, set_result, wait_for_result
+from app.metrics import llm_task_requests_total
 from app.models.schemas import (
     LLMAnswerRequest,
     LLMGenerateRequest,
@@ -18,28 +23,52 @@ from app.models.schemas import (
 router = APIRouter(prefix="/llm", tags=["llm"])
 
 
-@router.post("/answer", status_code=202, response_model=LLMTaskAccepted)
-def answer_task(body: LLMAnswerRequest) -> LLMTaskAccepted:
+@router.post("/answer", status_code=202, response_model=LLMTaskAccepted | LLMResultAnswer)
+async def answer_task(body: LLMAnswerRequest, response: Response):
     """
     Вопрос по базе знаний. Запрос ставится в очередь; ответ не моментальный.
     Получить результат: GET /api/llm/result/{request_id}.
+    Если тот же вопрос с той же ролью уже задавали при текущей версии графа — 200 с готовым
+    ответом (cached=true), задача в очередь не ставится.
     """
     request_id = str(uuid.uuid4())
+    role = body.role or "narrator"
+    cache_key, cached = await lookup_answer(body.question, role)
+    if cached is not None:
+        data = {
+            "request_id": request_id,
+            "status": "done",
+            "type": "knowledge",
+            "answer": cached["answer"],
+            "role": cached.get("role") or role,
+            "cached": True,
+        }
+        set_result(request_id, data)
+        response.status_code = 200
+        return _to_response(request_id, data)
     payload = {
         "request_id": request_id,
         "type": "knowledge",
         "question": body.question,
-        "role": body.role or "narrator",
+        "role": role,
     }
-    publish_llm_task(payload)
+    if cache_key:
+        payload["cache_key"] = cache_key
+        if answer_cache.store:
+            payload["cache_store"] = answer_cache.store
+            payload["cache_ttl_sec"] = settings.llm_answer_cache_ttl_sec
+    # cache_key includes the graph version: a question asked after a write does not join an older task
+    await _submit_task(payload, ("knowledge", cache_key or (role, normalize_question(body.question))))
     return LLMTaskAccepted(request_id=request_id)
 
 
 @router.post("/generate", status_code=202, response_model=LLMTaskAccepted)
-def generate_task(body: LLMGenerateRequest) -> LLMTaskAccepted:
+async def generate_task(body: LLMGenerateRequest) -> LLMTaskAccepted:
     """
     Генерация локации/персонажа/понятия/сцены. Не сохраняется в БД.
     Ответ — payload для POST создания. Результат: GET /api/llm/result/{request_id}.
+    count или prompts — несколько сущностей одной задачей: результат в items (по мере готовности — в
+    partial_items ожидающего результата и событиях partial SSE), не прошедшие проверку — в errors.
     """
     request_id = str(uuid.uuid4())
     payload = {
@@ -48,23 +77,45 @@ def generate_task(body: LLMGenerateRequest) -> LLMTaskAccepted:
         "entity_type": body.entity_type,
         "prompt": body.prompt,
     }
-    publish_llm_task(payload)
+    if body.prompts:
+        payload["prompts"] = body.prompts
+    elif body.count > 1:
+        payload["count"] = body.count
+    key = (
+        "generate",
+        body.entity_type,
+        normalize_question(body.prompt),
+        tuple(normalize_question(p) for p in body.prompts) if body.prompts else body.count,
+    )
+    await _submit_task(payload, key)
     return LLMTaskAccepted(request_id=request_id)
 
 
-@router.get(
-    "/result/{request_id}",
-    response_model=LLMResultPending | LLMResultAnswer | LLMResultGenerate | LLMResultError,
-    status_code=200,
-)
-def get_llm_result(request_id: str):
+async def _submit_task(payload: dict, key) -> None:
     """
-    Результат задачи LLM по request_id из POST /answer или POST /generate.
-    200 — результат готов (answer или generate payload), 200 с status=pending — ещё в обработке.
+    Publish the task, unless an identical one (same key) is already in flight on this replica:
+    then request_id is attached to it and gets the same result (see llm_results.InFlightTasks).
     """
-    data = get_result(request_id)
+    request_id, task_type = payload["request_id"], payload["type"]
+    if settings.llm_coalesce_enabled and in_flight.join(key, request_id) is not None:
+        llm_task_requests_total.labels(type=task_type, result="coalesced").inc()
+        return
+    try:
+        await publish_llm_task(payload)
+    except Exception as e:
+        for follower_id in in_flight.finish(request_id):
+            set_result(follower_id, {"request_id": follower_id, "status": "error", "error": f"Task not queued: {e}"})
+        raise
+    llm_task_requests_total.labels(type=task_type, result="queued").inc()
+
+
+def _to_response(request_id: str, data: dict | None):
     if data is None:
         return LLMResultPending(request_id=request_id)
+    if data.get("status") == "partial":
+        if data.get("type") == "generate":
+            return LLMResultPending(request_id=request_id, partial_items=data.get("items", []))
+        return LLMResultPending(request_id=request_id, partial_answer=data.get("answer", ""))
 
     if data.get("status") == "error" or data.get("error"):
         return LLMResultError(
@@ -76,11 +127,79 @@ def get_llm_result(request_id: str):
             request_id=request_id,
             answer=data.get("answer", ""),
             role=data.get("role"),
+            cached=data.get("cached", False),
         )
     if data.get("type") == "generate":
         return LLMResultGenerate(
             request_id=request_id,
             entity_type=data["entity_type"],
             payload=data.get("payload", {}),
+            items=data.get("items"),
+            errors=data.get("errors"),
         )
     return LLMResultError(request_id=request_id, error="Unknown result type")
+
+
+@router.get(
+    "/result/{request_id}",
+    response_model=LLMResultPending | LLMResultAnswer | LLMResultGenerate | LLMResultError,
+    status_code=200,
+)
+async def get_llm_result(
+    request_id: str,
+    wait: float = Query(0, ge=0, description="Long-poll: ждать готовый результат до wait секунд"),
+):
+    """
+    Результат задачи LLM по request_id из POST /answer или POST /generate.
+    200 — результат готов (answer или generate payload), 200 с status=pending — ещё в обработке.
+    С ?wait=N запрос паркуется, пока результат не придёт (не дольше N секунд и llm_result_max_wait_sec).
+    """
+    if wait > 0:
+        data = await wait_for_result(request_id, min(wait, settings.llm_result_max_wait_sec))
+    else:
+        data = get_result(request_id)
+    return _to_response(request_id, data)
+
+
+@router.get("/result/{request_id}/stream")
+async def stream_llm_result(request_id: str) -> StreamingResponse:
+    """
+    Server-Sent Events: событие на каждое изменение результата, затем поток закрывается:
+    `partial` (status=pending, partial_answer — ответ на данный момент) по мере генерации, в конце done/error.
+    Пока результата нет, раз в llm_result_stream_keepalive_sec отправляется комментарий keep-alive.
+    """
+    return StreamingResponse(
+        _result_events(request_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _result_events(request_id: str):
+    store = get_store()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.llm_result_stream_timeout_sec
+    last = None
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            yield _sse("timeout", LLMResultPending(request_id=request_id).model_dump_json())
+            return
+        data = await store.wait_for(
+            request_id,
+            lambda d: d is not None and d is not last,
+            min(settings.llm_result_stream_keepalive_sec, remaining),
+        )
+        if data is None or data is last:
+            yield ": keep-alive\n\n"
+            continue
+        last = data
+        response = _to_response(request_id, data)
+        event = "partial" if data.get("status") == "partial" else response.status
+        yield _sse(event, response.model_dump_json())
+        if is_final(data):
+            return
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
@@ -0,0 +1,74 @@
+"""Keyset pagination (?after=<id>&limit=), field projection (?fields=) and streamed JSON arrays for list endpoints."""
+import json
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from app.core.config import settings
+
+# fetch_page(after, size) -> records ordered by id, all with id > after
+FetchPage = Callable[[str | None, int], Awaitable[list[dict[str, Any]]]]
+Serialize = Callable[[dict[str, Any]], dict[str, Any]]
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def parse_fields(fields: str | None, allowed: tuple[str, ...]) -> list[str]:
+    """Comma-separated projection; all fields if not given. 400 on unknown field."""
+    if not fields:
+        return list(allowed)
+    requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in allowed]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}",
+        )
+    return requested
+
+
+def keyset_where(var: str, after: str | None) -> str:
+    """WHERE clause that lets Neo4j walk the id index in order."""
+    return f"{var}.id > $after" if after is not None else f"{var}.id IS NOT NULL"
+
+
+LIST_RESPONSES = {200: {"description": "JSON array of records with the fields selected by ?fields= (all by default)"}}
+
+
+async def list_response(
+    fetch_page: FetchPage, serialize: Serialize, after: str | None, limit: int | None
+) -> Response:
+    """
+    With limit: one page as a JSON array, X-Next-Cursor header if more may follow.
+    Without limit: every record, fetched page by page and streamed as one JSON array,
+    so memory stays bounded by the page size. The first page is fetched before the response
+    starts, so an early failure (Neo4j down) is still an error status, not a truncated 200.
+    """
+    if limit is not None:
+        records = await fetch_page(after, limit)
+        headers = {NEXT_CURSOR_HEADER: records[-1]["id"]} if len(records) == limit else None
+        return JSONResponse([serialize(r) for r in records], headers=headers)
+    page_size = settings.list_page_size
+    records = await fetch_page(after, page_size)
+    return StreamingResponse(_stream_all(fetch_page, serialize, records, page_size), media_type="application/json")
+
+
+async def _stream_all(
+    fetch_page: FetchPage, serialize: Serialize, records: list[dict[str, Any]], page_size: int
+) -> AsyncIterator[str]:
+    """records — the first page, already fetched; the following pages are fetched as the array is sent."""
+    first = True
+    yield "["
+    while True:
+        chunk = []
+        for r in records:
+            chunk.append(("" if first else ",") + json.dumps(serialize(r), ensure_ascii=False))
+            first = False
+        if chunk:
+            yield "".join(chunk)
+        if len(records) < page_size:
+            break
+        records = await fetch_page(records[-1]["id"], page_size)
+    yield "]"
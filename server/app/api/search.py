@@ -1,36 +1,56 @@
-"""Search API (query graph)."""
-from fastapi import APIRouter, Query
+"""Search API (query graph): full-text index with regex scan as fallback."""
+import logging
 
+from fastapi import APIRouter, HTTPException, Query
+from neo4j.exceptions import Neo4jError
+
+from app.core.cache import SEARCH_TAG, read_cache
+from app.core.config import settings
 from app.core.graph import run_read_query
-from app.core.validation import normalize_name
 from app.metrics import neo4j_queries_total
 from app.models.schemas import SearchResult
+from shared.search import FULLTEXT_SEARCH_QUERY, REGEX_SEARCH_QUERY, normalize_types, search_params
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/search", tags=["search"])
 
 
 @router.get("", response_model=list[SearchResult])
-async def search(q: str = Query(..., min_length=1)) -> list[SearchResult]:
-    """Search locations, characters, scenes, concepts by name/description/title."""
-    neo4j_queries_total.labels(operation="search").inc()
-    # Normalize query so search is case-insensitive for any script (Cyrillic, etc.)
-    q_norm = normalize_name(q)
-    pattern = f".*{q_norm.replace(' ', '.*')}.*"
-    params = {"pattern": pattern}
-    records = await run_read_query("""
-        MATCH (n)
-        WHERE (n:Location OR n:Character OR n:Scene OR n:Concept)
-        AND (
-            (n.name IS NOT NULL AND toLower(trim(n.name)) =~ $pattern)
-            OR (n.title IS NOT NULL AND toLower(trim(n.title)) =~ $pattern)
-            OR (n.description IS NOT NULL AND toLower(trim(n.description)) =~ $pattern)
-        )
-        RETURN labels(n)[0] AS type, n.id AS id,
-               COALESCE(n.name, n.title, '') AS name,
-               COALESCE(n.description, n.title, '') AS snippet
-        LIMIT 50
-    """, params)
+async def search(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    type: list[str] | None = Query(None, description="Filter by type: location, character, scene, concept"),
+) -> list[SearchResult]:
+    """Search locations, characters, scenes, concepts by name/description/title, best matches first."""
+    try:
+        types = normalize_types(type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    params = search_params(q, types, limit, offset)
+    key = ("search", q.strip().lower(), tuple(types or ()), limit, offset)
+    records = await read_cache.get_or_load("search", key, {SEARCH_TAG}, lambda: _run_search(params))
     return [
-        SearchResult(type=r["type"], id=r["id"], name=r["name"], snippet=r.get("snippet") or "")
+        SearchResult(
+            type=r["type"],
+            id=r["id"],
+            name=r["name"],
+            snippet=r.get("snippet") or "",
+            score=r.get("score"),
+        )
         for r in records
     ]
+
+
+async def _run_search(params: dict) -> list[dict]:
+    if settings.search_fulltext_enabled and params["query"]:
+        neo4j_queries_total.labels(operation="search").inc()
+        try:
+            records = await run_read_query(FULLTEXT_SEARCH_QUERY, params)
+            if records:
+                return records
+        except Neo4jError as e:
+            logger.warning("Full-text search failed, falling back to regex scan: %s", e)
+    neo4j_queries_total.labels(operation="search_regex").inc()
+    return await run_read_query(REGEX_SEARCH_QUERY, params)
@@ -1,17 +1,23 @@
 """Story (scenes) API."""
 import uuid
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
 
+from app.api.pagination import LIST_RESPONSES, keyset_where, list_response, parse_fields
+from app.core.cache import list_tag, node_tag, read_cache
+from app.core.config import settings
 from app.core.graph import run_read_query
 from app.core.broker import publish_event
 from app.core.validation import normalize_name
-from app.metrics import events_published_total
+from app.metrics import events_published_total, neo4j_queries_total
 from app.models.schemas import SceneCreate, SceneUpdate, SceneRead
 from shared.events import EventType
 
 router = APIRouter(prefix="/story", tags=["story"])
 
+SCENE_FIELDS = ("id", "title", "description", "location_id", "character_ids")
+
 
 @router.post("/scenes", status_code=202)
 async def create_scene(body: SceneCreate) -> dict:
@@ -20,7 +26,7 @@ async def create_scene(body: SceneCreate) -> dict:
     if not title_norm:
         raise HTTPException(status_code=400, detail="Title cannot be empty after trimming")
     existing = await run_read_query(
-        "MATCH (s:Scene) WHERE toLower(trim(s.title)) = $title_norm RETURN s.id AS id LIMIT 1",
+        "MATCH (s:Scene {title_norm: $title_norm}) RETURN s.id AS id LIMIT 1",
         {"title_norm": title_norm},
     )
     if existing:
@@ -32,43 +38,69 @@ async def create_scene(body: SceneCreate) -> dict:
         "location_id": body.location_id,
         "character_ids": body.character_ids,
     }
-    publish_event(EventType.SCENE_CREATE, payload)
+    await publish_event(EventType.SCENE_CREATE, payload)
     events_published_total.labels(event_type=EventType.SCENE_CREATE.value).inc()
     return {"status": "accepted", "payload": payload}
 
 
-@router.get("/scenes", response_model=list[SceneRead])
-async def list_scenes() -> list[SceneRead]:
-    """List all scenes from graph."""
-    records = await run_read_query("""
-        MATCH (s:Scene)-[:TAKES_PLACE_IN]->(l:Location)
-        OPTIONAL MATCH (s)-[:FEATURES]->(c:Character)
-        WITH s, l, collect(c.id) AS char_ids
-        RETURN s.id AS id, s.title AS title, s.description AS description,
-               l.id AS location_id, char_ids AS character_ids
-    """)
-    return [
-        SceneRead(
-            id=r["id"],
-            title=r["title"],
-            description=r.get("description") or "",
-            location_id=r["location_id"],
-            character_ids=[x for x in (r.get("character_ids") or []) if x],
+@router.get("/scenes", responses=LIST_RESPONSES)
+async def list_scenes(
+    after: str | None = Query(None, description="Cursor: id of the last scene of the previous page"),
+    limit: int | None = Query(None, ge=1, le=settings.list_max_limit),
+    fields: str | None = Query(None, description="Comma-separated projection, e.g. id,title"),
+) -> Response:
+    """List scenes ordered by id. Without limit the whole list is streamed; with limit see X-Next-Cursor."""
+    selected = parse_fields(fields, SCENE_FIELDS)
+
+    async def load_page(cursor: str | None, size: int) -> list[dict]:
+        neo4j_queries_total.labels(operation="list_scenes").inc()
+        return await run_read_query(f"""
+            MATCH (s:Scene)
+            WHERE {keyset_where('s', cursor)} AND EXISTS {{ (s)-[:TAKES_PLACE_IN]->(:Location) }}
+            WITH s ORDER BY s.id LIMIT $limit
+            MATCH (s)-[:TAKES_PLACE_IN]->(l:Location)
+            OPTIONAL MATCH (s)-[:FEATURES]->(c:Character)
+            WITH s, l, collect(c.id) AS char_ids
+            RETURN s.id AS id, s.title AS title, s.description AS description,
+                   l.id AS location_id, char_ids AS character_ids
+            ORDER BY s.id
+        """, {"after": cursor, "limit": size})
+
+    async def fetch_page(cursor: str | None, size: int) -> list[dict]:
+        if limit is None:
+            return await load_page(cursor, size)
+        return await read_cache.get_or_load(
+            "list_scenes", ("list", "Scene", cursor, size), {list_tag("Scene")}, lambda: load_page(cursor, size)
         )
-        for r in records
-    ]
+
+    def serialize(r: dict) -> dict:
+        scene = {
+            "id": r["id"],
+            "title": r["title"],
+            "description": r.get("description") or "",
+            "location_id": r["location_id"],
+            "character_ids": [x for x in (r.get("character_ids") or []) if x],
+        }
+        return {f: scene[f] for f in selected}
+
+    return await list_response(fetch_page, serialize, after, limit)
 
 
 @router.get("/scenes/{scene_id}", response_model=SceneRead)
 async def get_scene(scene_id: str) -> SceneRead:
     """Get scene by id."""
-    records = await run_read_query("""
-        MATCH (s:Scene {id: $id})-[:TAKES_PLACE_IN]->(l:Location)
-        OPTIONAL MATCH (s)-[:FEATURES]->(c:Character)
-        WITH s, l, collect(c.id) AS char_ids
-        RETURN s.id AS id, s.title AS title, s.description AS description,
-               l.id AS location_id, char_ids AS character_ids
-    """, {"id": scene_id})
+
+    async def load() -> list[dict]:
+        neo4j_queries_total.labels(operation="get_scene").inc()
+        return await run_read_query("""
+            MATCH (s:Scene {id: $id})-[:TAKES_PLACE_IN]->(l:Location)
+            OPTIONAL MATCH (s)-[:FEATURES]->(c:Character)
+            WITH s, l, collect(c.id) AS char_ids
+            RETURN s.id AS id, s.title AS title, s.description AS description,
+                   l.id AS location_id, char_ids AS character_ids
+        """, {"id": scene_id})
+
+    records = await read_cache.get_or_load("get_scene", ("get", "Scene", scene_id), {node_tag("Scene", scene_id)}, load)
     if not records:
         raise HTTPException(status_code=404, detail="Scene not found")
     r = records[0]
@@ -93,6 +125,6 @@ async def update_scene(scene_id: str, body: SceneUpdate) -> dict:
         payload["location_id"] = body.location_id
     if body.character_ids is not None:
         payload["character_ids"] = body.character_ids
-    publish_event(EventType.SCENE_UPDATE, payload)
+    await publish_event(EventType.SCENE_UPDATE, payload)
     events_published_total.labels(event_type=EventType.SCENE_UPDATE.value).inc()
     return {"status": "accepted", "payload": payload}
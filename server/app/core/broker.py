@@ -1,43 +1,222 @@
-"""RabbitMQ publisher (server)."""
+"""RabbitMQ publisher (server).
+
+One long-lived connection is owned by a background thread. API handlers enqueue
+messages and await a future, so the event loop never blocks on AMQP I/O and the
+TCP/AMQP handshake is paid once per process instead of once per request.
+
+Messages waiting in the queue are published together in one AMQP transaction
+(tx.select channel): every message of the batch is published without waiting,
+then a single tx.commit is the broker's acknowledgement for all of them. With
+pika's blocking client publisher confirms would cost one round trip per message.
+"""
+import asyncio
 import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
 import pika
-from pika.adapters.blocking_connection import BlockingChannel
+from pika.exceptions import AMQPError
 
 from app.core.config import settings
 from shared.events import EventType, build_event
 
+logger = logging.getLogger(__name__)
+
 QUEUE_GRAPH_TASKS = "graph.tasks"
 QUEUE_LLM_TASKS = "llm.tasks"
 
+_STOP = object()
+
+
+class Publisher:
+    """Persistent publisher: one connection and transactional channel in a dedicated thread.
+
+    Messages are drained from an in-process queue in batches of up to ``batch_size`` and
+    committed with one tx.commit per batch; queues are declared once per connection; a broken
+    connection is dropped and re-established once before the batch is reported as failed.
+    After stop() new submits fail immediately instead of waiting for a thread that is gone.
+    """
+
+    def __init__(self, url: str, batch_size: int = 100, reconnect_delay: float = 1.0) -> None:
+        self._params = pika.URLParameters(url)
+        self._batch_size = max(1, batch_size)
+        self._reconnect_delay = reconnect_delay
+        self._queue: queue.Queue = queue.Queue()
+        self._connection = None
+        self._channel = None
+        self._declared: set[str] = set()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def start(self) -> None:
+        """Start the publisher thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="amqp-publisher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Publish what is already queued, then close the connection. Later submits fail."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is None:
+            return
+        thread.join(timeout)
+        if not thread.is_alive():
+            self._fail_queued()
+
+    def submit(self, routing_key: str, body: str) -> Future:
+        """Enqueue a persistent message for the default exchange. Resolved once the broker commits it."""
+        future: Future = Future()
+        with self._lock:
+            if self._stopping:
+                future.set_exception(RuntimeError("Publisher is stopped"))
+                return future
+            self._queue.put((routing_key, body, future))
+        return future
+
+    def _fail_queued(self) -> None:
+        """Resolve anything left behind the stop sentinel so no awaiter hangs."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[2].set_running_or_notify_cancel():
+                item[2].set_exception(RuntimeError("Publisher is stopped"))
+
+    def _run(self) -> None:
+        idle_timeout = max(1.0, (self._params.heartbeat or 60) / 2)
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=idle_timeout)
+            except queue.Empty:
+                self._keepalive()
+                continue
+            if item is _STOP:
+                break
+            batch = [item]
+            while len(batch) < self._batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._publish_batch(batch)
+        self._close()
+
+    def _publish_batch(self, batch: list[tuple[str, str, Future]]) -> None:
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            self._publish(batch)
+        except Exception as e:
+            logger.exception("Failed to publish %d messages: %s", len(batch), e)
+            for _, _, future in batch:
+                future.set_exception(e)
+        else:
+            for _, _, future in batch:
+                future.set_result(None)
+
+    def _publish(self, batch: list[tuple[str, str, Future]]) -> None:
+        """Publish the batch and commit it once; on a broken connection retry the whole batch once."""
+        for attempt in range(2):
+            try:
+                channel = self._ensure_channel()
+                for routing_key, body, _ in batch:
+                    if routing_key not in self._declared:
+                        channel.queue_declare(queue=routing_key, durable=True)
+                        self._declared.add(routing_key)
+                    channel.basic_publish(
+                        exchange="",
+                        routing_key=routing_key,
+                        body=body,
+                        properties=pika.BasicProperties(delivery_mode=2),
+                    )
+                channel.tx_commit()
+                return
+            except AMQPError:
+                self._close()
+                if attempt:
+                    raise
+                logger.warning("Broker connection lost, reconnecting")
+                time.sleep(self._reconnect_delay)
 
-def publish_event(event_type: EventType, payload: dict) -> None:
+    def _ensure_channel(self):
+        if self._channel is None or not self._channel.is_open:
+            if self._connection is None or not self._connection.is_open:
+                self._connection = pika.BlockingConnection(self._params)
+                self._declared.clear()
+            self._channel = self._connection.channel()
+            self._channel.tx_select()
+        return self._channel
+
+    def _keepalive(self) -> None:
+        """Service heartbeats while idle so the broker does not drop the connection."""
+        if self._connection is None or not self._connection.is_open:
+            return
+        try:
+            self._connection.process_data_events(time_limit=0)
+        except AMQPError:
+            self._close()
+
+    def _close(self) -> None:
+        connection, self._connection, self._channel = self._connection, None, None
+        self._declared.clear()
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except AMQPError:
+                pass
+
+
+_publisher: Publisher | None = None
+
+
+def get_publisher() -> Publisher:
+    """Get or create and start the process-wide publisher."""
+    global _publisher
+    if _publisher is None:
+        _publisher = Publisher(
+            settings.rabbitmq_url,
+            batch_size=settings.rabbitmq_publish_batch_size,
+            reconnect_delay=settings.rabbitmq_reconnect_delay_sec,
+        )
+    _publisher.start()
+    return _publisher
+
+
+def close_publisher() -> None:
+    """Flush and stop the publisher (on shutdown)."""
+    global _publisher
+    if _publisher is not None:
+        _publisher.stop()
+        _publisher = None
+
+
+async def _publish(routing_key: str, body: str) -> None:
+    await asyncio.wrap_future(get_publisher().submit(routing_key, body))
+
+
+async def publish_event(event_type: EventType, payload: dict) -> None:
     """Publish event to RabbitMQ queue graph.tasks."""
-    params = pika.URLParameters(settings.rabbitmq_url)
-    connection = pika.BlockingConnection(params)
-    channel = connection.channel()
-    channel.queue_declare(queue=QUEUE_GRAPH_TASKS, durable=True)
-    body = json.dumps(build_event(event_type, payload))
-    channel.basic_publish(
-        exchange="",
-        routing_key=QUEUE_GRAPH_TASKS,
-        body=body,
-        properties=pika.BasicProperties(delivery_mode=2),
-    )
-    connection.close()
-
-
-def publish_llm_task(payload: dict) -> None:
+    await _publish(QUEUE_GRAPH_TASKS, json.dumps(build_event(event_type, payload)))
+
+
+async def publish_llm_task(payload: dict) -> None:
     """Publish LLM request to queue llm.tasks. payload: request_id, type (knowledge|generate), ..."""
-    params = pika.URLParameters(settings.rabbitmq_url)
-    connection = pika.BlockingConnection(params)
-    channel = connection.channel()
-    channel.queue_declare(queue=QUEUE_LLM_TASKS, durable=True)
-    body = json.dumps(payload)
-    channel.basic_publish(
-        exchange="",
-        routing_key=QUEUE_LLM_TASKS,
-        body=body,
-        properties=pika.BasicProperties(delivery_mode=2),
-    )
-    connection.close()
+    await _publish(QUEUE_LLM_TASKS, json.dumps(payload))
@@ -0,0 +1,238 @@
+"""In-process read cache for GET endpoints, invalidated by graph-change notifications.
+
+All writes go through the consumer, which publishes {"changes": [{"label", "id"}]} to the fanout
+exchange ``graph.changes`` after each commit (see shared/changes.py). Every cached entry carries
+tags; a change of (label, id) drops entries tagged ``<label>:<id>``, ``list:<label>`` and ``search``.
+
+The cache is only used while the change listener is connected (``set_active``): without
+notifications entries could not be invalidated, so reads go straight to Neo4j and the cache is
+cleared on every (re)connect. TTL is a backstop; with ``stale_sec`` > 0 an expired (but not
+invalidated) entry is served once more while it is refreshed in the background.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from dataclasses import dataclass
+from typing import Any
+
+import pika
+
+from app.core.config import settings
+from app.metrics import read_cache_entries, read_cache_invalidations_total, read_cache_requests_total
+from shared.changes import EXCHANGE_GRAPH_CHANGES
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TAG = "search"
+GRAPH_VERSION_TAG = "graph_version"  # every notification changes the graph version
+
+
+def node_tag(label: str, node_id: str) -> str:
+    return f"{label}:{node_id}"
+
+
+def list_tag(label: str) -> str:
+    return f"list:{label}"
+
+
+def change_tags(change: dict) -> set[str]:
+    """Tags to drop for one changed node."""
+    label = change.get("label")
+    return {node_tag(label, change.get("id")), list_tag(label), SEARCH_TAG}
+
+
+@dataclass
+class _Entry:
+    stored_at: float
+    tags: frozenset[str]
+    value: Any
+
+
+class ReadCache:
+    """LRU + TTL cache of query results with tag-based invalidation. Thread-safe."""
+
+    def __init__(self, max_entries: int = 10000, ttl_sec: float = 300, stale_sec: float = 0) -> None:
+        self._max_entries = max_entries
+        self._ttl_sec = ttl_sec
+        self._stale_sec = stale_sec
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._tags: dict[str, set[Hashable]] = {}
+        # Bumped by every invalidation: a load that started before it must not be stored
+        self._generation = 0
+        self._active = False
+        self._refreshing: set[Hashable] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def set_active(self, active: bool) -> None:
+        """Enable/disable caching; clears entries either way (notifications may have been missed)."""
+        with self._lock:
+            self._active = active
+            self._clear_locked()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear_locked()
+
+    async def get_or_load(
+        self,
+        operation: str,
+        key: Hashable,
+        tags: Iterable[str],
+        loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Cached value for key, or await loader() and store it under tags."""
+        if not self._active:
+            read_cache_requests_total.labels(operation=operation, result="bypass").inc()
+            return await loader()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            generation = self._generation
+        if entry is not None:
+            age = now - entry.stored_at
+            if age <= self._ttl_sec:
+                read_cache_requests_total.labels(operation=operation, result="hit").inc()
+                return entry.value
+            if age <= self._ttl_sec + self._stale_sec:
+                read_cache_requests_total.labels(operation=operation, result="stale").inc()
+                self._refresh_in_background(key, entry.tags, loader, generation)
+                return entry.value
+        read_cache_requests_total.labels(operation=operation, result="miss").inc()
+        value = await loader()
+        self._store(key, frozenset(tags), value, generation)
+        return value
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        """Drop every entry carrying any of tags. Returns number of dropped entries."""
+        dropped = 0
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if self._remove_locked(key):
+                        dropped += 1
+            read_cache_entries.set(len(self._entries))
+        return dropped
+
+    def invalidate_changes(self, changes: list[dict]) -> int:
+        tags: set[str] = {GRAPH_VERSION_TAG}
+        for change in changes:
+            tags |= change_tags(change)
+        dropped = self.invalidate(tags)
+        read_cache_invalidations_total.inc(dropped)
+        return dropped
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _refresh_in_background(self, key, tags, loader, generation) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        async def refresh() -> None:
+            try:
+                self._store(key, tags, await loader(), generation)
+            except Exception as e:
+                logger.warning("Background cache refresh failed: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _store(self, key, tags: frozenset[str], value, generation: int) -> None:
+        with self._lock:
+            if not self._active or generation != self._generation:
+                return
+            self._remove_locked(key)
+            self._entries[key] = _Entry(time.monotonic(), tags, value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self._max_entries:
+                self._remove_locked(next(iter(self._entries)))
+            read_cache_entries.set(len(self._entries))
+
+    def _remove_locked(self, key) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        return True
+
+    def _clear_locked(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._tags.clear()
+        read_cache_entries.set(0)
+
+
+read_cache = ReadCache(
+    max_entries=settings.read_cache_max_entries,
+    ttl_sec=settings.read_cache_ttl_sec,
+    stale_sec=settings.read_cache_stale_sec,
+)
+
+
+def make_change_handler(cache: ReadCache):
+    """on_message callback for graph.changes: invalidate cache entries of changed nodes."""
+
+    def on_message(ch, method, props, body):
+        try:
+            cache.invalidate_changes(json.loads(body).get("changes") or [])
+        except Exception as e:
+            # Unknown what changed: drop everything rather than serve stale data
+            logger.exception("Bad graph.changes message, clearing read cache: %s", e)
+            cache.clear()
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    return on_message
+
+
+def _listen_loop(cache: ReadCache, url: str) -> None:
+    while True:
+        try:
+            connection = pika.BlockingConnection(pika.URLParameters(url))
+            channel = connection.channel()
+            channel.exchange_declare(exchange=EXCHANGE_GRAPH_CHANGES, exchange_type="fanout", durable=True)
+            queue = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+            channel.queue_bind(queue=queue, exchange=EXCHANGE_GRAPH_CHANGES)
+            channel.basic_consume(queue=queue, on_message_callback=make_change_handler(cache))
+            cache.set_active(True)
+            logger.info("Graph changes listener started, read cache enabled")
+            channel.start_consuming()
+        except Exception as e:
+            logger.exception("Graph changes listener error: %s", e)
+        finally:
+            cache.set_active(False)
+        time.sleep(5)
+
+
+def start_graph_changes_listener(cache: ReadCache | None = None, url: str | None = None) -> threading.Thread:
+    """Start background thread that keeps the read cache in sync with graph.changes."""
+    t = threading.Thread(
+        target=_listen_loop,
+        args=(cache or read_cache, url or settings.rabbitmq_url),
+        daemon=True,
+    )
+    t.start()
+    return t
@@ -1,4 +1,5 @@
 """Neo4j graph client for read operations (server). Write operations go via consumer."""
+from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 from typing import Any
 
@@ -39,6 +40,22 @@ async def run_read_query(query: str, parameters: dict[str, Any] | None = None) -
     return records
 
 
+async def stream_read_query(
+    query: str, parameters: dict[str, Any] | None = None, fetch_size: int | None = None
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Execute read-only Cypher and yield records one by one from the result cursor.
+    The driver pulls fetch_size records at a time and only when the consumer asks for more,
+    so memory stays bounded by one batch (unlike run_read_query, which materialises everything).
+    """
+    driver = await get_driver()
+    parameters = parameters or {}
+    async with driver.session(fetch_size=fetch_size or settings.neo4j_fetch_size) as session:
+        result = await session.run(query, parameters)
+        async for record in result:
+            yield record.data()
+
+
 async def run_write_query(query: str, parameters: dict[str, Any] | None = None) -> None:
     """Execute write Cypher (used only for idempotent/read-heavy writes from server if needed)."""
     driver = await get_driver()
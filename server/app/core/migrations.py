@@ -0,0 +1,36 @@
+"""Run shared schema migrations (shared/schema.py) against Neo4j at server startup."""
+import logging
+
+from app.core.config import settings
+from app.core.graph import get_driver
+from shared.schema import CURRENT_VERSION_QUERY, RECORD_VERSION_QUERY, pending_migrations
+
+logger = logging.getLogger(__name__)
+
+
+async def run_migrations() -> int:
+    """Apply pending migrations. Returns the number applied."""
+    driver = await get_driver()
+    async with driver.session() as session:
+        result = await session.run(CURRENT_VERSION_QUERY)
+        record = await result.single()
+        current = record["version"] if record else None
+        applied = 0
+        for migration in pending_migrations(current):
+            logger.info("Applying schema migration %d: %s", migration.version, migration.description)
+            for statement in migration.statements:
+                result = await session.run(statement)
+                await result.consume()
+            for backfill in migration.backfills:
+                while True:
+                    result = await session.run(backfill, {"batch_size": settings.schema_backfill_batch_size})
+                    record = await result.single()
+                    if not record or not record["updated"]:
+                        break
+            result = await session.run(
+                RECORD_VERSION_QUERY,
+                {"version": migration.version, "description": migration.description},
+            )
+            await result.consume()
+            applied += 1
+    return applied
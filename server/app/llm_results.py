@@ -1,75 +1,348 @@
-"""In-memory store for LLM results (consumed from llm.results queue) and background consumer thread."""
+"""LLM results (consumed from llm.results) with a pluggable store and background consumer thread.
+
+The consumer publishes every result to the fanout exchange ``llm.results``. Delivery to the
+server depends on ``settings.llm_results_backend``:
+
+- ``fanout`` (default): every replica binds its own queue ``llm.results.<replica>`` (host name by
+  default) to the exchange, so any pod can answer GET /api/llm/result/{request_id} regardless of
+  which pod accepted the task. The queue is named, not exclusive: results published while the
+  replica reconnects to the broker wait in it. A queue without consumers for
+  ``llm_results_queue_ttl_sec`` (the pod is gone) is deleted by the broker (``x-expires``);
+  results published during a longer outage are lost, and clients see a pending result until the
+  long-poll times out;
+- ``memory``: replicas share the durable queue ``llm.results`` (only safe with a single replica).
+
+Single-flight: identical tasks (InFlightTasks key) accepted by this replica while one is already in
+flight are not published; their request_ids are attached to the leader, and its final result is
+stored under every attached request_id. If it never arrives (llm_coalesce_ttl_sec), the attached
+request_ids get an error result.
+"""
+import asyncio
 import json
 import logging
+import socket
 import threading
 import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
 
 import pika
 
+from app.answer_cache import remember_answer
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 QUEUE_LLM_RESULTS = "llm.results"
+EXCHANGE_LLM_RESULTS = "llm.results"
+
+
+class ResultStore(ABC):
+    """Storage for LLM results keyed by request_id."""
+
+    @abstractmethod
+    def set(self, request_id: str, data: dict) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, request_id: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    async def wait_for(
+        self, request_id: str, predicate: Callable[[dict | None], bool], timeout: float
+    ) -> dict | None:
+        """Wait until predicate(current data) holds or timeout expires. Returns the latest data."""
+
+
+def is_final(data: dict | None) -> bool:
+    """Result is final (done or error), not pending or partial (streamed answer so far)."""
+    return data is not None and data.get("status") in ("done", "error")
+
+
+class InMemoryResultStore(ResultStore):
+    """
+    Process-local store with TTL and a memory cap.
+    TTL is the same for every entry, so insertion order is expiry order: expired entries are
+    popped from the head of an OrderedDict (amortised O(1)) instead of scanning the whole store.
+    """
+
+    def __init__(self, ttl_sec: float = 3600, max_entries: int = 10000) -> None:
+        self._ttl_sec = ttl_sec
+        self._max_entries = max_entries
+        # request_id -> (stored_at, { "status": "done" | "error", "answer"?, "entity_type"?, "payload"?, "error"? })
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # request_id -> parked requests (event loop, future) woken by set(); set() runs in the consumer thread
+        self._waiters: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, request_id: str, data: dict) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._entries[request_id] = (now, data)
+            self._entries.move_to_end(request_id)
+            self._prune_expired(now)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            waiters = self._waiters.pop(request_id, ())
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # event loop already closed
+
+    def get(self, request_id: str) -> dict | None:
+        with self._lock:
+            self._prune_expired(time.monotonic())
+            entry = self._entries.get(request_id)
+        return entry[1] if entry else None
+
+    async def wait_for(
+        self, request_id: str, predicate: Callable[[dict | None], bool], timeout: float
+    ) -> dict | None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._lock:
+                self._prune_expired(time.monotonic())
+                entry = self._entries.get(request_id)
+                data = entry[1] if entry else None
+                remaining = deadline - loop.time()
+                if predicate(data) or remaining <= 0:
+                    return data
+                waiter = (loop, loop.create_future())
+                self._waiters.setdefault(request_id, set()).add(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    parked = self._waiters.get(request_id)
+                    if parked is not None:
+                        parked.discard(waiter)
+                        if not parked:
+                            del self._waiters[request_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _prune_expired(self, now: float) -> None:
+        while self._entries:
+            stored_at = next(iter(self._entries.values()))[0]
+            if now - stored_at <= self._ttl_sec:
+                break
+            self._entries.popitem(last=False)
+
+
+class InFlightTasks:
+    """
+    Tasks published by this replica and not finished yet: key -> leader request_id, plus the
+    request_ids attached to each leader. Leaders are kept in start order, so every join pops those
+    older than ttl_sec (result lost: consumer crash, result consumed by another replica) from the
+    head, and on_expired gets the request_ids that were attached to them. At most max_entries
+    leaders are tracked; beyond that new tasks are published without coalescing.
+    """
+
+    def __init__(
+        self,
+        ttl_sec: float = 300,
+        max_entries: int = 10000,
+        on_expired: Callable[[list[str]], None] | None = None,
+    ) -> None:
+        self._ttl_sec = ttl_sec
+        self._max_entries = max_entries
+        self._on_expired = on_expired
+        self._leaders: OrderedDict[Hashable, tuple[float, str]] = OrderedDict()
+        self._followers: dict[str, tuple[Hashable, list[str]]] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: Hashable, request_id: str) -> str | None:
+        """Attach request_id to the in-flight leader and return its id; None — request_id is the new leader."""
+        now = time.monotonic()
+        leader_id = None
+        with self._lock:
+            expired = self._purge_expired(now)
+            leader = self._leaders.get(key)
+            if leader is not None:
+                leader_id = leader[1]
+                self._followers[leader_id][1].append(request_id)
+            elif len(self._leaders) < self._max_entries:
+                self._leaders[key] = (now, request_id)
+                self._followers[request_id] = (key, [])
+        if expired and self._on_expired is not None:
+            self._on_expired(expired)
+        return leader_id
+
+    def finish(self, leader_id: str) -> list[str]:
+        """Leader is done (or failed to publish): forget it, return attached request_ids."""
+        with self._lock:
+            entry = self._followers.pop(leader_id, None)
+            if entry is None:
+                return []
+            key, followers = entry
+            if self._leaders.get(key, (0, None))[1] == leader_id:
+                del self._leaders[key]
+            return followers
+
+    def attached(self, leader_id: str) -> list[str]:
+        """request_ids attached to an unfinished leader (for intermediate results)."""
+        with self._lock:
+            entry = self._followers.get(leader_id)
+            return list(entry[1]) if entry else []
+
+    def clear(self) -> None:
+        with self._lock:
+            self._leaders.clear()
+            self._followers.clear()
+
+    def _purge_expired(self, now: float) -> list[str]:
+        """Forget leaders older than ttl_sec; returns the request_ids attached to them."""
+        expired: list[str] = []
+        while self._leaders:
+            key, (started_at, leader_id) = next(iter(self._leaders.items()))
+            if now - started_at <= self._ttl_sec:
+                break
+            del self._leaders[key]
+            expired.extend(self._followers.pop(leader_id, (key, []))[1])
+        return expired
 
-# request_id -> { "status": "done" | "error", "answer"?, "entity_type"?, "payload"?, "error"? }
-_results: dict[str, dict] = {}
-_results_lock = threading.Lock()
-# Храним результаты не более 1 часа
-_RESULT_TTL_SEC = 3600
-_result_timestamps: dict[str, float] = {}
+    def __len__(self) -> int:
+        return len(self._leaders)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_store: ResultStore = InMemoryResultStore(
+    ttl_sec=settings.llm_results_ttl_sec,
+    max_entries=settings.llm_results_max_entries,
+)
+
+
+def _fail_expired(request_ids: list[str]) -> None:
+    """Requests attached to a leader whose result never arrived: finish them with an error instead of pending."""
+    for request_id in request_ids:
+        _store.set(request_id, {"request_id": request_id, "status": "error", "error": "LLM result not received in time"})
+
+
+in_flight = InFlightTasks(
+    ttl_sec=settings.llm_coalesce_ttl_sec,
+    max_entries=settings.llm_coalesce_max_entries,
+    on_expired=_fail_expired,
+)
+
+
+def get_store() -> ResultStore:
+    return _store
 
 
 def set_result(request_id: str, data: dict) -> None:
-    with _results_lock:
-        _results[request_id] = data
-        _result_timestamps[request_id] = time.time()
+    _store.set(request_id, data)
 
 
 def get_result(request_id: str) -> dict | None:
-    with _results_lock:
-        _prune_expired()
-        return _results.get(request_id)
+    return _store.get(request_id)
+
+
+async def wait_for_result(request_id: str, timeout: float) -> dict | None:
+    """Long-poll: return as soon as the result is final, or whatever is stored after timeout."""
+    return await _store.wait_for(request_id, is_final, timeout)
+
 
+def merge_partial(previous: dict | None, data: dict) -> dict:
+    """
+    A partial generate result carries only the entities of the chunk that just finished (items with their
+    indices): add them to the partial already stored, in index order, so partial_items holds all so far.
+    """
+    if data.get("type") != "generate" or not previous or previous.get("status") != "partial":
+        return data
+    by_index = dict(zip(previous.get("indices") or [], previous.get("items") or []))
+    by_index.update(zip(data.get("indices") or [], data.get("items") or []))
+    indices = sorted(by_index)
+    return {**data, "indices": indices, "items": [by_index[i] for i in indices]}
 
-def _prune_expired() -> None:
-    now = time.time()
-    expired = [rid for rid, ts in _result_timestamps.items() if now - ts > _RESULT_TTL_SEC]
-    for rid in expired:
-        _results.pop(rid, None)
-        _result_timestamps.pop(rid, None)
 
+def make_message_handler(store: ResultStore, tasks: InFlightTasks | None = None):
+    """on_message callback that puts llm.results messages into store (and under attached request_ids)."""
+    tasks = tasks or in_flight
 
-def _consume_loop() -> None:
+    def on_message(ch, method, props, body):
+        try:
+            data = json.loads(body)
+            request_id = data.get("request_id")
+            if not request_id:
+                logger.warning("llm.results message without request_id")
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            if is_final(data):
+                followers = tasks.finish(request_id)
+            else:
+                previous = store.get(request_id)
+                if is_final(previous):
+                    # A partial answer overtaken by the final result
+                    ch.basic_ack(delivery_tag=method.delivery_tag)
+                    return
+                data = merge_partial(previous, data)
+                followers = tasks.attached(request_id)
+            store.set(request_id, data)
+            for follower_id in followers:
+                store.set(follower_id, {**data, "request_id": follower_id})
+            remember_answer(data)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+        except Exception as e:
+            logger.exception("Failed to process llm.results message: %s", e)
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+
+    return on_message
+
+
+def replica_queue_name(replica: str | None = None) -> str:
+    """Fanout queue of this replica: llm.results.<replica>, host name (pod name) by default."""
+    return f"{QUEUE_LLM_RESULTS}.{replica or settings.llm_results_replica or socket.gethostname()}"
+
+
+def declare_results_queue(channel, backend: str, replica: str | None = None) -> str:
+    """Declare the results exchange and the queue this replica reads from. Returns queue name."""
+    channel.exchange_declare(exchange=EXCHANGE_LLM_RESULTS, exchange_type="fanout", durable=True)
+    if backend == "fanout":
+        queue = replica_queue_name(replica)
+        channel.queue_declare(
+            queue=queue,
+            arguments={"x-expires": int(settings.llm_results_queue_ttl_sec * 1000)},
+        )
+    else:
+        channel.queue_declare(queue=QUEUE_LLM_RESULTS, durable=True)
+        queue = QUEUE_LLM_RESULTS
+    channel.queue_bind(queue=queue, exchange=EXCHANGE_LLM_RESULTS)
+    return queue
+
+
+def _consume_loop(store: ResultStore, url: str, backend: str, replica: str | None) -> None:
     while True:
         try:
-            params = pika.URLParameters(settings.rabbitmq_url)
+            params = pika.URLParameters(url)
             connection = pika.BlockingConnection(params)
             channel = connection.channel()
-            channel.queue_declare(queue=QUEUE_LLM_RESULTS, durable=True)
-
-            def on_message(ch, method, props, body):
-                try:
-                    data = json.loads(body)
-                    request_id = data.get("request_id")
-                    if not request_id:
-                        logger.warning("llm.results message without request_id")
-                        ch.basic_ack(delivery_tag=method.delivery_tag)
-                        return
-                    set_result(request_id, data)
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                except Exception as e:
-                    logger.exception("Failed to process llm.results message: %s", e)
-                    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-
-            channel.basic_consume(queue=QUEUE_LLM_RESULTS, on_message_callback=on_message)
-            logger.info("LLM results consumer started")
+            queue = declare_results_queue(channel, backend, replica)
+            channel.basic_consume(queue=queue, on_message_callback=make_message_handler(store))
+            logger.info("LLM results consumer started (backend=%s)", backend)
             channel.start_consuming()
         except Exception as e:
             logger.exception("LLM results consumer error: %s", e)
         time.sleep(5)
 
 
-def start_llm_results_consumer() -> None:
-    """Start background thread that consumes llm.results and fills _results."""
-    t = threading.Thread(target=_consume_loop, daemon=True)
+def start_llm_results_consumer(
+    store: ResultStore | None = None, url: str | None = None, replica: str | None = None
+) -> threading.Thread:
+    """Start background thread that consumes llm.results and fills the store."""
+    t = threading.Thread(
+        target=_consume_loop,
+        args=(store or _store, url or settings.rabbitmq_url, settings.llm_results_backend, replica),
+        daemon=True,
+    )
     t.start()
+    return t
@@ -1,16 +1,23 @@
 """FastAPI app: REST API, metrics, lifespan."""
+import logging
 import time
 
 from fastapi import FastAPI, Request, Depends
 from fastapi.responses import Response
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
-from app.api import locations, characters, story, concepts, search, llm, auth
+from app.api import locations, characters, story, concepts, search, llm, auth, export, bulk
 from app.auth import get_current_user
+from app.core.broker import close_publisher, get_publisher
+from app.core.cache import start_graph_changes_listener
+from app.core.config import settings
 from app.core.graph import close_driver
+from app.core.migrations import run_migrations
 from app.llm_results import start_llm_results_consumer
 from app.metrics import http_requests_total, http_request_duration_seconds
 
+logger = logging.getLogger(__name__)
+
 
 def create_app() -> FastAPI:
     """Create FastAPI application."""
@@ -19,10 +26,19 @@ def create_app() -> FastAPI:
     @app.on_event("shutdown")
     async def shutdown() -> None:
         await close_driver()
+        close_publisher()
 
     @app.on_event("startup")
-    def startup() -> None:
+    async def startup() -> None:
         start_llm_results_consumer()
+        if settings.read_cache_enabled:
+            start_graph_changes_listener()
+        get_publisher()
+        if settings.schema_migrations_enabled:
+            try:
+                await run_migrations()
+            except Exception as e:
+                logger.exception("Schema migrations failed: %s", e)
 
     @app.middleware("http")
     async def metrics_middleware(request: Request, call_next):
@@ -55,6 +71,8 @@ def create_app() -> FastAPI:
     app.include_router(concepts.router, prefix="/api", dependencies=[Depends(get_current_user)])
     app.include_router(search.router, prefix="/api", dependencies=[Depends(get_current_user)])
     app.include_router(llm.router, prefix="/api", dependencies=[Depends(get_current_user)])
+    app.include_router(export.router, prefix="/api", dependencies=[Depends(get_current_user)])
+    app.include_router(bulk.router, prefix="/api", dependencies=[Depends(get_current_user)])
 
     return app
 
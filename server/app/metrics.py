@@ -1,5 +1,5 @@
 """Prometheus metrics."""
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 
 http_requests_total = Counter(
     "http_server_requests_total",
@@ -22,3 +22,26 @@ neo4j_queries_total = Counter(
     "Total Neo4j queries",
     ["operation"],
 )
+read_cache_requests_total = Counter(
+    "read_cache_requests_total",
+    "Read cache lookups by result: hit, miss, stale (served while refreshing), bypass (cache inactive)",
+    ["operation", "result"],
+)
+read_cache_invalidations_total = Counter(
+    "read_cache_invalidations_total",
+    "Read cache entries dropped by graph.changes notifications",
+)
+read_cache_entries = Gauge(
+    "read_cache_entries",
+    "Entries currently in the read cache",
+)
+llm_answer_cache_requests_total = Counter(
+    "llm_answer_cache_requests_total",
+    "POST /api/llm/answer answer cache lookups by result: hit (answered without a task), miss",
+    ["result"],
+)
+llm_task_requests_total = Counter(
+    "llm_task_requests_total",
+    "LLM task requests by result: queued (published to llm.tasks), coalesced (attached to an identical task in flight)",
+    ["type", "result"],
+)
@@ -14,6 +14,7 @@ from app.models.schemas.llm import (
     LLMResultError,
 )
 from app.models.schemas.auth import TokenRequest, TokenResponse
+from app.models.schemas.bulk import BulkAccepted
 
 __all__ = [
     "LocationCreate",
@@ -38,4 +39,5 @@ __all__ = [
     "LLMResultError",
     "TokenRequest",
     "TokenResponse",
+    "BulkAccepted",
 ]
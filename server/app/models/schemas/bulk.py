@@ -0,0 +1,10 @@
+"""Bulk import schemas."""
+from pydantic import BaseModel
+
+
+class BulkAccepted(BaseModel):
+    """Bulk import accepted: ids in input order, ref -> id for items that had a ref."""
+    status: str = "accepted"
+    count: int
+    ids: list[str]
+    refs: dict[str, str]
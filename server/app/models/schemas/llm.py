@@ -13,7 +13,11 @@ class LLMAnswerRequest(BaseModel):
 class LLMGenerateRequest(BaseModel):
     """Запрос на генерацию сущности (ставится в очередь, в БД не сохраняется)."""
     entity_type: Literal["location", "character", "concept", "scene"] = Field(...)
-    prompt: str = Field(default="", description="Подсказка для генерации")
+    prompt: str = Field(default="", description="Подсказка для генерации (общая для всех при count/prompts)")
+    count: int = Field(default=1, ge=1, le=1000, description="Сколько сущностей сгенерировать одной задачей")
+    prompts: list[str] | None = Field(
+        default=None, min_length=1, max_length=1000, description="Подсказка на каждую сущность (вместо count)"
+    )
 
 
 class LLMTaskAccepted(BaseModel):
@@ -22,9 +26,14 @@ class LLMTaskAccepted(BaseModel):
 
 
 class LLMResultPending(BaseModel):
-    """Результат ещё не готов."""
+    """
+    Результат ещё не готов. partial_answer — уже сгенерированная часть ответа (потоковый режим),
+    partial_items — уже готовые сущности пакетной генерации.
+    """
     status: Literal["pending"] = "pending"
     request_id: str
+    partial_answer: str | None = None
+    partial_items: list[dict] | None = None
 
 
 class LLMResultAnswer(BaseModel):
@@ -34,6 +43,7 @@ class LLMResultAnswer(BaseModel):
     type: Literal["knowledge"] = "knowledge"
     answer: str
     role: str | None = None
+    cached: bool = False  # ответ из кэша ответов, задача в очередь не ставилась
 
 
 class LLMResultGenerate(BaseModel):
@@ -43,6 +53,8 @@ class LLMResultGenerate(BaseModel):
     type: Literal["generate"] = "generate"
     entity_type: Literal["location", "character", "concept", "scene"]
     payload: dict
+    items: list[dict] | None = None  # при count/prompts: все сгенерированные сущности по порядку
+    errors: list[dict] | None = None  # при count/prompts: {index, error} для не прошедших проверку
 
 
 class LLMResultError(BaseModel):
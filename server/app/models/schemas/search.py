@@ -8,3 +8,4 @@ class SearchResult(BaseModel):
     id: str
     name: str
     snippet: str = ""
+    score: float | None = None  # full-text relevance; None for the regex fallback
@@ -0,0 +1,105 @@
+"""Full graph dump as NDJSON, streamed from Neo4j result cursors (GET /api/export and CLI).
+
+One JSON object per line, nodes first, then relationships:
+    {"kind": "node", "type": "Location", "id": "...", "properties": {...}}
+    {"kind": "relationship", "type": "TAKES_PLACE_IN", "from": "<id>", "to": "<id>", "properties": {...}}
+
+CLI:
+    python -m app.services.export [-o world.ndjson.gz] [--gzip]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import zlib
+from collections.abc import AsyncIterator
+from typing import Any
+
+from app.core.config import settings
+from app.core.graph import close_driver, stream_read_query
+
+EXPORT_LABELS = ("Location", "Character", "Scene", "Concept")
+_LABEL_FILTER = " OR ".join(f"{{var}}:{label}" for label in EXPORT_LABELS)
+
+EXPORT_NODES_QUERY = f"""
+    MATCH (n)
+    WHERE {_LABEL_FILTER.format(var="n")}
+    RETURN labels(n)[0] AS type, n.id AS id, properties(n) AS properties
+"""
+
+EXPORT_RELATIONSHIPS_QUERY = f"""
+    MATCH (a)-[r]->(b)
+    WHERE ({_LABEL_FILTER.format(var="a")}) AND ({_LABEL_FILTER.format(var="b")})
+    RETURN type(r) AS type, a.id AS from, b.id AS to, properties(r) AS properties
+"""
+
+
+def _dumps(obj: dict[str, Any]) -> str:
+    # default=str: Neo4j temporal values (e.g. datetime properties) are not JSON-serialisable
+    return json.dumps(obj, ensure_ascii=False, default=str) + "\n"
+
+
+async def export_lines() -> AsyncIterator[str]:
+    """Yield NDJSON lines for every node, then every relationship."""
+    async for r in stream_read_query(EXPORT_NODES_QUERY):
+        yield _dumps({"kind": "node", "type": r["type"], "id": r["id"], "properties": r["properties"]})
+    async for r in stream_read_query(EXPORT_RELATIONSHIPS_QUERY):
+        yield _dumps({
+            "kind": "relationship",
+            "type": r["type"],
+            "from": r["from"],
+            "to": r["to"],
+            "properties": r["properties"],
+        })
+
+
+async def export_ndjson(compress: bool = False, chunk_bytes: int | None = None) -> AsyncIterator[bytes]:
+    """
+    Encode export_lines() into byte chunks of about chunk_bytes, gzip-compressed if compress.
+    Each chunk is yielded as soon as it fills, so a slow client slows down the Neo4j cursor
+    instead of the export piling up in memory.
+    """
+    chunk_bytes = chunk_bytes or settings.export_chunk_bytes
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+    buffer: list[bytes] = []
+    size = 0
+    async for line in export_lines():
+        data = line.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            raw = b"".join(buffer)
+            buffer, size = [], 0
+            out = compressor.compress(raw) if compressor else raw
+            if out:
+                yield out
+    raw = b"".join(buffer)
+    out = (compressor.compress(raw) + compressor.flush()) if compressor else raw
+    if out:
+        yield out
+
+
+async def export_to_stream(stream, compress: bool = False) -> None:
+    """Write the export to a binary file-like object."""
+    try:
+        async for chunk in export_ndjson(compress):
+            stream.write(chunk)
+    finally:
+        await close_driver()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Dump the whole graph as NDJSON.")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--gzip", action="store_true", help="gzip-compress the output (default if -o ends with .gz)")
+    args = parser.parse_args(argv)
+    compress = args.gzip or bool(args.output and args.output.endswith(".gz"))
+    if args.output:
+        with open(args.output, "wb") as f:
+            asyncio.run(export_to_stream(f, compress))
+    else:
+        asyncio.run(export_to_stream(sys.stdout.buffer, compress))
+
+
+if __name__ == "__main__":
+    main()
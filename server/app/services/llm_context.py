@@ -1,5 +1,23 @@
-"""Build LLM context from graph (by role: character id or narrator)."""
+"""Build LLM context from graph (by role: character id or narrator).
+
+The consumer materialises one (:RoleContext) document per role (shared/role_context.py), so the
+context is normally a single key lookup. A role without a document yet (graph written before
+schema migration 4, or role context materialisation disabled) is built on the fly with the same
+query and format.
+"""
 from app.core.graph import run_read_query
+from shared.role_context import (
+    CHARACTER_CONTEXT_QUERY,
+    NARRATOR_CONTEXT_QUERY,
+    READ_ROLE_CONTEXT_QUERY,
+    character_context_params,
+    format_character_context,
+    format_narrator_context,
+    is_narrator,
+    missing_character_context,
+    narrator_context_params,
+    role_key,
+)
 
 
 async def get_llm_context(role: str | None) -> str:
@@ -8,57 +26,23 @@ async def get_llm_context(role: str | None) -> str:
     - If role is a character id: character name, description, scenes and locations they appear in.
     - If role is "narrator" or empty: short world summary (locations, characters, concepts).
     """
-    role = (role or "").strip() or "narrator"
-    if role.lower() == "narrator":
+    records = await run_read_query(READ_ROLE_CONTEXT_QUERY, {"role": role_key(role)})
+    if records and records[0].get("text"):
+        return records[0]["text"]
+    if is_narrator(role):
         return await _narrator_context()
-    return await _character_context(role)
+    return await _character_context(role.strip())
 
 
 async def _narrator_context() -> str:
-    """World overview: counts and names of locations, characters, concepts."""
-    records = await run_read_query("""
-        MATCH (n)
-        WHERE n:Location OR n:Character OR n:Concept
-        RETURN labels(n)[0] AS type, COALESCE(n.name, n.title, n.id) AS name
-        LIMIT 50
-    """)
-    if not records:
-        return "Мир пока пуст (нет локаций, персонажей и понятий в графе)."
-    by_type: dict[str, list[str]] = {}
-    for r in records:
-        t = r.get("type") or "Node"
-        name = r.get("name") or ""
-        by_type.setdefault(t, []).append(name)
-    parts = []
-    for t in ("Location", "Character", "Concept"):
-        if t in by_type:
-            parts.append(f"{t}: {', '.join(by_type[t][:15])}" + (" ..." if len(by_type[t]) > 15 else ""))
-    return "Контекст мира (граф): " + "; ".join(parts) if parts else "Нет данных."
+    """World overview: names of locations, characters, concepts."""
+    records = await run_read_query(NARRATOR_CONTEXT_QUERY, narrator_context_params())
+    return format_narrator_context(records[0] if records else None)
 
 
 async def _character_context(character_id: str) -> str:
-    """Character profile and related scenes/locations."""
-    char_records = await run_read_query(
-        "MATCH (c:Character {id: $id}) RETURN c.name AS name, c.description AS description",
-        {"id": character_id},
-    )
-    if not char_records:
-        return f"Персонаж с id '{character_id}' не найден в графе."
-    c = char_records[0]
-    name = c.get("name") or character_id
-    desc = c.get("description") or ""
-    lines = [f"Персонаж: {name}.", desc] if desc else [f"Персонаж: {name}."]
-    scene_records = await run_read_query("""
-        MATCH (c:Character {id: $id})<-[:FEATURES]-(s:Scene)
-        OPTIONAL MATCH (s)-[:TAKES_PLACE_IN]->(l:Location)
-        RETURN s.title AS scene_title, s.description AS scene_desc, l.name AS location_name
-        LIMIT 10
-    """, {"id": character_id})
-    if scene_records:
-        scene_parts = []
-        for r in scene_records:
-            title = r.get("scene_title") or "Сцена"
-            loc = r.get("location_name")
-            scene_parts.append(f"{title}" + (f" (локация: {loc})" if loc else ""))
-        lines.append("Участвует в сценах: " + "; ".join(scene_parts))
-    return " ".join(lines)
+    """Character profile and related scenes/locations in one query."""
+    records = await run_read_query(CHARACTER_CONTEXT_QUERY, character_context_params([character_id]))
+    if not records:
+        return missing_character_context(character_id)
+    return format_character_context(records[0])
@@ -0,0 +1 @@
+"""Benchmarks against a real Neo4j (run manually, not part of the test suite)."""
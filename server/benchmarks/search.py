@@ -0,0 +1,108 @@
+"""
+Benchmark: GET /api/search queries — full-text index vs regex scan — at several graph sizes.
+
+Needs a running Neo4j (NEO4J_URI / NEO4J_USER / NEO4J_PASSWORD as for the server) with schema
+migrations applied (start the server once, or pass --migrate). Seeds Location/Character/Scene/Concept
+nodes with ids prefixed "bench-search-" up to each size, measures median/p95 latency of both queries,
+and deletes the seeded nodes at the end (unless --keep).
+
+    cd server && PYTHONPATH=.:.. python -m benchmarks.search --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from neo4j import GraphDatabase
+
+from app.core.config import settings
+from shared.search import FULLTEXT_SEARCH_QUERY, REGEX_SEARCH_QUERY, SEARCH_LABELS, search_params
+
+PREFIX = "bench-search-"
+SEED_BATCH = 10000
+SYLLABLES = ["та", "вер", "на", "лес", "гор", "ра", "ми", "ко", "дор", "ан", "ель", "ис", "тор", "ва"]
+QUERIES = ["таверна", "тавер", "лесной дор", "миколь", "горан"]
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def _seed(session, start: int, end: int) -> None:
+    rng = random.Random(start)
+    for batch_start in range(start, end, SEED_BATCH):
+        rows = []
+        for i in range(batch_start, min(end, batch_start + SEED_BATCH)):
+            label = SEARCH_LABELS[i % len(SEARCH_LABELS)]
+            text = f"{_word(rng)} {_word(rng)}"
+            rows.append({
+                "id": f"{PREFIX}{i}",
+                "label": label,
+                "text": text,
+                "description": " ".join(_word(rng) for _ in range(8)),
+            })
+        for label in SEARCH_LABELS:
+            field = "title" if label == "Scene" else "name"
+            session.run(
+                f"UNWIND $rows AS row MERGE (n:{label} {{id: row.id}}) "
+                f"SET n.{field} = row.text, n.{field}_norm = toLower(row.text), n.description = row.description",
+                {"rows": [r for r in rows if r["label"] == label]},
+            ).consume()
+
+
+def _measure(session, query: str, params: dict, repeat: int) -> tuple[float, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        session.run(query, params).consume()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--migrate", action="store_true", help="apply schema migrations first")
+    parser.add_argument("--keep", action="store_true", help="do not delete seeded nodes")
+    args = parser.parse_args()
+
+    if args.migrate:
+        from app.core.graph import close_driver
+        from app.core.migrations import run_migrations
+
+        async def migrate() -> None:
+            await run_migrations()
+            await close_driver()
+
+        asyncio.run(migrate())
+
+    driver = GraphDatabase.driver(settings.neo4j_uri, auth=(settings.neo4j_user, settings.neo4j_password))
+    seeded = 0
+    print(f"{'nodes':>8} | {'query':<12} | {'fulltext p50':>12} | {'p95':>8} | {'regex p50':>10} | {'p95':>8}")
+    try:
+        with driver.session() as session:
+            for size in sorted(args.sizes):
+                _seed(session, seeded, size)
+                seeded = size
+                session.run("CALL db.awaitIndexes(600)").consume()
+                for q in QUERIES:
+                    params = search_params(q, None, 50, 0)
+                    ft = _measure(session, FULLTEXT_SEARCH_QUERY, params, args.repeat)
+                    rx = _measure(session, REGEX_SEARCH_QUERY, params, max(3, args.repeat // 4))
+                    print(f"{size:>8} | {q:<12} | {ft[0]:>12.1f} | {ft[1]:>8.1f} | {rx[0]:>10.1f} | {rx[1]:>8.1f}")
+    finally:
+        if not args.keep:
+            with driver.session() as session:
+                session.run(
+                    "MATCH (n) WHERE n.id STARTS WITH $prefix "
+                    "CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS",
+                    {"prefix": PREFIX},
+                ).consume()
+        driver.close()
+
+
+if __name__ == "__main__":
+    main()
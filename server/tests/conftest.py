@@ -1,5 +1,5 @@
 """Pytest fixtures: app, client, mocks."""
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock
 
 import pytest
 from httpx import ASGITransport, AsyncClient
@@ -29,6 +29,39 @@ def mock_llm_results_consumer():
         yield
 
 
+@pytest.fixture(autouse=True)
+def mock_graph_changes_listener():
+    """Не запускать слушатель graph.changes; кэш чтения выключен и пуст в каждом тесте."""
+    from unittest.mock import patch
+    from app.core.cache import read_cache
+    read_cache.set_active(False)
+    with patch("app.main.start_graph_changes_listener"):
+        yield
+    read_cache.set_active(False)
+
+
+@pytest.fixture(autouse=True)
+def mock_answer_cache():
+    """Версия графа без Neo4j (0); кэш ответов пуст в каждом тесте."""
+    from unittest.mock import patch
+    from app.answer_cache import answer_cache
+    if answer_cache is not None:  # LLM_ANSWER_CACHE_ENABLED=false
+        answer_cache.clear()
+    with patch("app.answer_cache.current_graph_version", AsyncMock(return_value=0)):
+        yield answer_cache
+    if answer_cache is not None:
+        answer_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_llm_in_flight():
+    """Одинаковые вопросы в разных тестах не склеиваются с задачами предыдущих тестов."""
+    from app.llm_results import in_flight
+    in_flight.clear()
+    yield in_flight
+    in_flight.clear()
+
+
 @pytest.fixture
 def anyio_backend():
     return "asyncio"
@@ -51,4 +84,4 @@ def mock_run_read_query():
 @pytest.fixture
 def mock_publish_event():
     """Mock RabbitMQ publish_event (use with patch in test)."""
-    return MagicMock()
+    return AsyncMock()
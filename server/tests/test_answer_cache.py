@@ -0,0 +1,155 @@
+"""Tests for the LLM answer cache (question + role + graph version)."""
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.answer_cache import (
+    AnswerCache,
+    answer_cache,
+    InMemoryAnswerCache,
+    Neo4jAnswerCache,
+    answer_cache_key,
+    current_graph_version as real_current_graph_version,
+)
+from app.core.cache import read_cache
+from app.llm_results import InMemoryResultStore, make_message_handler
+from app.main import app
+
+
+def test_key_ignores_case_whitespace_and_trailing_punctuation():
+    assert answer_cache_key("Кто такой  Иван?", "narrator", 3) == answer_cache_key("кто такой иван", "narrator", 3)
+
+
+def test_key_depends_on_role_and_graph_version():
+    key = answer_cache_key("Кто такой Иван?", "narrator", 3)
+    assert key != answer_cache_key("Кто такой Иван?", "char-1", 3)
+    assert key != answer_cache_key("Кто такой Иван?", "narrator", 4)
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_evicts_least_recently_used():
+    cache = InMemoryAnswerCache(max_entries=2)
+    cache.put("a", {"answer": "A"})
+    cache.put("b", {"answer": "B"})
+    await cache.get("a")
+    cache.put("c", {"answer": "C"})
+    assert await cache.get("b") is None
+    assert await cache.get("a") == {"answer": "A"}
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_expires_entries():
+    cache = InMemoryAnswerCache(ttl_sec=10)
+    with patch("app.answer_cache.time.monotonic", return_value=100.0):
+        cache.put("a", {"answer": "A"})
+    with patch("app.answer_cache.time.monotonic", return_value=111.0):
+        assert await cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_answer_cache_backend_must_implement_put():
+    class ReadOnly(AnswerCache):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnly()
+
+
+@pytest.mark.asyncio
+async def test_neo4j_cache_reads_unexpired_entry_by_key():
+    with patch("app.answer_cache.run_read_query", AsyncMock(return_value=[{"answer": "A", "role": "narrator"}])) as q:
+        assert await Neo4jAnswerCache().get("3:abc") == {"answer": "A", "role": "narrator"}
+    query, params = q.call_args[0]
+    assert "c.expires_at > timestamp()" in query
+    assert params == {"key": "3:abc"}
+
+
+@pytest.mark.asyncio
+async def test_graph_version_cached_until_graph_changes():
+    read_cache.set_active(True)
+    with patch("app.answer_cache.run_read_query", AsyncMock(side_effect=[[{"version": 3}], [{"version": 4}]])) as q:
+        assert await real_current_graph_version() == 3
+        assert await real_current_graph_version() == 3
+        read_cache.invalidate_changes([{"label": "Location", "id": "loc-1"}])
+        assert await real_current_graph_version() == 4
+    assert q.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_graph_version_defaults_to_zero_on_empty_graph():
+    with patch("app.answer_cache.run_read_query", AsyncMock(return_value=[])):
+        assert await real_current_graph_version() == 0
+
+
+needs_answer_cache = pytest.mark.skipif(answer_cache is None, reason="LLM_ANSWER_CACHE_ENABLED=false")
+
+
+async def _ask(client, question="Кто такой Иван?"):
+    return await client.post("/api/llm/answer", json={"question": question, "role": "narrator"})
+
+
+@needs_answer_cache
+@pytest.mark.asyncio
+async def test_repeated_question_answered_from_cache_without_task():
+    transport = ASGITransport(app=app)
+    with patch("app.api.llm.publish_llm_task") as mock_publish:
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await _ask(client)
+            assert r.status_code == 202
+            task = mock_publish.call_args[0][0]
+            assert task["cache_key"] == answer_cache_key("Кто такой Иван?", "narrator", 0)
+            assert "cache_store" not in task
+
+            # Результат приходит из llm.results с тем же cache_key
+            result = {**task, "status": "done", "answer": "Кузнец"}
+            make_message_handler(InMemoryResultStore())(MagicMock(), MagicMock(), None, json.dumps(result))
+
+            r = await _ask(client, "кто такой иван")
+            assert r.status_code == 200
+            data = r.json()
+            assert data["status"] == "done" and data["answer"] == "Кузнец" and data["cached"] is True
+            r = await client.get(f"/api/llm/result/{data['request_id']}")
+    assert mock_publish.call_count == 1
+    assert r.json()["answer"] == "Кузнец"
+
+
+@needs_answer_cache
+@pytest.mark.asyncio
+async def test_new_graph_version_misses_cache(mock_answer_cache):
+    mock_answer_cache.put(answer_cache_key("Кто такой Иван?", "narrator", 0), {"answer": "old", "role": "narrator"})
+    transport = ASGITransport(app=app)
+    with patch("app.api.llm.publish_llm_task") as mock_publish:
+        with patch("app.answer_cache.current_graph_version", AsyncMock(return_value=1)):
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                r = await _ask(client)
+    assert r.status_code == 202
+    mock_publish.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_graph_version_unavailable_queues_task_without_cache_key():
+    transport = ASGITransport(app=app)
+    with patch("app.api.llm.publish_llm_task") as mock_publish:
+        with patch("app.answer_cache.current_graph_version", AsyncMock(side_effect=RuntimeError("neo4j down"))):
+            async with AsyncClient(transport=transport, base_url="http://test") as client:
+                r = await _ask(client)
+    assert r.status_code == 202
+    assert "cache_key" not in mock_publish.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_neo4j_backend_asks_consumer_to_store_answer():
+    transport = ASGITransport(app=app)
+    with patch("app.api.llm.answer_cache", Neo4jAnswerCache()), \
+            patch("app.answer_cache.answer_cache", Neo4jAnswerCache()), \
+            patch("app.answer_cache.run_read_query", AsyncMock(return_value=[])), \
+            patch("app.api.llm.publish_llm_task") as mock_publish:
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await _ask(client)
+    assert r.status_code == 202
+    task = mock_publish.call_args[0][0]
+    assert task["cache_store"] == "neo4j"
+    assert task["cache_ttl_sec"] > 0
@@ -0,0 +1,102 @@
+"""Tests for bulk import API."""
+import json
+
+import pytest
+from unittest.mock import patch
+
+from httpx import ASGITransport, AsyncClient
+
+from app.api.bulk import existing_keys_query
+from app.main import app
+
+WORLD = [
+    {"type": "location", "ref": "tavern", "name": " Таверна ", "description": "Шумно"},
+    {"type": "character", "ref": "alice", "name": "Алиса"},
+    {"type": "concept", "name": "Магия"},
+    {"type": "scene", "title": "Встреча", "location_id": "tavern", "character_ids": ["alice", "existing-char"]},
+]
+
+
+async def _post(body, content_type="application/json"):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/api/bulk", content=body, headers={"Content-Type": content_type})
+
+
+@pytest.mark.asyncio
+async def test_bulk_json_resolves_refs_and_publishes_batches(mock_run_read_query, mock_publish_event):
+    mock_run_read_query.return_value = []
+    with patch("app.api.bulk.run_read_query", mock_run_read_query), \
+            patch("app.api.bulk.publish_event", mock_publish_event), \
+            patch("app.api.bulk.settings.bulk_event_chunk_size", 3):
+        r = await _post(json.dumps(WORLD))
+    assert r.status_code == 202
+    data = r.json()
+    assert data["count"] == 4
+    assert data["refs"] == {"tavern": data["ids"][0], "alice": data["ids"][1]}
+    # Одна проверка уникальности на весь пакет
+    mock_run_read_query.assert_called_once()
+    params = mock_run_read_query.call_args[0][1]
+    assert params == {"Location": ["таверна"], "Character": ["алиса"], "Concept": ["магия"], "Scene": ["встреча"]}
+    # 4 события в пакетах по 3
+    assert mock_publish_event.call_count == 2
+    events = [e for call in mock_publish_event.call_args_list for e in call[0][1]["events"]]
+    assert [e["type"] for e in events] == ["location.create", "character.create", "concept.create", "scene.create"]
+    assert events[0]["payload"]["name"] == "Таверна"
+    scene = events[3]["payload"]
+    assert scene["location_id"] == data["ids"][0]
+    assert scene["character_ids"] == [data["ids"][1], "existing-char"]
+
+
+@pytest.mark.asyncio
+async def test_bulk_ndjson(mock_run_read_query, mock_publish_event):
+    mock_run_read_query.return_value = []
+    body = "\n".join(json.dumps(item) for item in WORLD[:2]) + "\n"
+    with patch("app.api.bulk.run_read_query", mock_run_read_query), \
+            patch("app.api.bulk.publish_event", mock_publish_event):
+        r = await _post(body, "application/x-ndjson")
+    assert r.status_code == 202
+    assert r.json()["count"] == 2
+    mock_publish_event.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_bulk_duplicates_in_batch_and_graph_409(mock_run_read_query, mock_publish_event):
+    mock_run_read_query.return_value = [{"label": "Character", "key": "алиса"}]
+    items = WORLD[:2] + [{"type": "location", "name": "ТАВЕРНА"}]
+    with patch("app.api.bulk.run_read_query", mock_run_read_query), \
+            patch("app.api.bulk.publish_event", mock_publish_event):
+        r = await _post(json.dumps(items))
+    assert r.status_code == 409
+    assert [d["index"] for d in r.json()["detail"]["duplicates"]] == [1, 2]
+    mock_publish_event.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_bulk_invalid_items_400(mock_run_read_query, mock_publish_event):
+    items = [
+        {"type": "planet", "name": "X"},
+        {"type": "scene", "title": "No location"},
+        {"type": "character", "ref": "bob", "name": "Bob"},
+        {"type": "scene", "title": "Wrong ref", "location_id": "bob"},
+    ]
+    with patch("app.api.bulk.run_read_query", mock_run_read_query), \
+            patch("app.api.bulk.publish_event", mock_publish_event):
+        r = await _post(json.dumps(items))
+    assert r.status_code == 400
+    assert [e["index"] for e in r.json()["detail"]["errors"]] == [0, 1, 3]
+    mock_run_read_query.assert_not_called()
+    mock_publish_event.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_bulk_not_an_array_400():
+    r = await _post(json.dumps({"type": "location", "name": "X"}))
+    assert r.status_code == 400
+
+
+def test_existing_keys_query_one_branch_per_label():
+    query = existing_keys_query(["Location", "Scene"])
+    assert query.count("UNION ALL") == 1
+    assert "(n:Location {name_norm: key})" in query
+    assert "(n:Scene {title_norm: key})" in query
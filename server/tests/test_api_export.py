@@ -0,0 +1,61 @@
+"""Tests for export API (streamed NDJSON dump)."""
+import gzip
+import json
+
+import pytest
+from unittest.mock import patch
+
+from httpx import ASGITransport, AsyncClient
+
+from app.main import app
+from app.services.export import EXPORT_NODES_QUERY
+
+
+def _fake_stream(nodes, relationships):
+    async def stream(query, parameters=None, fetch_size=None):
+        for r in nodes if query == EXPORT_NODES_QUERY else relationships:
+            yield r
+
+    return stream
+
+
+NODES = [
+    {"type": "Location", "id": "loc-1", "properties": {"id": "loc-1", "name": "Таверна"}},
+    {"type": "Scene", "id": "s1", "properties": {"id": "s1", "title": "Встреча"}},
+]
+RELATIONSHIPS = [{"type": "TAKES_PLACE_IN", "from": "s1", "to": "loc-1", "properties": {}}]
+
+
+@pytest.mark.asyncio
+async def test_export_ndjson():
+    with patch("app.services.export.stream_read_query", _fake_stream(NODES, RELATIONSHIPS)):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/export", params={"format": "ndjson"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines[0] == {"kind": "node", "type": "Location", "id": "loc-1", "properties": NODES[0]["properties"]}
+    assert lines[2] == {"kind": "relationship", "type": "TAKES_PLACE_IN", "from": "s1", "to": "loc-1", "properties": {}}
+    assert len(lines) == 3
+
+
+@pytest.mark.asyncio
+async def test_export_gzip_small_chunks():
+    with patch("app.services.export.stream_read_query", _fake_stream(NODES, RELATIONSHIPS)), \
+            patch("app.services.export.settings.export_chunk_bytes", 10):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/export", params={"gzip": "true"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/gzip"
+    lines = gzip.decompress(r.content).decode("utf-8").splitlines()
+    assert [json.loads(line)["kind"] for line in lines] == ["node", "node", "relationship"]
+
+
+@pytest.mark.asyncio
+async def test_export_unknown_format_422():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/export", params={"format": "csv"})
+    assert r.status_code == 422
@@ -107,3 +107,174 @@ async def test_llm_result_error():
     data = r.json()
     assert data["status"] == "error"
     assert "timeout" in data["error"].lower()
+
+
+@pytest.mark.asyncio
+async def test_llm_result_long_poll_returns_when_result_arrives():
+    """GET ?wait= parks the request until set_result delivers the answer (from another thread)."""
+    import asyncio
+    import threading
+
+    from app.llm_results import set_result
+
+    def deliver():
+        set_result("rid-wait", {"request_id": "rid-wait", "status": "done", "type": "knowledge", "answer": "Late"})
+
+    loop = asyncio.get_running_loop()
+    loop.call_later(0.05, lambda: threading.Thread(target=deliver).start())
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/llm/result/rid-wait", params={"wait": 5})
+    assert r.status_code == 200
+    assert r.json()["status"] == "done"
+    assert r.json()["answer"] == "Late"
+
+
+@pytest.mark.asyncio
+async def test_llm_result_long_poll_times_out_pending():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/llm/result/rid-never", params={"wait": 0.05})
+    assert r.status_code == 200
+    assert r.json()["status"] == "pending"
+
+
+@pytest.mark.asyncio
+async def test_llm_result_stream_emits_done_event():
+    from app.llm_results import set_result
+
+    set_result("rid-sse", {"request_id": "rid-sse", "status": "done", "type": "knowledge", "answer": "Streamed"})
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/llm/result/rid-sse/stream")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    assert "event: done" in r.text
+    assert "Streamed" in r.text
+
+
+async def _post_answers(client, *bodies):
+    return [await client.post("/api/llm/answer", json=body) for body in bodies]
+
+
+@pytest.mark.asyncio
+async def test_llm_identical_questions_in_flight_share_one_task():
+    """Одинаковые вопросы, пока первый в работе, не публикуются; результат получают все request_id."""
+    import json
+    from unittest.mock import MagicMock
+    from app.llm_results import get_store, make_message_handler
+
+    transport = ASGITransport(app=app)
+    with patch("app.api.llm.publish_llm_task") as mock_publish:
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await _post_answers(
+                client,
+                {"question": "Где таверна?", "role": "narrator"},
+                {"question": "  где ТАВЕРНА ", "role": "narrator"},
+                {"question": "Где таверна?", "role": "char-1"},
+            )
+            assert mock_publish.call_count == 2
+            leader = mock_publish.call_args_list[0][0][0]["request_id"]
+            result = {"request_id": leader, "status": "done", "type": "knowledge", "answer": "У реки"}
+            make_message_handler(get_store())(MagicMock(), MagicMock(), None, json.dumps(result))
+            follower = responses[1].json()["request_id"]
+            r = await client.get(f"/api/llm/result/{follower}")
+    assert all(resp.status_code == 202 for resp in responses)
+    assert r.json()["status"] == "done"
+    assert r.json()["answer"] == "У реки"
+
+
+@pytest.mark.asyncio
+async def test_llm_identical_generate_requests_coalesced():
+    transport = ASGITransport(app=app)
+    with patch("app.api.llm.publish_llm_task") as mock_publish:
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            for _ in range(3):
+                await client.post("/api/llm/generate", json={"entity_type": "location", "prompt": "таверна"})
+            await client.post("/api/llm/generate", json={"entity_type": "character", "prompt": "таверна"})
+    assert mock_publish.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_llm_publish_failure_fails_attached_requests(reset_llm_in_flight):
+    from app.api.llm import _submit_task
+    from app.llm_results import get_result
+
+    key = ("knowledge", "k")
+
+    async def attach_then_fail(payload):
+        reset_llm_in_flight.join(key, "r2")  # пришёл, пока лидер публикуется
+        raise RuntimeError("broker down")
+
+    with patch("app.api.llm.publish_llm_task", side_effect=attach_then_fail):
+        with pytest.raises(RuntimeError):
+            await _submit_task({"request_id": "r1", "type": "knowledge"}, key)
+    assert get_result("r2")["status"] == "error"
+    assert reset_llm_in_flight.join(key, "r3") is None  # ключ свободен
+
+
+@pytest.mark.asyncio
+async def test_llm_result_partial_is_pending_with_partial_answer():
+    from app.llm_results import set_result
+
+    set_result("rid-part", {"request_id": "rid-part", "status": "partial", "type": "knowledge", "answer": "Куз"})
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/llm/result/rid-part")
+    assert r.json() == {"status": "pending", "request_id": "rid-part", "partial_answer": "Куз", "partial_items": None}
+
+
+@pytest.mark.asyncio
+async def test_llm_result_stream_emits_partial_then_done():
+    import asyncio
+    import threading
+
+    from app.llm_results import set_result
+
+    def deliver_final():
+        set_result("rid-sse2", {"request_id": "rid-sse2", "status": "done", "type": "knowledge", "answer": "Кузнец"})
+
+    set_result("rid-sse2", {"request_id": "rid-sse2", "status": "partial", "type": "knowledge", "answer": "Куз"})
+    asyncio.get_running_loop().call_later(0.05, lambda: threading.Thread(target=deliver_final).start())
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/llm/result/rid-sse2/stream")
+    assert r.text.index("event: partial") < r.text.index("event: done")
+    assert '"partial_answer":"Куз"' in r.text
+
+
+@pytest.mark.asyncio
+async def test_llm_generate_batch_task_payload():
+    transport = ASGITransport(app=app)
+    with patch("app.api.llm.publish_llm_task") as mock_publish:
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/api/llm/generate", json={"entity_type": "character", "prompt": "NPC", "count": 200})
+            await client.post("/api/llm/generate", json={"entity_type": "character", "prompt": "NPC", "count": 3})
+            await client.post(
+                "/api/llm/generate", json={"entity_type": "character", "prompts": ["кузнец", "пекарь"]}
+            )
+            r = await client.post("/api/llm/generate", json={"entity_type": "character", "count": 1001})
+    tasks = [c[0][0] for c in mock_publish.call_args_list]
+    # Разный count — разные задачи (не склеиваются)
+    assert [t.get("count") for t in tasks] == [200, 3, None]
+    assert tasks[2]["prompts"] == ["кузнец", "пекарь"]
+    assert r.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_llm_result_generate_batch_items_and_partial():
+    from app.llm_results import set_result
+
+    set_result("rid-g", {"request_id": "rid-g", "status": "partial", "type": "generate", "items": [{"name": "A"}]})
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        pending = (await client.get("/api/llm/result/rid-g")).json()
+        set_result("rid-g", {
+            "request_id": "rid-g", "status": "done", "type": "generate", "entity_type": "character",
+            "payload": {"name": "A"}, "items": [{"name": "A"}, {"name": "B"}],
+            "errors": [{"index": 2, "error": "name: пустое значение"}],
+        })
+        done = (await client.get("/api/llm/result/rid-g")).json()
+    assert pending["status"] == "pending" and pending["partial_items"] == [{"name": "A"}]
+    assert [i["name"] for i in done["items"]] == ["A", "B"]
+    assert done["errors"][0]["index"] == 2
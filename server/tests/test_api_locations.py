@@ -142,3 +142,79 @@ async def test_update_location_same_name_ok(mock_publish_event, mock_run_read_qu
             r = await client.patch("/api/locations/loc-1", json={"name": "Same Name"})
     assert r.status_code == 202
     mock_publish_event.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_list_locations_page_with_cursor_and_fields(mock_run_read_query):
+    mock_run_read_query.return_value = [
+        {"id": "loc-2", "name": "Forest"},
+        {"id": "loc-3", "name": "Castle"},
+    ]
+    with patch("app.api.base_resource.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/locations", params={"after": "loc-1", "limit": 2, "fields": "name"})
+    assert r.status_code == 200
+    assert r.json() == [{"name": "Forest"}, {"name": "Castle"}]
+    assert r.headers["X-Next-Cursor"] == "loc-3"
+    query, params = mock_run_read_query.call_args[0]
+    assert "n.id > $after" in query and "ORDER BY n.id" in query
+    assert "n.description" not in query
+    assert params == {"after": "loc-1", "limit": 2}
+
+
+@pytest.mark.asyncio
+async def test_list_locations_last_page_has_no_cursor(mock_run_read_query):
+    mock_run_read_query.return_value = [{"id": "loc-9", "name": "End", "description": None}]
+    with patch("app.api.base_resource.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/locations", params={"limit": 5})
+    assert r.json() == [{"id": "loc-9", "name": "End", "description": ""}]
+    assert "X-Next-Cursor" not in r.headers
+
+
+@pytest.mark.asyncio
+async def test_list_locations_streams_all_pages(mock_run_read_query):
+    mock_run_read_query.side_effect = [
+        [{"id": "a", "name": "A", "description": ""}, {"id": "b", "name": "B", "description": ""}],
+        [{"id": "c", "name": "C", "description": ""}],
+    ]
+    with patch("app.api.base_resource.run_read_query", mock_run_read_query), \
+            patch("app.api.pagination.settings.list_page_size", 2):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/locations")
+    assert r.status_code == 200
+    assert [x["id"] for x in r.json()] == ["a", "b", "c"]
+    assert mock_run_read_query.call_args_list[1][0][1] == {"after": "b", "limit": 2}
+
+
+@pytest.mark.asyncio
+async def test_list_locations_stream_error_before_body_is_5xx(mock_run_read_query):
+    mock_run_read_query.side_effect = RuntimeError("neo4j down")
+    with patch("app.api.base_resource.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app, raise_app_exceptions=False)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/locations")
+    assert r.status_code == 500
+
+
+@pytest.mark.asyncio
+async def test_list_routes_do_not_advertise_full_read_schema():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        spec = (await client.get("/openapi.json")).json()
+    for path in ("/api/locations", "/api/story/scenes"):
+        ok = spec["paths"][path]["get"]["responses"]["200"]
+        assert "?fields=" in ok["description"]
+        assert "$ref" not in str(ok.get("content", {}))
+
+
+@pytest.mark.asyncio
+async def test_list_locations_unknown_field_400(mock_run_read_query):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/locations", params={"fields": "id,secret"})
+    assert r.status_code == 400
+    mock_run_read_query.assert_not_called()
@@ -43,3 +43,75 @@ async def test_search_empty_query():
     async with AsyncClient(transport=transport, base_url="http://test") as client:
         r = await client.get("/api/search", params={"q": ""})
     assert r.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_search_uses_fulltext_index_with_filters(mock_run_read_query):
+    mock_run_read_query.return_value = [
+        {"type": "Scene", "id": "s1", "name": "Встреча", "snippet": "", "score": 2.5},
+    ]
+    with patch("app.api.search.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get(
+                "/api/search",
+                params={"q": "встреч", "type": ["scene"], "limit": 10, "offset": 20},
+            )
+    assert r.status_code == 200
+    assert r.json()[0]["score"] == 2.5
+    query, params = mock_run_read_query.call_args[0]
+    assert "db.index.fulltext.queryNodes" in query
+    assert params["types"] == ["Scene"]
+    assert params["limit"] == 10 and params["offset"] == 20
+    assert "встре*" in params["query"]
+
+
+@pytest.mark.asyncio
+async def test_search_falls_back_to_regex_when_index_missing(mock_run_read_query):
+    from neo4j.exceptions import ClientError
+
+    mock_run_read_query.side_effect = [
+        ClientError("There is no such fulltext schema index: entity_fulltext"),
+        [{"type": "Location", "id": "loc-1", "name": "Tavern", "snippet": ""}],
+    ]
+    with patch("app.api.search.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/search", params={"q": "tavern"})
+    assert r.status_code == 200
+    assert r.json()[0]["id"] == "loc-1"
+    assert r.json()[0]["score"] is None
+    assert "=~ $pattern" in mock_run_read_query.call_args_list[1][0][0]
+
+
+@pytest.mark.asyncio
+async def test_search_falls_back_to_regex_when_fulltext_finds_nothing(mock_run_read_query):
+    mock_run_read_query.side_effect = [[], [{"type": "Location", "id": "loc-1", "name": "Замок на холме", "snippet": ""}]]
+    with patch("app.api.search.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/search", params={"q": "Замок на холме"})
+    assert r.status_code == 200
+    assert r.json()[0]["id"] == "loc-1"
+    assert "db.index.fulltext.queryNodes" in mock_run_read_query.call_args_list[0][0][0]
+    assert "=~ $pattern" in mock_run_read_query.call_args_list[1][0][0]
+
+
+@pytest.mark.asyncio
+async def test_search_stopwords_only_uses_regex(mock_run_read_query):
+    mock_run_read_query.return_value = []
+    with patch("app.api.search.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/search", params={"q": "кто где"})
+    assert r.status_code == 200
+    mock_run_read_query.assert_called_once()
+    assert "=~ $pattern" in mock_run_read_query.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_search_unknown_type():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/api/search", params={"q": "x", "type": "planet"})
+    assert r.status_code == 400
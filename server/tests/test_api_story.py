@@ -49,3 +49,18 @@ async def test_update_scene(mock_publish_event):
     assert r.status_code == 202
     assert r.json()["payload"]["id"] == "s1"
     mock_publish_event.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_list_scenes_projection_and_cursor(mock_run_read_query):
+    mock_run_read_query.return_value = [
+        {"id": "s2", "title": "Duel", "description": "", "location_id": "loc-1", "character_ids": ["c1", None]},
+    ]
+    with patch("app.api.story.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.get("/api/story/scenes", params={"after": "s1", "limit": 1, "fields": "id,character_ids"})
+    assert r.status_code == 200
+    assert r.json() == [{"id": "s2", "character_ids": ["c1"]}]
+    assert r.headers["X-Next-Cursor"] == "s2"
+    assert mock_run_read_query.call_args[0][1] == {"after": "s1", "limit": 1}
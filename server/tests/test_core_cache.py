@@ -0,0 +1,130 @@
+"""Tests for core cache (read cache invalidated by graph.changes)."""
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.core.cache import ReadCache, change_tags, make_change_handler, read_cache
+from app.main import app
+
+
+def _active_cache(**kwargs) -> ReadCache:
+    cache = ReadCache(**kwargs)
+    cache.set_active(True)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_hit_after_miss():
+    cache = _active_cache()
+    loader = AsyncMock(return_value=[{"id": "loc-1"}])
+    assert await cache.get_or_load("get", "k", {"Location:loc-1"}, loader) == [{"id": "loc-1"}]
+    assert await cache.get_or_load("get", "k", {"Location:loc-1"}, loader) == [{"id": "loc-1"}]
+    loader.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_inactive_cache_always_loads():
+    cache = ReadCache()
+    loader = AsyncMock(return_value=[])
+    await cache.get_or_load("get", "k", (), loader)
+    await cache.get_or_load("get", "k", (), loader)
+    assert loader.await_count == 2
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_invalidate_changes_drops_node_list_and_search_entries():
+    cache = _active_cache()
+    loader = AsyncMock(return_value=[])
+    await cache.get_or_load("get", ("get", "Location", "loc-1"), {"Location:loc-1"}, loader)
+    await cache.get_or_load("get", ("get", "Location", "loc-2"), {"Location:loc-2"}, loader)
+    await cache.get_or_load("list", ("list", "Location"), {"list:Location"}, loader)
+    await cache.get_or_load("list", ("list", "Scene"), {"list:Scene"}, loader)
+    await cache.get_or_load("search", ("search", "x"), {"search"}, loader)
+    assert cache.invalidate_changes([{"label": "Location", "id": "loc-1"}]) == 3
+    assert len(cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction():
+    cache = _active_cache(max_entries=2)
+    loader = AsyncMock(return_value=[])
+    await cache.get_or_load("get", "a", {"t:a"}, loader)
+    await cache.get_or_load("get", "b", {"t:b"}, loader)
+    await cache.get_or_load("get", "a", {"t:a"}, loader)  # a becomes most recent
+    await cache.get_or_load("get", "c", {"t:c"}, loader)
+    assert loader.await_count == 3
+    await cache.get_or_load("get", "a", {"t:a"}, loader)
+    assert loader.await_count == 3
+    await cache.get_or_load("get", "b", {"t:b"}, loader)
+    assert loader.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_load_racing_with_invalidation_is_not_stored():
+    cache = _active_cache()
+
+    async def loader():
+        cache.invalidate_changes([{"label": "Location", "id": "loc-1"}])
+        return ["old"]
+
+    assert await cache.get_or_load("get", "k", {"Location:loc-1"}, loader) == ["old"]
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_stale_while_revalidate():
+    cache = _active_cache(ttl_sec=10, stale_sec=10)
+    loader = AsyncMock(side_effect=[["v1"], ["v2"]])
+    with patch("app.core.cache.time.monotonic", return_value=100.0):
+        await cache.get_or_load("get", "k", (), loader)
+    with patch("app.core.cache.time.monotonic", return_value=115.0):
+        # Устарело, но в окне stale: отдаём старое и обновляем в фоне
+        assert await cache.get_or_load("get", "k", (), loader) == ["v1"]
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert await cache.get_or_load("get", "k", (), loader) == ["v2"]
+    assert loader.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_expired_without_stale_window_reloads():
+    cache = _active_cache(ttl_sec=10)
+    loader = AsyncMock(side_effect=[["v1"], ["v2"]])
+    with patch("app.core.cache.time.monotonic", return_value=100.0):
+        await cache.get_or_load("get", "k", (), loader)
+    with patch("app.core.cache.time.monotonic", return_value=111.0):
+        assert await cache.get_or_load("get", "k", (), loader) == ["v2"]
+
+
+def test_change_tags():
+    assert change_tags({"label": "Scene", "id": "s1"}) == {"Scene:s1", "list:Scene", "search"}
+
+
+@pytest.mark.asyncio
+async def test_change_handler_invalidates_and_acks():
+    cache = _active_cache()
+    await cache.get_or_load("get", "k", {"Scene:s1"}, AsyncMock(return_value=[]))
+    ch, method = MagicMock(), MagicMock()
+    make_change_handler(cache)(ch, method, None, json.dumps({"changes": [{"label": "Scene", "id": "s1"}]}).encode())
+    assert len(cache) == 0
+    ch.basic_ack.assert_called_once_with(delivery_tag=method.delivery_tag)
+
+
+@pytest.mark.asyncio
+async def test_get_location_served_from_cache_until_change(mock_run_read_query):
+    mock_run_read_query.return_value = [{"id": "loc-1", "name": "Tavern", "description": ""}]
+    read_cache.set_active(True)
+    with patch("app.api.base_resource.run_read_query", mock_run_read_query):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.get("/api/locations/loc-1")
+            r = await client.get("/api/locations/loc-1")
+            assert r.json()["name"] == "Tavern"
+            assert mock_run_read_query.await_count == 1
+            read_cache.invalidate_changes([{"label": "Location", "id": "loc-1"}])
+            await client.get("/api/locations/loc-1")
+    assert mock_run_read_query.await_count == 2
@@ -3,7 +3,7 @@ from unittest.mock import AsyncMock, patch, MagicMock
 
 import pytest
 
-from app.core.graph import run_read_query, run_write_query, close_driver
+from app.core.graph import run_read_query, run_write_query, close_driver, stream_read_query
 
 
 @pytest.mark.asyncio
@@ -46,3 +46,37 @@ async def test_run_write_query():
     with patch("app.core.graph.get_driver", new_callable=AsyncMock, return_value=mock_driver):
         await run_write_query("CREATE (n:Test {id: $id})", {"id": "1"})
     mock_session.run.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_stream_read_query_iterates_cursor():
+    class Record:
+        def __init__(self, data):
+            self._data = data
+
+        def data(self):
+            return self._data
+
+    class Cursor:
+        def __init__(self, rows):
+            self._rows = iter(rows)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return Record(next(self._rows))
+            except StopIteration:
+                raise StopAsyncIteration
+
+    mock_session = MagicMock()
+    mock_session.run = AsyncMock(return_value=Cursor([{"n": 1}, {"n": 2}]))
+    mock_session.__aenter__ = AsyncMock(return_value=mock_session)
+    mock_session.__aexit__ = AsyncMock(return_value=None)
+    mock_driver = MagicMock()
+    mock_driver.session.return_value = mock_session
+    with patch("app.core.graph.get_driver", new_callable=AsyncMock, return_value=mock_driver):
+        rows = [r async for r in stream_read_query("MATCH (n) RETURN n", fetch_size=10)]
+    assert rows == [{"n": 1}, {"n": 2}]
+    mock_driver.session.assert_called_once_with(fetch_size=10)
@@ -0,0 +1,55 @@
+"""Tests for schema migration runner (server)."""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.core.migrations import run_migrations
+from shared.schema import MIGRATIONS
+
+
+def _result(record=None):
+    result = MagicMock()
+    result.single = AsyncMock(return_value=record)
+    result.consume = AsyncMock()
+    return result
+
+
+def _driver_with(session):
+    session.__aenter__ = AsyncMock(return_value=session)
+    session.__aexit__ = AsyncMock(return_value=None)
+    driver = MagicMock()
+    driver.session.return_value = session
+    return driver
+
+
+@pytest.mark.asyncio
+async def test_run_migrations_up_to_date():
+    session = MagicMock()
+    session.run = AsyncMock(return_value=_result({"version": MIGRATIONS[-1].version}))
+    with patch("app.core.migrations.get_driver", new_callable=AsyncMock, return_value=_driver_with(session)):
+        applied = await run_migrations()
+    assert applied == 0
+    session.run.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_migrations_applies_and_backfills_in_batches():
+    backfill_counts = {}
+
+    async def run(query, params=None):
+        if "max(m.version)" in query:
+            return _result({"version": None})
+        if "$batch_size" in query:
+            # первый батч что-то обновил, второй — нет
+            backfill_counts[query] = backfill_counts.get(query, 0) + 1
+            return _result({"updated": 5 if backfill_counts[query] == 1 else 0})
+        return _result()
+
+    session = MagicMock()
+    session.run = AsyncMock(side_effect=run)
+    with patch("app.core.migrations.get_driver", new_callable=AsyncMock, return_value=_driver_with(session)):
+        applied = await run_migrations()
+    assert applied == len(MIGRATIONS)
+    assert all(count == 2 for count in backfill_counts.values())
+    queries = [c.args[0] for c in session.run.call_args_list]
+    assert any("MERGE (m:SchemaMigration" in q for q in queries)
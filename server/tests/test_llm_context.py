@@ -0,0 +1,34 @@
+"""Tests for per-role LLM context (materialised RoleContext documents with on-the-fly fallback)."""
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.services.llm_context import get_llm_context
+
+
+@pytest.mark.asyncio
+async def test_materialised_context_is_one_key_lookup():
+    with patch("app.services.llm_context.run_read_query", AsyncMock(return_value=[{"text": "Персонаж: Иван."}])) as q:
+        assert await get_llm_context(" c1 ") == "Персонаж: Иван."
+    q.assert_awaited_once()
+    assert q.call_args[0][1] == {"role": "c1"}
+
+
+@pytest.mark.asyncio
+async def test_character_without_document_built_in_one_query():
+    character = {"id": "c1", "name": "Иван", "description": "", "scenes": [{"title": "Кузня", "location": None}]}
+    with patch("app.services.llm_context.run_read_query", AsyncMock(side_effect=[[], [character]])) as q:
+        assert await get_llm_context("c1") == "Персонаж: Иван. Участвует в сценах: Кузня"
+    assert q.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_narrator_fallback_and_empty_world():
+    with patch("app.services.llm_context.run_read_query", AsyncMock(side_effect=[[], []])):
+        assert await get_llm_context(None) == "Мир пока пуст (нет локаций, персонажей и понятий в графе)."
+
+
+@pytest.mark.asyncio
+async def test_unknown_character():
+    with patch("app.services.llm_context.run_read_query", AsyncMock(side_effect=[[], []])):
+        assert await get_llm_context("nope") == "Персонаж с id 'nope' не найден в графе."
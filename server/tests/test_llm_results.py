@@ -0,0 +1,232 @@
+"""Tests for LLM results store and llm.results delivery (memory / fanout)."""
+import json
+import os
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+
+import pika
+import pytest
+
+from app.llm_results import (
+    EXCHANGE_LLM_RESULTS,
+    InFlightTasks,
+    InMemoryResultStore,
+    ResultStore,
+    declare_results_queue,
+    make_message_handler,
+    start_llm_results_consumer,
+)
+
+
+def test_store_set_get():
+    store = InMemoryResultStore()
+    store.set("rid-1", {"status": "done", "answer": "42"})
+    assert store.get("rid-1") == {"status": "done", "answer": "42"}
+    assert store.get("missing") is None
+
+
+def test_store_expires_entries():
+    store = InMemoryResultStore(ttl_sec=10)
+    with patch("app.llm_results.time.monotonic", return_value=100.0):
+        store.set("old", {"status": "done"})
+    with patch("app.llm_results.time.monotonic", return_value=105.0):
+        store.set("new", {"status": "done"})
+    with patch("app.llm_results.time.monotonic", return_value=112.0):
+        assert store.get("old") is None
+        assert store.get("new") == {"status": "done"}
+    assert len(store) == 1
+
+
+def test_store_memory_cap_evicts_oldest():
+    store = InMemoryResultStore(max_entries=2)
+    store.set("a", {})
+    store.set("b", {})
+    store.set("c", {})
+    assert store.get("a") is None
+    assert store.get("b") == {}
+    assert store.get("c") == {}
+
+
+def test_store_overwrite_refreshes_position():
+    store = InMemoryResultStore(max_entries=2)
+    store.set("a", {"v": 1})
+    store.set("b", {})
+    store.set("a", {"v": 2})
+    store.set("c", {})
+    assert store.get("a") == {"v": 2}
+    assert store.get("b") is None
+
+
+def test_message_handler_acks_and_stores():
+    store = InMemoryResultStore()
+    channel = MagicMock()
+    method = MagicMock(delivery_tag=7)
+    make_message_handler(store)(channel, method, None, json.dumps({"request_id": "r", "status": "done"}))
+    assert store.get("r")["status"] == "done"
+    channel.basic_ack.assert_called_once_with(delivery_tag=7)
+
+
+def test_message_handler_nacks_invalid_json():
+    channel = MagicMock()
+    method = MagicMock(delivery_tag=3)
+    make_message_handler(InMemoryResultStore())(channel, method, None, b"not json")
+    channel.basic_nack.assert_called_once_with(delivery_tag=3, requeue=False)
+
+
+def test_in_flight_second_identical_task_joins_leader():
+    tasks = InFlightTasks()
+    assert tasks.join(("knowledge", "q"), "r1") is None
+    assert tasks.join(("knowledge", "q"), "r2") == "r1"
+    assert tasks.join(("knowledge", "other"), "r3") is None
+    assert tasks.finish("r1") == ["r2"]
+    # После завершения тот же ключ начинает новую задачу
+    assert tasks.join(("knowledge", "q"), "r4") is None
+
+
+def test_in_flight_expired_leader_is_replaced():
+    tasks = InFlightTasks(ttl_sec=10)
+    with patch("app.llm_results.time.monotonic", return_value=100.0):
+        tasks.join("k", "r1")
+    with patch("app.llm_results.time.monotonic", return_value=111.0):
+        assert tasks.join("k", "r2") is None
+    assert tasks.finish("r1") == []
+    assert tasks.finish("r2") == []
+    assert len(tasks) == 0
+
+
+def test_in_flight_purges_lost_leaders_and_fails_their_followers():
+    expired = []
+    tasks = InFlightTasks(ttl_sec=10, on_expired=expired.extend)
+    with patch("app.llm_results.time.monotonic", return_value=100.0):
+        tasks.join("lost", "r1")
+        tasks.join("lost", "r2")
+    # Другой ключ: потерянный лидер всё равно удаляется, его последователи получают ошибку
+    with patch("app.llm_results.time.monotonic", return_value=111.0):
+        assert tasks.join("other", "r3") is None
+    assert expired == ["r2"]
+    assert len(tasks) == 1
+    assert tasks.finish("r1") == []
+
+
+def test_in_flight_expired_followers_get_error_result():
+    from app import llm_results
+
+    with patch.object(llm_results, "_store", InMemoryResultStore()):
+        llm_results._fail_expired(["r2"])
+        assert llm_results.get_result("r2")["status"] == "error"
+
+
+def test_in_flight_is_bounded():
+    tasks = InFlightTasks(max_entries=1)
+    assert tasks.join("a", "r1") is None
+    assert tasks.join("b", "r2") is None  # не отслеживается: публикуется без объединения
+    assert tasks.join("b", "r3") is None
+    assert tasks.join("a", "r4") == "r1"
+    assert len(tasks) == 1
+    assert tasks.finish("r2") == []
+
+
+def test_message_handler_fans_final_result_out_to_attached_requests():
+    store, tasks = InMemoryResultStore(), InFlightTasks()
+    tasks.join("k", "r1")
+    tasks.join("k", "r2")
+    tasks.join("k", "r3")
+    result = {"request_id": "r1", "status": "done", "type": "knowledge", "answer": "A"}
+    make_message_handler(store, tasks)(MagicMock(), MagicMock(), None, json.dumps(result))
+    assert store.get("r2") == {**result, "request_id": "r2"}
+    assert store.get("r3")["answer"] == "A"
+    assert len(tasks) == 0
+
+
+def test_message_handler_partial_results():
+    store, tasks = InMemoryResultStore(), InFlightTasks()
+    tasks.join("k", "r1")
+    tasks.join("k", "r2")
+    handler = make_message_handler(store, tasks)
+    partial = {"request_id": "r1", "status": "partial", "type": "knowledge", "answer": "Куз"}
+    handler(MagicMock(), MagicMock(), None, json.dumps(partial))
+    # Промежуточный результат тоже уходит присоединённым запросам, но задача ещё в работе
+    assert store.get("r2")["answer"] == "Куз"
+    assert len(tasks) == 1
+    handler(MagicMock(), MagicMock(), None, json.dumps({**partial, "status": "done", "answer": "Кузнец"}))
+    # Запоздавший partial не затирает финальный ответ
+    channel = MagicMock()
+    handler(channel, MagicMock(delivery_tag=9), None, json.dumps(partial))
+    assert store.get("r1")["status"] == "done"
+    assert store.get("r2")["answer"] == "Кузнец"
+    channel.basic_ack.assert_called_once_with(delivery_tag=9)
+
+
+def test_generate_partials_accumulate_chunk_items_in_index_order():
+    store, tasks = InMemoryResultStore(), InFlightTasks()
+    handler = make_message_handler(store, tasks)
+    partial = {"request_id": "g1", "status": "partial", "type": "generate", "count": 6}
+    # Части приходят в порядке готовности, каждая несёт только свои сущности
+    handler(MagicMock(), MagicMock(), None, json.dumps({**partial, "items": [{"name": "C"}, {"name": "D"}], "indices": [2, 3]}))
+    handler(MagicMock(), MagicMock(), None, json.dumps({**partial, "items": [{"name": "A"}], "indices": [0]}))
+    stored = store.get("g1")
+    assert stored["indices"] == [0, 2, 3]
+    assert [i["name"] for i in stored["items"]] == ["A", "C", "D"]
+
+
+def test_fanout_delivers_result_to_every_replica():
+    """Each replica's handler sees the same message, so any pod can serve GET /result."""
+    replicas = [InMemoryResultStore() for _ in range(3)]
+    handlers = [make_message_handler(store) for store in replicas]
+    body = json.dumps({"request_id": "rid-x", "status": "done", "type": "knowledge", "answer": "ok"})
+    for handler in handlers:
+        handler(MagicMock(), MagicMock(delivery_tag=1), None, body)
+    assert all(store.get("rid-x")["answer"] == "ok" for store in replicas)
+
+
+def test_declare_results_queue_fanout_uses_named_replica_queue():
+    """The queue outlives a reconnect (not exclusive/auto-delete) and expires once the replica is gone."""
+    channel = MagicMock()
+    with patch("app.llm_results.settings.llm_results_queue_ttl_sec", 300.0):
+        queue = declare_results_queue(channel, "fanout", replica="pod-1")
+    assert queue == "llm.results.pod-1"
+    channel.exchange_declare.assert_called_once_with(exchange=EXCHANGE_LLM_RESULTS, exchange_type="fanout", durable=True)
+    channel.queue_declare.assert_called_once_with(queue="llm.results.pod-1", arguments={"x-expires": 300000})
+    channel.queue_bind.assert_called_once_with(queue="llm.results.pod-1", exchange=EXCHANGE_LLM_RESULTS)
+
+
+def test_result_store_is_abstract():
+    class Incomplete(ResultStore):
+        def set(self, request_id, data):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_declare_results_queue_memory_uses_shared_queue():
+    channel = MagicMock()
+    queue = declare_results_queue(channel, "memory")
+    assert queue == "llm.results"
+    channel.queue_declare.assert_called_once_with(queue="llm.results", durable=True)
+
+
+@pytest.mark.skipif(not os.getenv("WINM_TEST_RABBITMQ_URL"), reason="WINM_TEST_RABBITMQ_URL not set")
+def test_replicas_against_local_broker():
+    """Several replicas consume from a real broker; every one receives the result."""
+    url = os.environ["WINM_TEST_RABBITMQ_URL"]
+    replicas = [InMemoryResultStore() for _ in range(3)]
+    with patch("app.llm_results.settings.llm_results_backend", "fanout"):
+        for i, store in enumerate(replicas):
+            start_llm_results_consumer(store=store, url=url, replica=f"test-{i}-{uuid.uuid4()}")
+        time.sleep(1.0)
+    request_id = str(uuid.uuid4())
+    connection = pika.BlockingConnection(pika.URLParameters(url))
+    channel = connection.channel()
+    channel.exchange_declare(exchange=EXCHANGE_LLM_RESULTS, exchange_type="fanout", durable=True)
+    channel.basic_publish(
+        exchange=EXCHANGE_LLM_RESULTS,
+        routing_key="",
+        body=json.dumps({"request_id": request_id, "status": "done", "type": "knowledge", "answer": "ok"}),
+    )
+    connection.close()
+    deadline = time.time() + 10
+    while time.time() < deadline and not all(store.get(request_id) for store in replicas):
+        time.sleep(0.1)
+    assert all(store.get(request_id) for store in replicas)
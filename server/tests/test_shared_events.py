@@ -1,5 +1,5 @@
 """Tests for shared events."""
-from shared.events import EventType, build_event
+from shared.events import EventType, build_event, expand_events
 
 
 def test_event_type_values():
@@ -11,3 +11,22 @@ def test_build_event():
     ev = build_event(EventType.CHARACTER_CREATE, {"name": "Alice"})
     assert ev["type"] == "character.create"
     assert ev["payload"]["name"] == "Alice"
+
+
+def test_expand_batch_event():
+    inner = [build_event(EventType.LOCATION_CREATE, {"id": "l1"}), build_event(EventType.SCENE_CREATE, {"id": "s1"})]
+    ev = build_event(EventType.BATCH, {"events": inner})
+    events = expand_events([(ev["type"], ev["payload"]), ("concept.create", {"id": "c1"})])
+    assert events == [("location.create", {"id": "l1"}), ("scene.create", {"id": "s1"}), ("concept.create", {"id": "c1"})]
+
+
+def test_build_change_notification_expands_and_dedupes():
+    from shared.changes import build_change_notification
+
+    batch = build_event(EventType.BATCH, {"events": [build_event(EventType.SCENE_CREATE, {"id": "s1"})]})
+    notification = build_change_notification([
+        ("location.create", {"id": "l1"}),
+        ("location.update", {"id": "l1"}),
+        (batch["type"], batch["payload"]),
+    ])
+    assert notification == {"changes": [{"label": "Location", "id": "l1"}, {"label": "Scene", "id": "s1"}]}
@@ -0,0 +1,24 @@
+"""Tests for shared schema migrations."""
+from shared.schema import MIGRATIONS, pending_migrations
+
+
+def test_versions_are_unique_and_increasing():
+    versions = [m.version for m in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_pending_migrations_from_empty_db():
+    assert [m.version for m in pending_migrations(None)] == [m.version for m in MIGRATIONS]
+
+
+def test_pending_migrations_up_to_date():
+    assert pending_migrations(MIGRATIONS[-1].version) == []
+
+
+def test_first_migration_creates_constraints_and_norm_indexes():
+    statements = " ".join(MIGRATIONS[0].statements)
+    for label in ("Location", "Character", "Concept", "Scene"):
+        assert f"FOR (n:{label}) REQUIRE n.id IS UNIQUE" in statements
+    assert "ON (n.name_norm)" in statements
+    assert "ON (n.title_norm)" in statements
+    assert all("$batch_size" in backfill for backfill in MIGRATIONS[0].backfills)
@@ -0,0 +1,49 @@
+"""Tests for shared search query builders."""
+import re
+
+import pytest
+
+from shared.search import build_fulltext_any_query, build_fulltext_query, build_regex_pattern, normalize_types
+
+
+def test_fulltext_query_prefix_and_fuzzy():
+    """Prefix terms are not analysed: the prefix is cut to reach the indexed stem of inflected forms."""
+    assert build_fulltext_query("Таверна") == "(таверна^3 OR таверн* OR таверна~1)"
+    assert build_fulltext_query("дом") == "(дом^3 OR дом*)"
+
+
+def test_fulltext_query_drops_stopwords_and_short_words():
+    """The russian analyzer never indexes stopwords: an AND clause for one would match nothing."""
+    assert build_fulltext_query("Замок на холме") == (
+        "(замок^3 OR замо* OR замок~1) AND (холме^3 OR холм* OR холме~1)"
+    )
+    assert build_fulltext_query("кто такой Иван") == "(иван^3 OR иван* OR иван~1)"
+    assert build_fulltext_query("ab c") is None
+    assert build_fulltext_query("и в на") is None
+
+
+def test_fulltext_query_strips_lucene_syntax():
+    query = build_fulltext_query('name:"x" OR (y)~ -z')
+    assert ":" not in query and '"' not in query and "-" not in query
+
+
+def test_fulltext_query_empty():
+    assert build_fulltext_query("  ?! ") is None
+
+
+def test_fulltext_any_query_or_of_words():
+    assert build_fulltext_any_query("Где живёт Иван, где?") == "живёт^3 OR живёт~1 OR иван^3 OR иван~1"
+    assert build_fulltext_any_query("a, b!") is None
+
+
+def test_regex_pattern_escapes_and_joins_words():
+    pattern = build_regex_pattern("Old  Tav.ern")
+    assert re.fullmatch(pattern, "the old tav.ern inn")
+    assert not re.fullmatch(pattern, "the old tavXern inn")
+
+
+def test_normalize_types():
+    assert normalize_types(["location", "SCENE"]) == ["Location", "Scene"]
+    assert normalize_types(None) is None
+    with pytest.raises(ValueError):
+        normalize_types(["planet"])
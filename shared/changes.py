@@ -0,0 +1,52 @@
+"""Graph-change notifications: consumer -> server, published after every committed graph write.
+
+Message (fanout exchange ``graph.changes``):
+{"changes": [{"label": "Location", "id": "..."}, ...], "graph_version": 42}.
+The server uses them to invalidate its read cache.
+
+Graph version: a counter on the single (:GraphVersion {id: "graph"}) node, incremented by the
+consumer in the same transaction as every graph write. It only grows, so anything keyed by it
+(the server's LLM answer cache) is naturally invalidated by any write.
+"""
+from typing import Any
+
+from shared.events import EventType, expand_events
+
+EXCHANGE_GRAPH_CHANGES = "graph.changes"
+
+GRAPH_VERSION_ID = "graph"
+BUMP_GRAPH_VERSION_QUERY = (
+    "MERGE (v:GraphVersion {id: $id}) "
+    "SET v.version = coalesce(v.version, 0) + 1 "
+    "RETURN v.version AS version"
+)
+READ_GRAPH_VERSION_QUERY = "MATCH (v:GraphVersion {id: $id}) RETURN v.version AS version"
+
+EVENT_LABELS = {
+    EventType.LOCATION_CREATE.value: "Location",
+    EventType.LOCATION_UPDATE.value: "Location",
+    EventType.CHARACTER_CREATE.value: "Character",
+    EventType.CHARACTER_UPDATE.value: "Character",
+    EventType.SCENE_CREATE.value: "Scene",
+    EventType.SCENE_UPDATE.value: "Scene",
+    EventType.CONCEPT_CREATE.value: "Concept",
+    EventType.CONCEPT_UPDATE.value: "Concept",
+}
+
+
+def build_change_notification(
+    events: list[tuple[str, dict[str, Any]]], graph_version: int | None = None
+) -> dict[str, Any]:
+    """Changed nodes (label, id) for written events; BATCH events are expanded, repeats dropped."""
+    changes = []
+    seen = set()
+    for event_type, payload in expand_events(events):
+        label = EVENT_LABELS.get(event_type)
+        key = (label, payload.get("id"))
+        if label and key not in seen:
+            seen.add(key)
+            changes.append({"label": label, "id": payload.get("id")})
+    notification: dict[str, Any] = {"changes": changes}
+    if graph_version is not None:
+        notification["graph_version"] = graph_version
+    return notification
@@ -13,8 +13,21 @@ class EventType(str, Enum):
     SCENE_UPDATE = "scene.update"
     CONCEPT_CREATE = "concept.create"
     CONCEPT_UPDATE = "concept.update"
+    # Many events in one message: payload = {"events": [{"type": ..., "payload": ...}, ...]}
+    BATCH = "batch"
 
 
 def build_event(event_type: EventType, payload: dict[str, Any]) -> dict[str, Any]:
     """Build event dict for broker."""
     return {"type": event_type.value, "payload": payload}
+
+
+def expand_events(events: list[tuple[str, dict[str, Any]]]) -> list[tuple[str, dict[str, Any]]]:
+    """Flatten BATCH events into their (type, payload) items, keeping order."""
+    result = []
+    for event_type, payload in events:
+        if event_type == EventType.BATCH.value:
+            result.extend((e["type"], e.get("payload", {})) for e in payload.get("events", []))
+        else:
+            result.append((event_type, payload))
+    return result
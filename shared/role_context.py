@@ -0,0 +1,93 @@
+"""Per-role LLM context documents, shared by server (get_llm_context) and consumer (materialisation).
+
+A role is a character id or ``narrator``. The consumer keeps one (:RoleContext {role, text}) node per
+role, refreshed in the same transaction as the writes that change it (unique role, schema
+migration 4), so reading a role's context is a single key lookup. The build queries and the text
+format live here so that a document built on the fly is identical to a materialised one.
+"""
+NARRATOR_ROLE = "narrator"
+CONTEXT_SCENES_LIMIT = 10
+NARRATOR_NAMES_LIMIT = 15
+
+READ_ROLE_CONTEXT_QUERY = "MATCH (r:RoleContext {role: $role}) RETURN r.text AS text"
+
+WRITE_ROLE_CONTEXTS_QUERY = """
+UNWIND $rows AS row
+MERGE (r:RoleContext {role: row.role})
+SET r.text = row.text, r.updated_at = timestamp()
+"""
+
+# Characters by id with the scenes they appear in (and each scene's location)
+CHARACTER_CONTEXT_QUERY = """
+UNWIND $ids AS id
+MATCH (c:Character {id: id})
+OPTIONAL MATCH (c)<-[:FEATURES]-(s:Scene)
+OPTIONAL MATCH (s)-[:TAKES_PLACE_IN]->(l:Location)
+WITH c, collect(CASE WHEN s IS NULL THEN null ELSE {title: s.title, location: l.name} END)[..$scenes] AS scenes
+RETURN c.id AS id, c.name AS name, c.description AS description, scenes
+"""
+
+# Counts come from the label count store; names are read from the first $names nodes of each label
+NARRATOR_CONTEXT_QUERY = """
+CALL { MATCH (n:Location) RETURN count(n) AS location_count }
+CALL { MATCH (n:Character) RETURN count(n) AS character_count }
+CALL { MATCH (n:Concept) RETURN count(n) AS concept_count }
+CALL { MATCH (n:Location) WITH n LIMIT $names RETURN collect(COALESCE(n.name, n.id)) AS locations }
+CALL { MATCH (n:Character) WITH n LIMIT $names RETURN collect(COALESCE(n.name, n.id)) AS characters }
+CALL { MATCH (n:Concept) WITH n LIMIT $names RETURN collect(COALESCE(n.name, n.id)) AS concepts }
+RETURN location_count, character_count, concept_count, locations, characters, concepts
+"""
+
+
+def is_narrator(role: str | None) -> bool:
+    return not (role or "").strip() or role.strip().lower() == NARRATOR_ROLE
+
+
+def role_key(role: str | None) -> str:
+    """RoleContext.role: narrator for an empty role, otherwise the character id."""
+    return NARRATOR_ROLE if is_narrator(role) else role.strip()
+
+
+def character_context_params(ids: list[str]) -> dict:
+    return {"ids": ids, "scenes": CONTEXT_SCENES_LIMIT}
+
+
+def narrator_context_params() -> dict:
+    return {"names": NARRATOR_NAMES_LIMIT}
+
+
+def format_character_context(record: dict) -> str:
+    """Character profile and the scenes/locations they appear in."""
+    name = record.get("name") or record.get("id")
+    desc = record.get("description") or ""
+    lines = [f"Персонаж: {name}.", desc] if desc else [f"Персонаж: {name}."]
+    scenes = record.get("scenes") or []
+    if scenes:
+        scene_parts = []
+        for s in scenes:
+            title = s.get("title") or "Сцена"
+            loc = s.get("location")
+            scene_parts.append(f"{title}" + (f" (локация: {loc})" if loc else ""))
+        lines.append("Участвует в сценах: " + "; ".join(scene_parts))
+    return " ".join(lines)
+
+
+def format_narrator_context(record: dict | None) -> str:
+    """World overview: names of locations, characters, concepts."""
+    parts = []
+    for label, names_key, count_key in (
+        ("Location", "locations", "location_count"),
+        ("Character", "characters", "character_count"),
+        ("Concept", "concepts", "concept_count"),
+    ):
+        names = (record or {}).get(names_key) or []
+        if names:
+            more = " ..." if (record.get(count_key) or 0) > len(names) else ""
+            parts.append(f"{label}: {', '.join(names)}{more}")
+    if not parts:
+        return "Мир пока пуст (нет локаций, персонажей и понятий в графе)."
+    return "Контекст мира (граф): " + "; ".join(parts)
+
+
+def missing_character_context(character_id: str) -> str:
+    return f"Персонаж с id '{character_id}' не найден в графе."
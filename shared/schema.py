@@ -0,0 +1,101 @@
+"""Versioned Neo4j schema migrations, shared by server and consumer (both run them at startup).
+
+Applied versions are recorded as (:SchemaMigration {version}) nodes. Every statement is
+idempotent (IF NOT EXISTS / batched backfill of missing properties), so several processes
+starting at the same time may run the same migration safely.
+"""
+from dataclasses import dataclass
+
+from shared.search import FULLTEXT_INDEX, SEARCH_LABELS
+
+NAME_LABELS = ("Location", "Character", "Concept")
+SCENE_LABEL = "Scene"
+
+CURRENT_VERSION_QUERY = "MATCH (m:SchemaMigration) RETURN max(m.version) AS version"
+RECORD_VERSION_QUERY = (
+    "MERGE (m:SchemaMigration {version: $version}) "
+    "SET m.description = $description, m.applied_at = datetime()"
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    One schema version.
+    statements: schema DDL, each run in its own auto-commit transaction.
+    backfills: data updates run repeatedly with $batch_size until they RETURN updated = 0.
+    """
+    version: int
+    description: str
+    statements: tuple[str, ...] = ()
+    backfills: tuple[str, ...] = ()
+
+
+def _id_constraint(label: str) -> str:
+    return (
+        f"CREATE CONSTRAINT {label.lower()}_id_unique IF NOT EXISTS "
+        f"FOR (n:{label}) REQUIRE n.id IS UNIQUE"
+    )
+
+
+def _norm_index(label: str, prop: str) -> str:
+    return f"CREATE INDEX {label.lower()}_{prop} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})"
+
+
+def _norm_backfill(label: str, source: str, prop: str) -> str:
+    return (
+        f"MATCH (n:{label}) WHERE n.{source} IS NOT NULL AND n.{prop} IS NULL "
+        f"WITH n LIMIT $batch_size "
+        f"SET n.{prop} = toLower(trim(n.{source})) "
+        f"RETURN count(n) AS updated"
+    )
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(
+        version=1,
+        description="id uniqueness constraints; name_norm / title_norm indexes with backfill",
+        statements=(
+            *(_id_constraint(label) for label in (*NAME_LABELS, SCENE_LABEL)),
+            *(_norm_index(label, "name_norm") for label in NAME_LABELS),
+            _norm_index(SCENE_LABEL, "title_norm"),
+        ),
+        backfills=(
+            *(_norm_backfill(label, "name", "name_norm") for label in NAME_LABELS),
+            _norm_backfill(SCENE_LABEL, "title", "title_norm"),
+        ),
+    ),
+    Migration(
+        version=2,
+        description="full-text index for search (name, title, description; russian analyzer)",
+        statements=(
+            f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX} IF NOT EXISTS "
+            f"FOR (n:{'|'.join(SEARCH_LABELS)}) ON EACH [n.name, n.title, n.description] "
+            "OPTIONS {indexConfig: {`fulltext.analyzer`: 'russian'}}",
+        ),
+    ),
+    Migration(
+        version=3,
+        description="graph version counter; LLM answer cache nodes (unique key, expiry index)",
+        statements=(
+            _id_constraint("GraphVersion"),
+            "CREATE CONSTRAINT answercache_key_unique IF NOT EXISTS "
+            "FOR (n:AnswerCache) REQUIRE n.key IS UNIQUE",
+            _norm_index("AnswerCache", "expires_at"),
+        ),
+    ),
+    Migration(
+        version=4,
+        description="materialised per-role LLM context documents (unique role)",
+        statements=(
+            "CREATE CONSTRAINT rolecontext_role_unique IF NOT EXISTS "
+            "FOR (n:RoleContext) REQUIRE n.role IS UNIQUE",
+        ),
+    ),
+)
+
+
+def pending_migrations(current_version: int | None) -> list[Migration]:
+    """Migrations newer than current_version, in order."""
+    current = current_version or 0
+    return sorted((m for m in MIGRATIONS if m.version > current), key=lambda m: m.version)
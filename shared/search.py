@@ -0,0 +1,124 @@
+"""Graph search queries shared by server (GET /api/search) and consumer (LLM search rounds).
+
+Primary path: Lucene full-text index ``entity_fulltext`` (created by schema migration 2) with
+relevance scoring, prefix and fuzzy matching. Fallback: the regex scan over every node, used when
+the index is missing, the query has no indexable words or full-text finds nothing.
+
+The index uses the ``russian`` analyzer: stopwords are not indexed and words are stemmed. A query
+clause for a stopword can never match, so stopwords and 1-2 letter words are dropped before the
+words are ANDed. Prefix and fuzzy terms bypass the analyzer, so the prefix is taken from a crude
+stem (last letter cut) to reach the indexed stem of inflected forms ("таверне" -> "таверн*").
+"""
+import re
+
+FULLTEXT_INDEX = "entity_fulltext"
+SEARCH_LABELS = ("Location", "Character", "Scene", "Concept")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_MIN_WORD_LEN = 3
+_MIN_STEM_LEN = 5
+_MIN_FUZZY_LEN = 4
+
+# Stopwords of the Lucene russian analyzer (Snowball list): never indexed, so never matched
+RUSSIAN_STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот
+от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь
+опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам
+чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь
+этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой
+хоть после над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо
+свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно всю между
+""".split())
+
+FULLTEXT_SEARCH_QUERY = """
+    CALL db.index.fulltext.queryNodes($index, $query) YIELD node, score
+    WHERE $types IS NULL OR any(label IN labels(node) WHERE label IN $types)
+    RETURN labels(node)[0] AS type, node.id AS id,
+           COALESCE(node.name, node.title, '') AS name,
+           COALESCE(node.description, node.title, '') AS snippet,
+           score
+    ORDER BY score DESC
+    SKIP $offset LIMIT $limit
+"""
+
+REGEX_SEARCH_QUERY = """
+    MATCH (n)
+    WHERE (n:Location OR n:Character OR n:Scene OR n:Concept)
+    AND ($types IS NULL OR any(label IN labels(n) WHERE label IN $types))
+    AND (
+        (n.name IS NOT NULL AND toLower(trim(n.name)) =~ $pattern)
+        OR (n.title IS NOT NULL AND toLower(trim(n.title)) =~ $pattern)
+        OR (n.description IS NOT NULL AND toLower(trim(n.description)) =~ $pattern)
+    )
+    RETURN labels(n)[0] AS type, n.id AS id,
+           COALESCE(n.name, n.title, '') AS name,
+           COALESCE(n.description, n.title, '') AS snippet
+    SKIP $offset LIMIT $limit
+"""
+
+
+def indexable_words(q: str) -> list[str]:
+    """Lower-cased words of q that the index can match: no stopwords, at least 3 letters, no repeats."""
+    return [
+        word for word in dict.fromkeys(_WORD_RE.findall((q or "").lower()))
+        if len(word) >= _MIN_WORD_LEN and word not in RUSSIAN_STOPWORDS
+    ]
+
+
+def build_fulltext_query(q: str) -> str | None:
+    """
+    Lucene query: every indexable word must match exactly (boosted), by prefix of its stem or fuzzily.
+    Only \\w characters survive tokenisation, so no Lucene syntax from user input reaches the index.
+    Returns None if q has no indexable words (the caller uses the regex scan).
+    """
+    clauses = []
+    for word in indexable_words(q):
+        stem = word[:-1] if len(word) >= _MIN_STEM_LEN else word
+        variants = [f"{word}^3", f"{stem}*"]
+        if len(word) >= _MIN_FUZZY_LEN:
+            variants.append(f"{word}~1")
+        clauses.append("(" + " OR ".join(variants) + ")")
+    return " AND ".join(clauses) if clauses else None
+
+
+def build_fulltext_any_query(q: str) -> str | None:
+    """
+    Lucene query for matching a whole question against entity names: any indexable word may match,
+    exactly (boosted) or fuzzily. None if nothing is left.
+    """
+    clauses = []
+    for word in indexable_words(q):
+        clauses.append(f"{word}^3 OR {word}~1" if len(word) >= _MIN_FUZZY_LEN else f"{word}^3")
+    return " OR ".join(clauses) if clauses else None
+
+
+def build_regex_pattern(q: str) -> str:
+    """Regex for the fallback scan: words in order, anything in between."""
+    words = (q or "").strip().lower().split()
+    return ".*" + ".*".join(re.escape(w) for w in words) + ".*" if words else ".*"
+
+
+def normalize_types(types: list[str] | None) -> list[str] | None:
+    """Map type filters ('location', 'Scene', ...) to labels. Raises ValueError for unknown types."""
+    if not types:
+        return None
+    labels = {label.lower(): label for label in SEARCH_LABELS}
+    result = []
+    for t in types:
+        label = labels.get(t.strip().lower())
+        if label is None:
+            raise ValueError(f"Unknown type: {t}")
+        result.append(label)
+    return result
+
+
+def search_params(q: str, types: list[str] | None, limit: int, offset: int) -> dict:
+    """Parameters for both FULLTEXT_SEARCH_QUERY and REGEX_SEARCH_QUERY."""
+    return {
+        "index": FULLTEXT_INDEX,
+        "query": build_fulltext_query(q),
+        "pattern": build_regex_pattern(q),
+        "types": types,
+        "limit": limit,
+        "offset": offset,
+    }